@@ -0,0 +1,95 @@
+"""
+Compares the loading speed of the different versions of the measurement loaders.
+
+Run it from the root of the repository:
+    python -m benchmarks.benchmark_loading
+"""
+import os
+import glob
+import time
+
+import numpy as np
+
+from pawlabeling.functions import io
+from pawlabeling.tests.functions import fixtures
+
+root_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pawlabeling")
+
+
+def time_function(function, repeat, *args, **kwargs):
+    """
+    Returns the result and the fastest time out of repeat runs
+    """
+    timings = []
+    result = None
+    for _ in xrange(repeat):
+        start_time = time.time()
+        result = function(*args, **kwargs)
+        timings.append(time.time() - start_time)
+    return result, min(timings)
+
+
+def rsscan_file_paths():
+    file_paths = glob.glob(os.path.join(root_folder, "samples", "Measurements", "*", "*.zip"))
+    file_paths.append(os.path.join(root_folder, "tests", "functions", "files", "rsscan_export.zip"))
+    return sorted(file_paths)
+
+
+def benchmark_rsscan(repeat=1):
+    print("{:<60} {:>7} {:>10} {:>10} {:>8} {:>6}".format("File", "Frames", "loadtxt", "fromstring",
+                                                          "Speed up", "Equal"))
+    total_old, total_new = 0., 0.
+    for file_path in rsscan_file_paths():
+        input_file = io.open_zip_file(file_path)
+        # Skip anything that doesn't look like an RSscan export (like the Zebris files)
+        if len(io.find_rsscan_headers(input_file)) < 2:
+            continue
+
+        old_data, old_time = time_function(io.load_rsscan, repeat, input_file, version="loadtxt")
+        new_data, new_time = time_function(io.load_rsscan, repeat, input_file, version="fromstring")
+        total_old += old_time
+        total_new += new_time
+
+        file_name = os.path.basename(file_path)[:60]
+        print("{:<60} {:>7} {:>9.3f}s {:>9.3f}s {:>7.1f}x {:>6}".format(file_name, new_data.shape[2],
+                                                                      old_time, new_time, old_time / new_time,
+                                                                      str(np.array_equal(old_data, new_data))))
+
+    if total_new:
+        print("Total: loadtxt {:.2f}s, fromstring {:.2f}s, {:.1f}x faster".format(total_old, total_new,
+                                                                                  total_old / total_new))
+
+
+def benchmark_zebris(repeat=1):
+    print("{:<60} {:>7} {:>10} {:>10} {:>10}".format("File", "Frames", "Time", "Text", "Array"))
+    for file_path in glob.glob(os.path.join(root_folder, "samples", "Measurements", "Zebris", "*.zip")):
+        input_file = io.open_zip_file(file_path)
+        data, duration = time_function(io.load_zebris, repeat, input_file)
+
+        file_name = os.path.basename(file_path)[:60]
+        print("{:<60} {:>7} {:>9.3f}s {:>8.1f}MB {:>8.1f}MB".format(file_name, data.shape[2], duration,
+                                                                   len(input_file) / 1e6, data.nbytes / 1e6))
+
+
+def benchmark_tekscan(repeat=3):
+    """
+    There are no Tekscan samples, so we use synthetic exports of increasing size
+    """
+    print("{:<20} {:>7} {:>10} {:>10} {:>10} {:>6}".format("Size", "MB", "python", "pandas",
+                                                           "MB/s", "Equal"))
+    for rows, columns, frames in [(44, 52, 100), (44, 52, 500), (64, 128, 1000)]:
+        input_file, _ = fixtures.create_tekscan_export(rows, columns, frames)
+        megabytes = len(input_file) / 1e6
+        old_data, old_time = time_function(io.load_tekscan, repeat, input_file, version="python")
+        new_data, new_time = time_function(io.load_tekscan, repeat, input_file, version="pandas")
+
+        size = "{}x{}x{}".format(rows, columns, frames)
+        print("{:<20} {:>7.1f} {:>9.3f}s {:>9.3f}s {:>10.1f} {:>6}".format(size, megabytes, old_time, new_time,
+                                                                         megabytes / new_time,
+                                                                         str(np.array_equal(old_data, new_data))))
+
+
+if __name__ == "__main__":
+    benchmark_rsscan()
+    benchmark_zebris()
+    benchmark_tekscan()
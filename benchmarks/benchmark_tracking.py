@@ -0,0 +1,270 @@
+"""
+Compares the speed of the tracking engines and how often they agree on the contacts they find.
+
+Run it from the root of the repository:
+    python -m benchmarks.benchmark_tracking
+"""
+import os
+import copy
+import glob
+
+import cv2
+import numpy as np
+
+from pawlabeling.functions import io, tracking, utility
+from benchmarks.benchmark_loading import root_folder, time_function
+
+
+def measurement_file_paths():
+    return sorted(glob.glob(os.path.join(root_folder, "samples", "Measurements", "*", "*.zip")))
+
+
+def pad(measurement_data, padding_factor=1):
+    # The same padding contactmodel.track_contacts adds
+    x, y, z = measurement_data.shape
+    data = np.zeros((x + 2 * padding_factor, y + 2 * padding_factor, z), np.float32)
+    data[padding_factor:-padding_factor, padding_factor:-padding_factor, :] = measurement_data
+    return data
+
+
+def contact_signatures(contacts):
+    """
+    Describes each contact by its first and last frame and its bounding box,
+    skipping the contacts contactmodel would skip too
+    """
+    signatures = set()
+    for contact in contacts:
+        if len(contact) < 2:
+            continue
+        _, min_x, max_x, min_y, max_y = utility.update_bounding_box(contact)
+        signatures.add((min(contact), max(contact), min_x, max_x, min_y, max_y))
+    return signatures
+
+
+def benchmark_tracking(repeat=1):
+    print("{:<60} {:>7} {:>10} {:>10} {:>8} {:>9}".format("File", "Frames", "graph", "label",
+                                                           "Speed up", "Agreement"))
+    total_graph, total_label = 0., 0.
+    for file_path in measurement_file_paths():
+        measurement_data = io.load(io.open_zip_file(file_path))
+        if measurement_data is None:
+            continue
+        data = pad(measurement_data)
+
+        graph_contacts, graph_time = time_function(tracking.track_contours, repeat, data, engine="graph")
+        label_contacts, label_time = time_function(tracking.track_contours, repeat, data, engine="label")
+        total_graph += graph_time
+        total_label += label_time
+
+        graph_signatures = contact_signatures(graph_contacts)
+        label_signatures = contact_signatures(label_contacts)
+        agreement = len(graph_signatures & label_signatures) / float(
+            max(len(graph_signatures), len(label_signatures), 1))
+
+        file_name = os.path.basename(file_path)[:60]
+        print("{:<60} {:>7} {:>9.3f}s {:>9.3f}s {:>7.1f}x {:>8.0f}%".format(file_name, data.shape[2],
+                                                                          graph_time, label_time,
+                                                                          graph_time / label_time,
+                                                                          agreement * 100))
+
+    if total_label:
+        print("Total: graph {:.2f}s, label {:.2f}s, {:.1f}x faster".format(total_graph, total_label,
+                                                                           total_graph / total_label))
+
+
+def benchmark_create_graph(repeat=1):
+    """
+    Shows how many contour pairs the spatial index saves create_graph from testing
+    """
+    print("{:<60} {:>7} {:>10} {:>10} {:>8}".format("File", "Frames", "Time", "Pairs", "Pruned"))
+    for file_path in measurement_file_paths():
+        measurement_data = io.load(io.open_zip_file(file_path))
+        if measurement_data is None:
+            continue
+        contour_dict = tracking.find_contours(pad(measurement_data))
+        statistics = {}
+        _, duration = time_function(tracking.create_graph, repeat, contour_dict, statistics=statistics)
+
+        file_name = os.path.basename(file_path)[:60]
+        pairs = statistics["pairs"] / repeat
+        pruned = statistics["pruned"] / float(max(statistics["pairs"], 1))
+        print("{:<60} {:>7} {:>9.3f}s {:>10} {:>7.0f}%".format(file_name, measurement_data.shape[2], duration,
+                                                              pairs, pruned * 100))
+
+
+def benchmark_find_contours(repeat=1, workers=(1, 2, 4)):
+    """
+    Compares finding the contours one frame at a time with the batch version, for a couple of worker counts,
+    and shows how the time of the batch version is spread over its stages
+    """
+    durations = dict((version, 0.) for version in ["frames"] + ["batch {}".format(count) for count in workers])
+    timings = {}
+    for file_path in measurement_file_paths():
+        measurement_data = io.load(io.open_zip_file(file_path))
+        if measurement_data is None:
+            continue
+        data = pad(measurement_data)
+        durations["frames"] += time_function(tracking.find_contours, repeat, data, version="frames")[1]
+        for count in workers:
+            file_timings = {}
+            durations["batch {}".format(count)] += time_function(tracking.find_contours, repeat, data,
+                                                                 version="batch", workers=count,
+                                                                 timings=file_timings)[1]
+            if count == workers[0]:
+                for stage, duration in file_timings.items():
+                    timings[stage] = timings.get(stage, 0.) + duration / repeat
+
+    for version in sorted(durations):
+        print("{:<10} {:>9.3f}s {:>7.1f}x".format(version, durations[version],
+                                                  durations["frames"] / durations[version]))
+    print("Stages with {} worker(s): {}".format(workers[0], ", ".join("{} {:.3f}s".format(stage, duration)
+                                                                     for stage, duration in sorted(timings.items()))))
+
+
+def create_components(number_of_components, seed=0):
+    """
+    Creates square components that move across a long plate over time, like a treadmill recording
+    where every step has been split in a couple of pieces
+    """
+    random_state = np.random.RandomState(seed)
+    components = []
+    for index in xrange(number_of_components):
+        start = index * 2 + random_state.randint(0, 5)
+        x, y = random_state.randint(0, 60), (index * 3) % 1000 + random_state.randint(0, 10)
+        size = random_state.randint(2, 8)
+        contour = np.array([[[y, x]], [[y + size, x]], [[y + size, x + size]], [[y, x + size]]], dtype=np.int32)
+        components.append(dict((frame, [contour]) for frame in xrange(start, start + random_state.randint(2, 30))))
+    return components
+
+
+def benchmark_merging_contacts(repeat=1):
+    """
+    Shows how merging_contacts scales with the number of components for both ways of finding merge candidates
+    """
+    print("{:>10} {:>10} {:>10} {:>8} {:>6}".format("Components", "naive", "kdtree", "Speed up", "Equal"))
+    for number_of_components in [50, 100, 250, 500, 1000, 2000]:
+        components = create_components(number_of_components)
+        # merging_contacts empties the components it merges, so they each get their own copy
+        timings = {}
+        results = {}
+        for version in ["naive", "kdtree"]:
+            timings[version] = float("inf")
+            for _ in xrange(repeat):
+                contacts = copy.deepcopy(components)
+                results[version], duration = time_function(tracking.merging_contacts, 1, contacts, version=version)
+                timings[version] = min(timings[version], duration)
+
+        equal = sorted(sorted(contact) for contact in results["naive"]) == sorted(sorted(contact)
+                                                                                 for contact in results["kdtree"])
+        print("{:>10} {:>9.3f}s {:>9.3f}s {:>7.1f}x {:>6}".format(number_of_components, timings["naive"],
+                                                                timings["kdtree"],
+                                                                timings["naive"] / timings["kdtree"], str(equal)))
+
+
+def benchmark_contour_features(repeat=1):
+    """
+    Counts how many bounding boxes tracking and creating the contacts calculate,
+    with and without sharing a ContourFeatures table between them
+    """
+    from pawlabeling.models import contactmodel, measurementmodel, platemodel
+
+    plate = platemodel.Plate()
+    plate.sensor_width, plate.sensor_height, plate.sensor_surface = 0.508, 0.762, 0.387096
+    # Count the calls to cv2.boundingRect from everywhere, including utility.update_bounding_box
+    bounding_rect = cv2.boundingRect
+    calls = [0]
+
+    def counting_bounding_rect(contour):
+        calls[0] += 1
+        return bounding_rect(contour)
+
+    def track_and_create(measurement, measurement_data, features):
+        data = pad(measurement_data)
+        raw_contacts = tracking.track_contours(data, features=features)
+        for raw_contact in raw_contacts:
+            contact = contactmodel.Contact(subject_id="subject", session_id="session",
+                                           measurement_id=measurement.measurement_id)
+            contact.create_contact(contact=raw_contact, measurement_data=measurement_data,
+                                   orientation=measurement.orientation, features=features)
+
+    print("{:<60} {:>10} {:>10} {:>10} {:>10}".format("File", "Calls", "Calls", "Time", "Time"))
+    print("{:<60} {:>10} {:>10} {:>10} {:>10}".format("", "before", "features", "before", "features"))
+    cv2.boundingRect = counting_bounding_rect
+    try:
+        for file_path in measurement_file_paths():
+            measurement_data = io.load(io.open_zip_file(file_path))
+            if measurement_data is None:
+                continue
+            measurement = measurementmodel.MockMeasurement("measurement", measurement_data, 100)
+            results = []
+            for use_features in [False, True]:
+                calls[0] = 0
+                _, duration = time_function(lambda: track_and_create(
+                    measurement, measurement_data, tracking.ContourFeatures() if use_features else None), repeat)
+                results.append((calls[0] / repeat, duration))
+
+            file_name = os.path.basename(file_path)[:60]
+            print("{:<60} {:>10} {:>10} {:>9.3f}s {:>9.3f}s".format(file_name, results[0][0], results[1][0],
+                                                                  results[0][1], results[1][1]))
+    finally:
+        cv2.boundingRect = bounding_rect
+
+
+def add_noise(data, density, seed=0):
+    """
+    Turns on density of the empty sensors with the smallest value in data, like the blips of a noisy plate
+    """
+    random_state = np.random.RandomState(seed)
+    noisy_data = data.copy()
+    noisy_data[(random_state.rand(*data.shape) < density) & (data == 0)] = data[data > 0].min()
+    return noisy_data
+
+
+def benchmark_denoising(repeat=1, densities=(0, 0.002), settings=((2, 1), (2, 2), (4, 2))):
+    """
+    Compares tracking with and without removing the noise first, for a couple of (min_area, persistence) settings,
+    on the measurements with some extra noise added to them (densities). Shows how many contours are left
+    and how many contacts with more than one frame we end up with
+    """
+    def track(data, denoise):
+        features = tracking.ContourFeatures()
+        contacts = tracking.track_contours(data, features=features, denoise=denoise)
+        return len(features), len(contact_signatures(contacts))
+
+    columns = [(density, setting) for density in densities for setting in [None] + list(settings)]
+    durations, contours, contacts = [dict((column, 0) for column in columns) for _ in xrange(3)]
+    denoise = tracking.denoising.denoise
+    try:
+        for file_path in measurement_file_paths():
+            measurement_data = io.load(io.open_zip_file(file_path))
+            if measurement_data is None:
+                continue
+            for density in densities:
+                data = add_noise(pad(measurement_data), density) if density else pad(measurement_data)
+                for setting in [None] + list(settings):
+                    if setting is not None:
+                        min_area, persistence = setting
+                        tracking.denoising.denoise = lambda data, statistics=None, **kwargs: denoise(
+                            data, min_area=min_area, persistence=persistence, statistics=statistics)
+                    (number_of_contours, number_of_contacts), duration = time_function(track, repeat, data,
+                                                                                       setting is not None)
+                    durations[(density, setting)] += duration
+                    contours[(density, setting)] += number_of_contours
+                    contacts[(density, setting)] += number_of_contacts
+    finally:
+        tracking.denoising.denoise = denoise
+
+    print("{:<8} {:<10} {:>10} {:>10} {:>10}".format("Noise", "Denoising", "Time", "Contours", "Contacts"))
+    for column in columns:
+        density, setting = column
+        print("{:<8} {:<10} {:>9.3f}s {:>10} {:>10}".format(density, "{}/{}".format(*setting) if setting else "off",
+                                                           durations[column], contours[column], contacts[column]))
+
+
+if __name__ == "__main__":
+    benchmark_tracking()
+    benchmark_create_graph()
+    benchmark_merging_contacts()
+    benchmark_contour_features()
+    benchmark_find_contours()
+    benchmark_denoising()
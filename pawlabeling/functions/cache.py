@@ -0,0 +1,164 @@
+"""
+Cache for parsed measurements, so we don't have to parse the same text file over and over again.
+
+Every measurement is stored as a .npy file, which can be memory-mapped, with a .json file next to it
+containing its summary (shape, orientation, maximum value, per frame sums and counts). The files are named
+after a hash of the file's contents or for zip files, the CRC of the member we load.
+Several import workers can use the same cache folder at once, so files can disappear from under us.
+"""
+import os
+import json
+import errno
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger("logger")
+
+# Bump this whenever the loaders in io return something different, it invalidates every entry
+loader_version = 2
+
+
+def get_key(file_path, member=None, brand=""):
+    """
+    Returns a hash of the contents of file_path, the brand and the loader version.
+    If file_path is a zip file, we hash the name, size and CRC of member (or the last member,
+    just like io.open_zip_member) from the archive's directory, so we don't have to decompress it.
+    """
+    sha1 = hashlib.sha1()
+    sha1.update("{}:{}:".format(brand, loader_version))
+    if file_path[-3:] == "zip":
+        import zipfile
+
+        try:
+            with zipfile.ZipFile(file_path, "r") as infile:
+                members = [info for info in infile.infolist() if not info.filename.endswith("/")]
+                if member is not None:
+                    members = [info for info in members if info.filename == member]
+        except (IOError, zipfile.BadZipfile):
+            return None
+        if not members:
+            return None
+        info = members[-1]
+        sha1.update("{}:{}:{}".format(info.filename, info.file_size, info.CRC))
+        return sha1.hexdigest()
+
+    with open(file_path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_paths(key, cache_folder):
+    data_path = os.path.join(cache_folder, "{}.npy".format(key))
+    summary_path = os.path.join(cache_folder, "{}.json".format(key))
+    return data_path, summary_path
+
+
+def load(key, cache_folder):
+    """
+    Returns a read-only memory-mapped array and the summary dictionary or (None, None) if key isn't cached
+    """
+    if not key:
+        return None, None
+
+    data_path, summary_path = get_paths(key, cache_folder)
+    if not (os.path.isfile(data_path) and os.path.isfile(summary_path)):
+        return None, None
+
+    try:
+        with open(summary_path, "r") as infile:
+            summary = json.load(infile)
+        data = np.load(data_path, mmap_mode="r")
+    except Exception as e:
+        logger.warning("cache.load: Couldn't load {} from the cache. Exception: {}".format(key, e))
+        return None, None
+
+    if list(data.shape) != summary["shape"]:
+        logger.warning("cache.load: The cached array for {} has the wrong shape".format(key))
+        return None, None
+
+    # Touch the file, so the eviction knows it was recently used
+    try:
+        os.utime(data_path, None)
+    except OSError:
+        pass
+    return data, summary
+
+
+def store(key, data, summary, cache_folder, cache_size):
+    """
+    Writes data and its summary to the cache and evicts the least recently used entries
+    if the cache has grown larger than cache_size (in MB)
+    """
+    if not key:
+        return
+
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    data_path, summary_path = get_paths(key, cache_folder)
+    summary = dict(summary, shape=list(data.shape))
+    # JSON doesn't know what to do with numpy arrays
+    summary = dict((key, value.tolist() if isinstance(value, np.ndarray) else value)
+                   for key, value in summary.items())
+    temporary_paths = []
+    try:
+        # Write to temporary files first, so we never end up with half an entry.
+        # Every call gets its own, because two workers might be storing the same file at once.
+        for _ in xrange(2):
+            handle, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=cache_folder)
+            os.close(handle)
+            temporary_paths.append(temporary_path)
+        with open(temporary_paths[0], "wb") as outfile:
+            np.save(outfile, np.asarray(data, dtype=np.float32))
+        with open(temporary_paths[1], "w") as outfile:
+            json.dump(summary, outfile)
+        # The summary is moved last, because load only trusts entries that have one
+        os.rename(temporary_paths[0], data_path)
+        os.rename(temporary_paths[1], summary_path)
+    except Exception as e:
+        logger.warning("cache.store: Couldn't store {} in the cache. Exception: {}".format(key, e))
+        for temporary_path in temporary_paths:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        return
+
+    evict(cache_folder, cache_size)
+
+
+def evict(cache_folder, cache_size):
+    """
+    Removes the least recently used entries until the cache is smaller than cache_size (in MB)
+    """
+    entries = []
+    total_size = 0
+    for file_name in os.listdir(cache_folder):
+        if not file_name.endswith(".npy"):
+            continue
+        data_path = os.path.join(cache_folder, file_name)
+        try:
+            stat = os.stat(data_path)
+        except OSError as e:
+            # Another worker might have evicted it in the meantime
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+        entries.append((stat.st_mtime, stat.st_size, file_name[:-4]))
+        total_size += stat.st_size
+
+    max_size = cache_size * 1024 * 1024
+    for _, size, key in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            for path in get_paths(key, cache_folder):
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError as e:
+            # On Windows you can't remove a file that's still memory-mapped
+            logger.info("cache.evict: Couldn't remove {}. Exception: {}".format(key, e))
+            continue
+        total_size -= size
@@ -488,16 +488,61 @@ def check_valid(contact_list, weight):
 
 
 def check_orientation(measurement_data):
+    return summarize_measurement(measurement_data)["orientation"]
+
+
+def get_orientation(start_frame, end_frame):
+    """
+    Returns True if the subject walked right to left, going by the COP of the first and last active frame
+    """
     from scipy.ndimage.measurements import center_of_mass
-    # Find the first and last frame with nonzero measurement_data (from z)
-    x, y, z = np.nonzero(measurement_data)
-    # For some reason I was loading the file in such a way that it wasn't sorted
-    z = sorted(z)
-    start, end = z[0], z[-1]
     # Get the COP for those two frames
-    start_x, start_y = center_of_mass(measurement_data[:, :, start])
-    end_x, end_y = center_of_mass(measurement_data[:, :, end])
+    start_x, start_y = center_of_mass(start_frame)
+    end_x, end_y = center_of_mass(end_frame)
     # We've calculated the start and end point of the measurement (if at all)
     x_distance = end_x - start_x
     # If this distance is negative, the subject walked right to left
-    return True if x_distance < 0 else False
\ No newline at end of file
+    return True if x_distance < 0 else False
+
+
+def summarize_measurement(measurement_data, block_size=64):
+    """
+    Goes through the measurement once, block_size frames at a time, and returns a dictionary with its
+    orientation, maximum_value, first_frame and last_frame (the first and last frame with nonzero values,
+    -1 if there are none), frame_sums (the total force of every frame) and frame_counts (the number of
+    nonzero sensors in every frame).
+    It works on anything that can be sliced like measurement_data[:, :, start:stop] and SparseMeasurements.
+    """
+    from . import sparse
+
+    rows, columns, frames = measurement_data.shape
+    if isinstance(measurement_data, sparse.SparseMeasurement):
+        maximum_value = float(measurement_data.max())
+        frame_sums = measurement_data.frame_sums()
+        frame_counts = measurement_data.frame_counts()
+    else:
+        maximum_value = 0.
+        frame_sums = np.zeros(frames, dtype=np.float64)
+        frame_counts = np.zeros(frames, dtype=np.int64)
+        for start in xrange(0, frames, block_size):
+            stop = min(start + block_size, frames)
+            block = np.asarray(measurement_data[:, :, start:stop]).reshape((rows * columns, stop - start))
+            if block.size:
+                maximum_value = max(maximum_value, float(block.max()))
+            frame_sums[start:stop] = block.sum(axis=0, dtype=np.float64)
+            frame_counts[start:stop] = np.count_nonzero(block, axis=0)
+
+    active_frames = np.flatnonzero(frame_counts)
+    if len(active_frames):
+        first_frame, last_frame = int(active_frames[0]), int(active_frames[-1])
+        walked_right_to_left = get_orientation(measurement_data[:, :, first_frame], measurement_data[:, :, last_frame])
+    else:
+        first_frame, last_frame = -1, -1
+        walked_right_to_left = False
+
+    return {"orientation": walked_right_to_left,
+            "maximum_value": maximum_value,
+            "first_frame": first_frame,
+            "last_frame": last_frame,
+            "frame_sums": frame_sums,
+            "frame_counts": np.asarray(frame_counts, dtype=np.int64)}
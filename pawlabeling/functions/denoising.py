@@ -0,0 +1,165 @@
+"""
+Removes sensor noise from a measurement before we look for contours, so every blip of a single sensor
+doesn't end up as a contour that has to be linked and merged, only to be dropped afterwards.
+
+There are three filters, applied in this order:
+ - the noise floor: every sensor gets the highest value it had during the idle frames, where nothing touches
+   the plate, anything up to that value is noise
+ - temporal persistence: sensors have to stay active for at least persistence frames in a row
+ - minimum area: the blobs (8-connected, within a frame) have to cover at least min_area sensors
+"""
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("logger")
+
+
+def find_idle_frames(data, idle_fraction=0.01, margin=10):
+    """
+    Returns the indices of the idle frames: the frames whose total pressure is at most idle_fraction
+    of the busiest frame and that are more than margin frames away from any frame above it.
+    The margin keeps the light first and last frames of a contact out of the idle frames.
+    A contact that stays below idle_fraction of the busiest frame the whole time still looks like noise though.
+    """
+    frame_sums = data.frame_sums() if hasattr(data, "frame_sums") else np.sum(np.sum(data, axis=0), axis=0)
+    frame_sums = np.asarray(frame_sums, dtype=np.float64)
+    if not len(frame_sums) or frame_sums.max() <= 0:
+        return np.zeros(0, dtype=np.int64)
+    busy = frame_sums > idle_fraction * frame_sums.max()
+    if margin > 0:
+        # Spread every busy frame over margin frames on either side
+        busy_frames = np.flatnonzero(busy)
+        near = np.zeros(len(busy) + 1, dtype=np.int64)
+        np.add.at(near, np.maximum(busy_frames - margin, 0), 1)
+        np.add.at(near, np.minimum(busy_frames + margin + 1, len(busy)), -1)
+        busy = np.cumsum(near[:-1]) > 0
+    return np.flatnonzero(~busy)
+
+
+def noise_floor(data, idle_fraction=0.01, margin=10):
+    """
+    Returns the (rows x columns) noise floor of every sensor: its maximal value during the idle frames
+    or zero if there aren't any.
+    Only the idle frames get read, so data can also be a lazy MeasurementData or a SparseMeasurement.
+    """
+    floor = np.zeros(data.shape[:2], dtype=getattr(data, "dtype", np.float32))
+    idle_frames = find_idle_frames(data, idle_fraction=idle_fraction, margin=margin)
+    if not len(idle_frames):
+        return floor
+    # Read the idle frames a run of consecutive frames at a time
+    starts = np.flatnonzero(np.r_[True, np.diff(idle_frames) != 1])
+    stops = np.r_[starts[1:], len(idle_frames)]
+    for start, stop in zip(idle_frames[starts], idle_frames[stops - 1] + 1):
+        if hasattr(data, "frames"):
+            block = data.frames(start, stop)
+        else:
+            block = np.asarray(data[:, :, start:stop])
+        np.maximum(floor, block.max(axis=2), out=floor)
+    return floor
+
+
+def to_frames(mask):
+    """
+    Returns a contiguous (frames x rows + 1 x columns) uint8 copy of the (rows x columns x frames) boolean mask.
+    The extra row stays empty, so when we stack the frames on top of each other, their blobs don't touch.
+    Most sensors are off, so scattering the ones that are on is a lot faster than transposing the mask.
+    """
+    rows, columns, number_of_frames = mask.shape
+    frames = np.zeros((number_of_frames, rows + 1, columns), dtype=np.uint8)
+    row, column, frame = np.unravel_index(np.flatnonzero(mask), mask.shape)
+    frames[frame, row, column] = 1
+    return frames
+
+
+def from_frames(frames, data):
+    """
+    Returns a copy of data with only the sensors that are on in the frames from to_frames
+    """
+    frame, row, column = np.unravel_index(np.flatnonzero(frames.view(np.bool_)), frames.shape)
+    denoised_data = np.zeros_like(data)
+    denoised_data[row, column, frame] = data[row, column, frame]
+    return denoised_data
+
+
+def remove_short_runs(frames, persistence):
+    """
+    Turns off the sensors in the frames from to_frames that are active for less than persistence frames in a row.
+    This is a binary opening along the frames, but shifting slices is a lot faster than scipy's version.
+    """
+    number_of_frames = frames.shape[0]
+    if number_of_frames < persistence:
+        return np.zeros_like(frames)
+    stop = number_of_frames - persistence + 1
+    # A sensor survives the erosion if it's active in this frame and the next persistence - 1 frames
+    eroded = frames[:stop].copy()
+    for shift in xrange(1, persistence):
+        eroded &= frames[shift:stop + shift]
+    # Then the dilation turns the rest of those runs back on
+    opened = np.zeros_like(frames)
+    for shift in xrange(persistence):
+        opened[shift:stop + shift] |= eroded
+    return opened
+
+
+def remove_small_blobs(frames, min_area):
+    """
+    Turns off the blobs (8-connected, just like findContours) in the frames from to_frames
+    that cover less than min_area sensors. Returns the number of blobs that are left.
+    The frames are labeled in one go, by treating them as one tall image.
+    """
+    number_of_frames, rows, columns = frames.shape
+    _, labels = cv2.connectedComponents(frames.reshape((number_of_frames * rows, columns)), connectivity=8)
+    # Most sensors are background, so we only count the labels of the active ones
+    active = np.flatnonzero(frames.view(np.bool_))
+    active_labels = labels.ravel()[active]
+    areas = np.bincount(active_labels)
+    frames.ravel()[active[areas[active_labels] < min_area]] = 0
+    return np.count_nonzero(areas >= min_area)
+
+
+def count_blobs(frames):
+    """
+    Returns the number of blobs in the frames from to_frames, which is about the number of contours findContours finds
+    """
+    number_of_frames, rows, columns = frames.shape
+    return cv2.connectedComponents(frames.reshape((number_of_frames * rows, columns)), connectivity=8)[0] - 1
+
+
+def update_statistics(statistics, data, denoised_data):
+    """
+    Adds the number of sensors and blobs in data and denoised_data (its denoised copy) to the statistics dictionary
+    """
+    before = to_frames(data > 0)
+    after = to_frames(denoised_data > 0)
+    for key, value in [("sensors_before", np.count_nonzero(before)), ("sensors_after", np.count_nonzero(after)),
+                       ("blobs_before", count_blobs(before)), ("blobs_after", count_blobs(after))]:
+        statistics[key] = statistics.get(key, 0) + value
+
+
+def denoise(data, min_area=2, persistence=1, idle_fraction=0.01, floor=None, statistics=None):
+    """
+    Returns a copy of the (rows x columns x frames) data where the sensors that are considered noise are set to zero.
+    A min_area or persistence of 1 turns that filter off, an idle_fraction of 0 turns off the noise floor
+    (unless some frames are entirely empty, but those don't have any noise to begin with).
+    Pass the floor from noise_floor if data is only part of a measurement, so every part uses the same one.
+    SparseMeasurements get a dense copy.
+    If you pass a statistics dictionary, the number of sensors and blobs before and after get added to it.
+    """
+    if hasattr(data, "toarray"):
+        data = data.toarray()
+    data = np.asarray(data)
+
+    if floor is None:
+        floor = noise_floor(data, idle_fraction=idle_fraction)
+    frames = to_frames(data > floor[:, :, np.newaxis])
+    if persistence > 1:
+        frames = remove_short_runs(frames, persistence)
+    if min_area > 1:
+        remove_small_blobs(frames, min_area)
+
+    denoised_data = from_frames(frames, data)
+    if statistics is not None:
+        update_statistics(statistics, data, denoised_data)
+    return denoised_data
@@ -1,5 +1,11 @@
 import os
+import stat as stat_module
+import errno
+import json
 import logging
+import itertools
+import tempfile
+from collections import OrderedDict
 
 import numpy as np
 from pubsub import pub
@@ -10,6 +16,15 @@ try:
 except ImportError:
     import pickle
 
+# os.scandir only exists from Python 3.5, so try the backport before falling back on os.listdir
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 logger = logging.getLogger("logger")
 
 
@@ -38,42 +53,89 @@ def fix_orientation(data):
     return data
 
 
-def load_zebris(infile):
+def iterate_zebris_frames(infile, header=None):
     """
-    Input: raw text file, consisting of lines of strings
-    Output: stacked numpy array (width x height x number of frames)
+    Input: raw text file, either as a string or a file-like object
+    Output: generator yielding every frame as a float32 array (width x height)
 
-    This very crudely goes through the file, and if the line starts with an F splits it
-    Then if the first word is Frame, it flips a boolean "frame_number"
-    and parses every line until we hit the closing "}".
+    This goes through the file line by line, if a line starts with Frame and ends with "{"
+    every line starting with a y gets converted to a row, until we hit the closing "}".
+    If a dictionary is passed as header, it gets filled with the key/value pairs on the other lines
+    starting with an F, such as the "Frame count".
     """
-    frame_number = None
-    data_slices = []
-    # Clean up the file
-    split_input = [line for line in infile.split("\n") if len(line) > 0]
+    from cStringIO import StringIO
+
+    # cStringIO shares the buffer of the string, so this doesn't create a copy
+    if isinstance(infile, basestring):
+        infile = StringIO(infile)
 
-    for line in iter(split_input):
+    data = None
+    for line in infile:
         # This should prevent it from splitting every line
-        if frame_number:
+        if data is not None:
             if line[0] == 'y':
-                line = line.split()
-                data.append(line[1:])
-                # End of the frame
-            if line[0] == '}':
-                data_slices.append(np.array(data, dtype=np.float32).T)
-                frame_number = None
-
-        if line[0] == 'F':
-            line = line.split()
-            if line[0] == "Frame" and line[-1] == "{":
-                frame_number = line[1]
+                # Skip the y-label, the rest are the values of this row
+                data.append(np.fromstring(line.split(None, 1)[1], dtype=np.float32, sep=" "))
+            # End of the frame
+            elif line[0] == '}':
+                yield np.vstack(data).T
+                data = None
+        elif line[0] == 'F':
+            split_line = line.split()
+            if split_line[0] == "Frame" and split_line[-1] == "{":
                 data = []
-    results = np.dstack(data_slices)
+            elif header is not None:
+                header[" ".join(split_line[:-1])] = split_line[-1]
+
+
+def stack_frames(frames, capacity=0):
+    """
+    Input: iterable of equally shaped 2D frames, optionally the expected number of frames
+    Output: stacked numpy array (width x height x number of frames)
+
+    The frames are written into a buffer as they are being parsed, so we never have to hold
+    both the text and all the separate frames in memory at the same time.
+    """
+    results = None
+    length = 0
+    for frame in frames:
+        if results is None:
+            # Store the frames along the first axis, so the buffer can be grown and shrunk in place
+            results = np.zeros((max(capacity, 256),) + frame.shape, dtype=np.float32)
+        elif frame.shape != results.shape[1:]:
+            raise Exception("The frames don't all have the same shape")
+        elif length == results.shape[0]:
+            results.resize((2 * length,) + frame.shape, refcheck=False)
+        results[length] = frame
+        length += 1
 
     # Check if we didn't pass an empty array
-    if results.shape[2] == 1:
+    if length <= 1:
         raise Exception
 
+    # Drop any frames we didn't use and put the frames in the last dimension
+    results.resize((length,) + results.shape[1:], refcheck=False)
+    return results.transpose((1, 2, 0))
+
+
+def load_zebris(infile):
+    """
+    Input: raw text file, either as a string or a file-like object
+    Output: stacked numpy array (width x height x number of frames)
+    """
+    header = {}
+    frames = iterate_zebris_frames(infile, header=header)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        raise Exception("Couldn't find any Zebris frames")
+
+    # Use the frame count from the header if its there, so we only have to allocate once
+    try:
+        capacity = int(header.get("Frame count", 0))
+    except ValueError:
+        capacity = 0
+    results = stack_frames(itertools.chain([first_frame], frames), capacity=capacity)
+
     width, height, length = results.shape
     if width > height:
         return results
@@ -81,13 +143,126 @@ def load_zebris(infile):
         return results.swapaxes(0, 1)
 
 
+def find_rsscan_headers(infile):
+    """
+    Returns a list with the (start, end) offsets of every frame header, like: Frame 0 (0.00 ms)
+    Searching for the literal "ms)" is a lot faster than splitting the whole file into lines first.
+    """
+    headers = []
+    index = infile.find("ms)")
+    while index != -1:
+        end = infile.find("\n", index)
+        if end == -1:
+            end = len(infile)
+        # Only count it as a header if "ms)" is the last thing on the line
+        if not infile[index + 3:end].strip():
+            start = infile.rfind("\n", 0, index) + 1
+            headers.append((start, end))
+        index = infile.find("ms)", end)
+    return headers
+
+
+def load_rsscan(infile, version=None):
+    """Reads all measurement_data in the datafile. Returns a 3D array of pressure measurement_data
+    with shape (nx, ny, nz). Strings are parsed in one go, file-like objects frame by frame."""
+    if version is None:
+        version = "fromstring" if isinstance(infile, basestring) else "stream"
+
+    if version == "stream":
+        return load_rsscan_stream(infile)
+    elif version == "fromstring":
+        return load_rsscan_fromstring(infile)
+    elif version == "loadtxt":
+        return load_rsscan_loadtxt(infile)
+    else:
+        raise ValueError("Unknown RSscan version: {}".format(version))
+
+
+def load_rsscan_fromstring(infile):
+    """
+    Finds all the frame headers in a single pass, then converts the text of all the frames
+    at once with np.fromstring, instead of calling np.loadtxt for every frame.
+    """
+    headers = find_rsscan_headers(infile)
+    # We need at least two frames to figure out how many rows a frame has
+    if len(headers) < 2:
+        raise Exception("Couldn't find any RSscan frames")
+
+    # We'll count the number of lines in the first frame and how long the first line is
+    first_frame = [line for line in infile[headers[0][1]:headers[1][0]].split("\n") if line.strip()]
+    height = len(first_frame)
+    width = len(first_frame[0].split())
+    num_frames = len(headers)
+
+    # Glue the bodies of all frames together, so numpy only has to parse a single string
+    # Any whitespace (tabs, newlines and carriage returns) counts as a separator
+    starts = [start for start, end in headers[1:]] + [len(infile)]
+    frame_string = " ".join([infile[end:start] for (_, end), start in zip(headers, starts)])
+    result = np.fromstring(frame_string, dtype=np.float32, sep=" ")
+
+    # If any frame has a different size, we can't reshape it
+    if result.size != num_frames * height * width:
+        raise Exception("The RSscan frames don't all have the same shape")
+    result = np.ascontiguousarray(result.reshape((num_frames, height, width)).transpose((1, 2, 0)))
+
+    # Check if the array contains any NaN, if so, throw an Exception
+    if np.isnan(result).any():
+        logger.error("Measurements should never contain NaN. Please report this measurement file on Github.")
+        raise Exception
+
+    # Check if we didn't pass an empty array
+    if result.shape[2] == 1:
+        raise Exception
+    return result
+
+
+def iterate_rsscan_frames(infile):
+    """
+    Input: raw text file, either as a string or a file-like object
+    Output: generator yielding every frame as a float32 array (height x width)
+
+    Every line ending with "ms)" starts a new frame, the non-empty lines that follow are its rows.
+    """
+    from cStringIO import StringIO
+
+    if isinstance(infile, basestring):
+        infile = StringIO(infile)
+
+    rows = None
+    for line in infile:
+        line = line.rstrip()
+        if line.endswith("ms)"):
+            if rows:
+                yield np.fromstring(" ".join(rows), dtype=np.float32, sep=" ").reshape((len(rows), -1))
+            rows = []
+        elif rows is not None and line:
+            rows.append(line)
+
+    if rows:
+        yield np.fromstring(" ".join(rows), dtype=np.float32, sep=" ").reshape((len(rows), -1))
+
+
+def load_rsscan_stream(infile):
+    """
+    Parses the frames while reading them from the file, so the text never has to be in memory in its entirety.
+    """
+    result = stack_frames(iterate_rsscan_frames(infile))
+
+    # Check if the array contains any NaN, if so, throw an Exception
+    if np.isnan(result).any():
+        logger.error("Measurements should never contain NaN. Please report this measurement file on Github.")
+        raise Exception
+    return result
+
+
 # TODO Check to replace the looping using iter with a sentinel value
 # See Raymond Hettinger's presentation from PyCon about Beautiful Python
 # This functions is modified from:
 # http://stackoverflow.com/questions/4087919/how-can-i-improve-my-contact-detection
-def load_rsscan(infile):
+def load_rsscan_loadtxt(infile):
     """Reads all measurement_data in the datafile. Returns an array of times for each
-    slice, and a 3D array of pressure measurement_data with shape (nx, ny, nz)."""
+    slice, and a 3D array of pressure measurement_data with shape (nx, ny, nz).
+    This is the original version, which calls np.loadtxt for every single frame."""
     from StringIO import StringIO
 
     width = 0
@@ -124,9 +299,82 @@ def load_rsscan(infile):
         raise Exception
     return result
 
-def load_tekscan(infile):
+def find_tekscan_frames(infile):
+    """
+    Returns a list with the (start, end) offsets of the rows of every frame.
+    A frame starts after a line beginning with Frame and ends at the first blank line,
+    the next frame or the end of the file.
+    """
+    import re
+
+    headers = [0] if infile.startswith("Frame") else []
+    index = infile.find("\nFrame")
+    while index != -1:
+        headers.append(index + 1)
+        index = infile.find("\nFrame", index + 1)
+
+    blank_line = re.compile(r"\n[ \t\r]*\n")
+    frames = []
+    for index, header_start in enumerate(headers):
+        next_header = headers[index + 1] if index + 1 < len(headers) else len(infile)
+        start = infile.find("\n", header_start, next_header)
+        if start == -1:
+            continue
+        # Skip any blank lines between the header and the first row
+        while start < next_header and infile[start] in " \t\r\n":
+            start += 1
+        match = blank_line.search(infile, start, next_header)
+        end = match.start() if match else next_header
+        if end > start:
+            frames.append((start, end))
+    return frames
+
+
+def load_tekscan(infile, version="pandas"):
+    """Reads all data in the datafile. Returns a 3D array of pressure data with shape (nx, ny, ntimes)."""
+    # The frames are glued together from their offsets, so we need the whole text
+    if not isinstance(infile, basestring):
+        infile = infile.read()
+
+    if version == "pandas":
+        return load_tekscan_pandas(infile)
+    elif version == "python":
+        return load_tekscan_python(infile)
+    else:
+        raise ValueError("Unknown Tekscan version: {}".format(version))
+
+
+def load_tekscan_pandas(infile):
+    """
+    Uses the offsets from find_tekscan_frames to glue the rows of all frames together
+    and lets the C parser of pandas convert them all at once.
+    """
+    import pandas as pd
+    from cStringIO import StringIO
+
+    frames = find_tekscan_frames(infile)
+    if not frames:
+        raise Exception("Couldn't find any Tekscan frames")
+
+    # The first frame tells us how many rows every frame should have
+    start, end = frames[0]
+    height = len([line for line in infile[start:end].split("\n") if line.strip()])
+    num_frames = len(frames)
+
+    frame_string = "\n".join([infile[start:end] for start, end in frames])
+    result = pd.read_csv(StringIO(frame_string), header=None, dtype=np.float32, engine="c").values
+
+    # If any frame has a different size, we can't reshape it (pandas pads short rows with NaN)
+    if result.shape[0] != num_frames * height or np.isnan(result).any():
+        raise Exception("The Tekscan frames don't all have the same shape")
+    width = result.shape[1]
+    return np.ascontiguousarray(result.reshape((num_frames, height, width)).transpose((1, 2, 0)))
+
+
+def load_tekscan_python(infile):
     """Reads all data in the datafile. Returns an array of times for each
-    slice, and a 3D array of pressure data with shape (nx, ny, ntimes)."""
+    slice, and a 3D array of pressure data with shape (nx, ny, ntimes).
+    This is the original version, which splits every line in Python."""
     data_slices = []
     data = []
     first_frame = False
@@ -150,18 +398,134 @@ def load_tekscan(infile):
     result = np.dstack(data_slices)
     return result
 
-def load(input_file, brand):
-    if brand == "rsscan":
+class PeekedFile(object):
+    """
+    Wraps a file-like object of which we've already read the first couple of lines,
+    so the loaders still get to see the whole file.
+    """
+    def __init__(self, lines, infile):
+        self.lines = lines
+        self.infile = infile
+
+    def __iter__(self):
+        return itertools.chain(self.lines, self.infile)
+
+    def read(self):
+        return "".join(self.lines) + self.infile.read()
+
+    def close(self):
+        self.infile.close()
+
+
+def peek(input_file, size=8192):
+    """
+    Returns the first (at least) size bytes of input_file and something that can be passed to the loaders
+    instead of input_file, in case we had to read from a stream
+    """
+    if isinstance(input_file, basestring):
+        return input_file[:size], input_file
+
+    # Read whole lines, so we don't cut a line in two
+    lines = []
+    length = 0
+    while length < size:
+        line = input_file.readline()
+        if not line:
+            break
+        lines.append(line)
+        length += len(line)
+    return "".join(lines), PeekedFile(lines, input_file)
+
+
+def detect_format(header):
+    """
+    Input: the first couple of KB of a measurement file
+    Output: the brand whose format it matches or None if we don't recognize it
+    """
+    import re
+
+    # RSscan: Frame 0 (0.00 ms) followed by tab separated rows, Frame can be translated (like Beeld)
+    if re.search(r"^\S+ \d+ \([^)]*ms\)\s*$", header, re.MULTILINE):
+        return "rsscan"
+    # Zebris: a header with Exercises { ... } or the Frame 1 { blocks themselves
+    if re.search(r"^(Exercises\t\{|Frame \d+ \{)", header, re.MULTILINE):
+        return "zebris"
+    # Tekscan: the ASCII_DATA header or a Frame line followed by comma separated rows
+    if re.search(r"^(ASCII_DATA\b|Frame \d+[^\n]*\n[ \t\r\n]*[\d.]+,)", header, re.MULTILINE):
+        return "tekscan"
+    return None
+
+
+# Stores the results of detect_file_format, so we only have to sniff each file once.
+# Every (file, member) has a single entry and once there are more than file_formats_size entries,
+# the least recently used one gets dropped.
+file_formats = OrderedDict()
+file_formats_size = 1024
+
+
+def detect_file_format(file_path, member=None):
+    """
+    Detects the format of a (zipped) measurement file by only reading the start of the file.
+    The result is cached for as long as the file doesn't change.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    key = (file_path, member)
+    entry = file_formats.pop(key, None)
+    # The size and mtime are what scan_folder uses to tell whether a file changed
+    if entry is None or entry[:2] != (stat.st_size, stat.st_mtime):
+        if file_path[-3:] == "zip":
+            infile = open_zip_member(file_path, member=member)
+        else:
+            infile = open(file_path, "rb")
+
+        file_format = None
+        if infile is not None:
+            try:
+                header, _ = peek(infile)
+            finally:
+                infile.close()
+            file_format = detect_format(header)
+        entry = (stat.st_size, stat.st_mtime, file_format)
+
+    file_formats[key] = entry
+    while len(file_formats) > file_formats_size:
+        file_formats.popitem(last=False)
+    return entry[2]
+
+
+def load(input_file, brand=None):
+    """
+    Detects the format of input_file (a string or a file-like object) and dispatches it to the right loader.
+    If the format doesn't match the brand, we fail right away instead of trying to parse it.
+    Returns None if loading fails.
+    """
+    header, input_file = peek(input_file)
+    file_format = detect_format(header)
+    if file_format is None:
+        if brand is None:
+            logger.error("Couldn't recognize the format of this file")
+            return None
+        # Perhaps it's a variation we don't know yet, so try the loader of the brand anyway
+        logger.info("Couldn't recognize the format of this file, trying to load it as {}".format(brand))
+        file_format = brand
+    elif brand is not None and file_format != brand:
+        logger.error("This file looks like a {} file, but the plate is a {}".format(file_format, brand))
+        return None
+
+    if file_format == "rsscan":
         try:
             return load_rsscan(input_file)
         except Exception as e:
             logger.debug("Loading with RSscan format failed. Exception: {}".format(e))
-    elif brand == "zebris":
+    elif file_format == "zebris":
         try:
             return load_zebris(input_file)
         except Exception as e:
             logger.debug("Loading with Zebris format failed. Exception: {}".format(e))
-    elif brand == "tekscan":
+    elif file_format == "tekscan":
         try:
             return load_tekscan(input_file)
         except Exception as e:
@@ -172,6 +536,10 @@ def load(input_file, brand):
 
 
 def open_zip_file(file_name):
+    """
+    Returns the contents of the last member of the zip file as a string.
+    Use open_zip_member if you want to stream the contents instead.
+    """
     # Check if we even get a file_name
     if file_name == "":
         return None
@@ -192,7 +560,49 @@ def open_zip_file(file_name):
     return input_file
 
 
-def zip_file(file_path):
+def get_zip_members(file_name):
+    """
+    Returns the names of all the files inside the zip file, skipping any folders
+    """
+    import zipfile
+
+    infile = zipfile.ZipFile(file_name, "r")
+    try:
+        return [member for member in infile.namelist() if not member.endswith("/")]
+    finally:
+        infile.close()
+
+
+def open_zip_member(file_name, member=None):
+    """
+    Returns a file-like object, which decompresses the member while its being read.
+    If no member is given, we use the last one, just like open_zip_file.
+    """
+    # Check if it ends with zip, else its probably a wrong file
+    if file_name[-3:] != "zip":
+        return None
+
+    import zipfile
+
+    infile = zipfile.ZipFile(file_name, "r")
+    try:
+        if member is None:
+            members = [name for name in infile.namelist() if not name.endswith("/")]
+            # Just in case the zip file is empty
+            if not members:
+                return None
+            member = members[-1]
+        # The stream opens its own handle to the file, so we can close the archive
+        return infile.open(member, "r")
+    finally:
+        infile.close()
+
+
+def zip_file(file_path, compress_level=None):
+    """
+    Zips file_path to file_path.zip and removes the original.
+    A compress_level of 0 stores the file without compression, zipfile only accepts other levels from Python 3.7.
+    """
     if not file_path:
         raise Exception("Incorrect file name")
 
@@ -202,13 +612,23 @@ def zip_file(file_path):
     new_file_path = file_path + ".zip"
     outfile = zipfile.ZipFile(new_file_path, "w")
 
+    compress_type = zipfile.ZIP_STORED if compress_level == 0 else zipfile.ZIP_DEFLATED
     try:
         # Write the content from file_path to the zip-file called outfile
-        outfile.write(file_path, os.path.basename(file_path), compress_type=zipfile.ZIP_DEFLATED)
+        try:
+            outfile.write(file_path, os.path.basename(file_path), compress_type=compress_type,
+                          compresslevel=compress_level)
+        except TypeError:
+            # This version of zipfile doesn't support compresslevel
+            outfile.write(file_path, os.path.basename(file_path), compress_type=compress_type)
     except Exception as e:
         logger.critical("Couldn't write to ZIP file. Exception: {}".format(e))
+        outfile.close()
+        # Don't leave half a zip file next to the original
+        os.remove(new_file_path)
         # Raise another exception to let the caller deal with it
         raise Exception
+    outfile.close()
 
     try:
         # Remove the uncompressed file
@@ -221,6 +641,182 @@ def zip_file(file_path):
     return new_file_path
 
 
+class ZipQueue(object):
+    """
+    Zips files in a couple of background threads, so importing measurements doesn't have to wait for it.
+    zlib releases the GIL while compressing, so the threads really do run in parallel.
+    put blocks when max_size files are waiting, so we never queue up more than we can handle.
+    """
+    def __init__(self, workers=2, max_size=16, compress_level=None):
+        import threading
+        import Queue
+
+        self.compress_level = compress_level
+        self.queue = Queue.Queue(maxsize=max_size)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.zipped = []
+        self.failed = []
+        self.threads = []
+        for _ in xrange(workers):
+            thread = threading.Thread(target=self.work)
+            # Don't keep the application alive for this, call join if you want to wait for it
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, file_path):
+        with self.lock:
+            self.pending += 1
+        self.queue.put(file_path)
+
+    def work(self):
+        while True:
+            file_path = self.queue.get()
+            try:
+                zip_file(file_path, compress_level=self.compress_level)
+                succeeded = True
+            except Exception:
+                succeeded = False
+
+            with self.lock:
+                self.pending -= 1
+                if succeeded:
+                    self.zipped.append(file_path)
+                else:
+                    self.failed.append(file_path)
+            self.queue.task_done()
+
+    def join(self):
+        """
+        Waits until every file that was put on the queue has been zipped
+        """
+        self.queue.join()
+
+    def status(self):
+        """
+        Returns a dictionary with the number of files that are pending, zipped and failed
+        """
+        with self.lock:
+            return {"pending": self.pending,
+                    "zipped": len(self.zipped),
+                    "failed": len(self.failed)}
+
+
+def iterate_folder(folder):
+    """
+    Yields the name, path, whether its a directory and the stat result of every entry in folder.
+    With scandir we can reuse the information we got while listing the folder.
+    """
+    if scandir is not None:
+        for entry in scandir(folder):
+            is_dir = entry.is_dir()
+            yield entry.name, entry.path, is_dir, entry.stat()
+    else:
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            stat = os.stat(path)
+            yield name, path, stat_module.S_ISDIR(stat.st_mode), stat
+
+
+def hash_file(file_path):
+    """
+    Returns the sha1 hash of the raw bytes of file_path
+    """
+    import hashlib
+
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def load_file_index(index_file):
+    if not index_file or not os.path.isfile(index_file):
+        return {}
+    try:
+        with open(index_file, "r") as infile:
+            return json.load(infile)
+    except Exception as e:
+        logger.warning("io.load_file_index: Couldn't load the file index. Exception: {}".format(e))
+        return {}
+
+
+def store_file_index(index_file, file_index):
+    temporary_path = None
+    try:
+        # Write to a temporary file next to the index first, so there's always a complete index
+        handle, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(index_file)))
+        with os.fdopen(handle, "w") as outfile:
+            json.dump(file_index, outfile)
+        try:
+            os.rename(temporary_path, index_file)
+        except OSError as e:
+            # Windows won't rename a file over an existing one
+            if e.errno != errno.EEXIST:
+                raise
+            os.remove(index_file)
+            os.rename(temporary_path, index_file)
+    except Exception as e:
+        logger.warning("io.store_file_index: Couldn't store the file index. Exception: {}".format(e))
+        if temporary_path is not None and os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def scan_folder(measurement_folder, index_file=None):
+    """
+    Recursively scans measurement_folder and returns a dictionary with path: entry,
+    where every entry has the name, folder, size, mtime, ctime, is_dir and (for files) the hash.
+
+    If an index_file is given, we only hash files that changed since the previous scan.
+    The index is shared between scans of different folders, so we only replace the entries below measurement_folder.
+    """
+    assert os.path.exists(measurement_folder)
+    assert os.path.isdir(measurement_folder)
+
+    file_index = load_file_index(index_file)
+    entries = {}
+    folders = [measurement_folder]
+    while folders:
+        folder = folders.pop()
+        try:
+            folder_entries = list(iterate_folder(folder))
+        except OSError as e:
+            logger.warning("io.scan_folder: Couldn't scan {}. Exception: {}".format(folder, e))
+            continue
+
+        for name, path, is_dir, stat in folder_entries:
+            entry = {"name": name,
+                     "folder": folder,
+                     "size": stat.st_size,
+                     "mtime": stat.st_mtime,
+                     "ctime": stat.st_ctime,
+                     "is_dir": is_dir,
+                     "hash": None}
+            if is_dir:
+                folders.append(path)
+            else:
+                previous = file_index.get(path)
+                # Only hash the file again if it changed
+                if previous and previous["size"] == entry["size"] and previous["mtime"] == entry["mtime"]:
+                    entry["hash"] = previous["hash"]
+                else:
+                    try:
+                        entry["hash"] = hash_file(path)
+                    except IOError as e:
+                        logger.warning("io.scan_folder: Couldn't read {}. Exception: {}".format(path, e))
+            entries[path] = entry
+
+    if index_file:
+        # Remove the entries of files below measurement_folder that no longer exist
+        prefix = os.path.join(measurement_folder, "")
+        file_index = dict((path, entry) for path, entry in file_index.iteritems() if not path.startswith(prefix))
+        file_index.update(entries)
+        store_file_index(index_file, file_index)
+    return entries
+
+
 def get_file_paths(measurement_folder):
     from collections import defaultdict
 
@@ -231,13 +827,10 @@ def get_file_paths(measurement_folder):
 
     assert os.path.exists(measurement_folder)
     assert os.path.isdir(measurement_folder)
-    file_names = [name for name in os.listdir(measurement_folder)]
     # Removed the isfile condition
-    #if os.path.isfile(os.path.join(measurement_folder, name))
-
-    for file_name in file_names:
-        file_paths[file_name] = os.path.join(measurement_folder, file_name)
+    for file_name, file_path, _, _ in iterate_folder(measurement_folder):
+        file_paths[file_name] = file_path
 
     if not file_paths:
         logger.info("No files found, please check the measurement folder in your settings file")
-    return file_paths
\ No newline at end of file
+    return file_paths
@@ -0,0 +1,175 @@
+"""
+Sparse representation of measurements. Most sensors of a pressure plate are zero in most frames,
+so we only store the nonzero sensors of each frame.
+"""
+import numpy as np
+
+
+def compress(data, max_density=0.25):
+    """
+    Returns a SparseMeasurement if less than max_density of the sensors in data are nonzero, else returns data.
+    Every nonzero value costs 8 bytes instead of 4, so beyond a density of 0.5 the dense array is smaller.
+    """
+    if isinstance(data, SparseMeasurement):
+        return data
+    if np.count_nonzero(data) > max_density * data.size:
+        return data
+    return SparseMeasurement.from_dense(data)
+
+
+class SparseMeasurement(object):
+    """
+    Stores a (rows x columns x frames) measurement as compressed sparse rows, with one row per frame.
+    The values of frame f are values[indptr[f]:indptr[f + 1]] and indices contains their flattened
+    sensor positions (row * columns + column).
+
+    Indexing like measurement_data[:, :, frame] or measurement_data[min_x:max_x, min_y:max_y, frame]
+    works just like it does on a dense array, so the tracking and contact code can use either.
+    """
+
+    def __init__(self, shape, indptr, indices, values):
+        self.shape = tuple(int(size) for size in shape)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.dtype = self.values.dtype
+        self.ndim = 3
+        # Contacts index the same frame over and over again, so we hold on to the last one
+        self._frame_cache = (None, None)
+
+    @classmethod
+    def from_dense(cls, data):
+        return cls.from_frames((data[:, :, frame] for frame in xrange(data.shape[2])), shape=data.shape)
+
+    @classmethod
+    def from_frames(cls, frames, shape=None):
+        """
+        Creates a SparseMeasurement out of an iterable of (rows x columns) frames
+        """
+        indptr = [0]
+        indices = []
+        values = []
+        frame_shape = None
+        for frame in frames:
+            if frame_shape is None:
+                frame_shape = frame.shape
+            elif frame.shape != frame_shape:
+                raise Exception("The frames don't all have the same shape")
+            flat_frame = frame.ravel()
+            nonzero = np.flatnonzero(flat_frame)
+            indices.append(nonzero.astype(np.int32))
+            values.append(flat_frame[nonzero].astype(np.float32))
+            indptr.append(indptr[-1] + len(nonzero))
+
+        if frame_shape is None:
+            raise Exception("Can't create a SparseMeasurement without any frames")
+        if shape is None:
+            shape = frame_shape + (len(indptr) - 1,)
+        return cls(shape=shape, indptr=indptr,
+                   indices=np.concatenate(indices), values=np.concatenate(values))
+
+    @property
+    def size(self):
+        rows, columns, frames = self.shape
+        return rows * columns * frames
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+
+    @property
+    def density(self):
+        return float(len(self.values)) / self.size if self.size else 0.
+
+    def frame(self, index):
+        """
+        Returns a dense (rows x columns) copy of frame index
+        """
+        rows, columns, frames = self.shape
+        if index < 0:
+            index += frames
+        if not 0 <= index < frames:
+            raise IndexError("Frame {} is out of bounds for a measurement with {} frames".format(index, frames))
+        start, stop = self.indptr[index], self.indptr[index + 1]
+        result = np.zeros(rows * columns, dtype=self.dtype)
+        result[self.indices[start:stop]] = self.values[start:stop]
+        return result.reshape((rows, columns))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != 3:
+            return self.toarray()[key]
+
+        x, y, z = key
+        if isinstance(z, (int, long, np.integer)):
+            cached_index, cached_frame = self._frame_cache
+            if cached_index != z:
+                cached_frame = self.frame(z)
+                cached_frame.flags.writeable = False
+                self._frame_cache = (z, cached_frame)
+            return cached_frame[x, y]
+
+        frames = xrange(*z.indices(self.shape[2])) if isinstance(z, slice) else z
+        block = np.zeros(self.shape[:2] + (len(frames),), dtype=self.dtype)
+        for index, frame in enumerate(frames):
+            block[:, :, index] = self.frame(frame)
+        return block[x, y]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def toarray(self):
+        """
+        Returns the dense (rows x columns x frames) measurement
+        """
+        rows, columns, frames = self.shape
+        result = np.zeros((rows, columns, frames), dtype=self.dtype)
+        frame_ids = np.repeat(np.arange(frames), np.diff(self.indptr))
+        row_ids, column_ids = self.indices // columns, self.indices % columns
+        result[row_ids, column_ids, frame_ids] = self.values
+        return result
+
+    def max(self):
+        return self.values.max() if len(self.values) else self.dtype.type(0)
+
+    def max_projection(self):
+        """
+        Returns the maximum value of every sensor over all frames (rows x columns)
+        """
+        rows, columns, frames = self.shape
+        result = np.zeros(rows * columns, dtype=self.dtype)
+        if len(self.values):
+            order = np.argsort(self.indices, kind="mergesort")
+            sorted_indices = self.indices[order]
+            starts = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+            result[sorted_indices[starts]] = np.maximum.reduceat(self.values[order], starts)
+        return result.reshape((rows, columns))
+
+    def frame_sums(self):
+        """
+        Returns the sum of every frame, like np.sum(np.sum(data, axis=0), axis=0)
+        """
+        frames = self.shape[2]
+        frame_ids = np.repeat(np.arange(frames), np.diff(self.indptr))
+        return np.bincount(frame_ids, weights=self.values, minlength=frames)
+
+    def frame_counts(self):
+        """
+        Returns the number of nonzero sensors in every frame
+        """
+        return np.diff(self.indptr)
+
+    def pad(self, padding):
+        """
+        Returns a new SparseMeasurement with padding empty sensors around every frame
+        """
+        rows, columns, frames = self.shape
+        row_ids, column_ids = self.indices // columns, self.indices % columns
+        indices = (row_ids + padding) * (columns + 2 * padding) + (column_ids + padding)
+        return SparseMeasurement(shape=(rows + 2 * padding, columns + 2 * padding, frames),
+                                 indptr=self.indptr, indices=indices, values=self.values)
+
+    def __getstate__(self):
+        # Don't pickle the cached frame
+        state = self.__dict__.copy()
+        state["_frame_cache"] = (None, None)
+        return state
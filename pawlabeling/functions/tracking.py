@@ -1,13 +1,119 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import itertools
+import logging
+import threading
+import time
+import Queue
 import cv2
 
 import numpy as np
 
+from ..functions import denoising, unionfind
 from ..functions.utility import update_bounding_box
 from ..settings import settings
 
+logger = logging.getLogger("logger")
 
-def closest_contact(contact1, contact2, center1, euclidean_distance):
+# Bump this whenever finding the contours or linking them gives different components, it invalidates the stored ones
+tracker_version = 1
+
+
+class ContourFeatures(object):
+    """
+    Table with the features of every contour in a measurement, so we only have to calculate them once.
+    The table is a structured array with a row per contour: frame, index (within its frame), the bounding box
+    (min_x, max_x, min_y, max_y, just like update_bounding_box), center_x, center_y, area and points.
+    Contours are looked up by their id, so we hold on to them to make sure those stay unique.
+    """
+    dtype = np.dtype([("frame", np.int32), ("index", np.int32),
+                      ("min_x", np.int32), ("max_x", np.int32), ("min_y", np.int32), ("max_y", np.int32),
+                      ("center_x", np.float64), ("center_y", np.float64),
+                      ("area", np.float64), ("points", np.int32)])
+
+    def __init__(self, contour_dict=None):
+        self.table = np.zeros(0, dtype=self.dtype)
+        self.rows = {}
+        self.contours = []
+        # Plain tuples of the bounding boxes, indexing the structured array one row at a time is a lot slower.
+        # rects holds them as (x, y, width, height) like cv2.boundingRect returns them
+        self.boxes = []
+        self.rects = []
+        self.bounding_rect_calls = 0
+        if contour_dict:
+            self.add(contour_dict)
+
+    def __len__(self):
+        return len(self.contours)
+
+    def add(self, contour_dict):
+        """
+        Adds the contours in contour_dict (frames as keys, lists of contours as values) to the table
+        """
+        new_rows = []
+        for frame in sorted(contour_dict):
+            for index, contour in enumerate(contour_dict[frame]):
+                if id(contour) in self.rows:
+                    continue
+                new_rows.append(self.create_row(frame, index, contour))
+        if new_rows:
+            self.table = np.concatenate([self.table, np.array(new_rows, dtype=self.dtype)])
+
+    def create_row(self, frame, index, contour):
+        x, y, width, height = cv2.boundingRect(contour)
+        self.bounding_rect_calls += 1
+        box = (x, x + width, y, y + height)
+        self.rows[id(contour)] = len(self.contours)
+        self.contours.append(contour)
+        self.boxes.append(box)
+        self.rects.append((x, y, width, height))
+        return (frame, index, box[0], box[1], box[2], box[3], (box[0] + box[1]) / 2., (box[2] + box[3]) / 2.,
+                cv2.contourArea(contour), len(contour))
+
+    def get_row(self, contour):
+        """
+        Returns the row of contour, contours we haven't seen yet get added to the table
+        """
+        row = self.rows.get(id(contour))
+        if row is None:
+            self.table = np.concatenate([self.table, np.array([self.create_row(-1, -1, contour)], dtype=self.dtype)])
+            row = self.rows[id(contour)]
+        return row
+
+    def get_box(self, contour):
+        """
+        Returns (min_x, max_x, min_y, max_y) of contour
+        """
+        return self.boxes[self.get_row(contour)]
+
+    def get_rect(self, contour):
+        """
+        Returns (x, y, width, height) of contour, the same as cv2.boundingRect
+        """
+        return self.rects[self.get_row(contour)]
+
+    def bounding_box(self, contact):
+        """
+        Returns the same as update_bounding_box, the center and the bounding box of all the contours in contact
+        """
+        total_min_x, total_max_x = float("inf"), float("-inf")
+        total_min_y, total_max_y = float("inf"), float("-inf")
+        for contours in contact.itervalues():
+            for contour in contours:
+                min_x, max_x, min_y, max_y = self.get_box(contour)
+                if min_x < total_min_x:
+                    total_min_x = min_x
+                if max_x > total_max_x:
+                    total_max_x = max_x
+                if min_y < total_min_y:
+                    total_min_y = min_y
+                if max_y > total_max_y:
+                    total_max_y = max_y
+
+        total_centroid = ((total_max_x + total_min_x) / 2., (total_max_y + total_min_y) / 2.)
+        return total_centroid, total_min_x, total_max_x, total_min_y, total_max_y
+
+
+def closest_contact(contact1, contact2, center1, euclidean_distance, features=None):
     """
     We take all the frames, add some to bridge any gaps, then we calculate the distance
     between the center of the first (short) contact and center of the second contact
@@ -18,7 +124,9 @@ def closest_contact(contact1, contact2, center1, euclidean_distance):
     get a higher value and increment the value for every frame the distance is short enough.
     In the end we regularize the value, to prevent it from growing too large and taking
     an earlier position in the heap.
+    If you pass ContourFeatures, the bounding boxes are looked up instead of calculated.
     """
+    get_bounding_box = features.bounding_box if features is not None else update_bounding_box
     # Perhaps I should add a boolean for when there's a gap or not
     frames = list(contact1.keys())
     min_frame, max_frame = min(frames), max(frames)
@@ -33,7 +141,7 @@ def closest_contact(contact1, contact2, center1, euclidean_distance):
     for frame in frames:
         if frame in contact2:
             if contact2[frame]:  # How can there be an empty list in here?
-                center2, _, _, _, _ = update_bounding_box({frame: contact2[frame]})
+                center2, _, _, _, _ = get_bounding_box({frame: contact2[frame]})
                 #distance = np.linalg.norm(np.array(center1) - np.array(center2))
                 x1 = center1[0]
                 y1 = center1[1]
@@ -47,19 +155,20 @@ def closest_contact(contact1, contact2, center1, euclidean_distance):
     return value / float(len(frames))
 
 
-def calculate_temporal_spatial_variables(contacts):
+def calculate_temporal_spatial_variables(contacts, features=None):
     """
     We recalculate the euclidean distance based on the current size of the  remaining contacts
     This ensures that we reduce the number of false positives, by having a too large euclidean distance
     It assumes contacts are more of less round, such that the width and height are equal.
     """
+    get_bounding_box = features.bounding_box if features is not None else update_bounding_box
     sides = []
     centers = []
     surfaces = []
     lengths = []
     for contact in contacts:
         # Get the dimensions for each contact
-        center, min_x, max_x, min_y, max_y = update_bounding_box(contact)
+        center, min_x, max_x, min_y, max_y = get_bounding_box(contact)
         centers.append(center)
 
         width = max_x - min_x
@@ -90,7 +199,53 @@ def merge_contours(contact1, contact2):
         contact2[frame] = []
 
 
-def merging_contacts(contacts):
+def find_merge_candidates(center_list, frame_ranges, euclidean_distance, version="kdtree"):
+    """
+    Returns the pairs of contacts (index1, index2, distance) whose centers are within the euclidean distance.
+    Contacts can only be merged if they overlap in time or the gap between them is less than 5 frames,
+    so the kdtree version also drops pairs whose frame ranges are too far apart. Both orders of every pair
+    are returned, because merging_contacts doesn't treat them the same.
+    The naive version compares every contact with every other contact.
+    """
+    if version == "naive":
+        candidates = ((index1, index2) for index1 in xrange(len(center_list))
+                      for index2 in xrange(len(center_list)) if index1 != index2)
+    else:
+        from scipy.spatial import cKDTree
+
+        if len(center_list) < 2:
+            return []
+        tree = cKDTree(np.array(center_list, dtype=np.float64)[:, :2])
+        # Use a slightly larger radius, we check the exact distance below
+        pairs = tree.query_pairs(euclidean_distance * (1 + 1e-9), output_type="ndarray")
+        starts, stops = np.array(frame_ranges, dtype=np.int64).reshape((-1, 2)).T
+        # The frame interval index: the gap between the two contacts has to be less than 5 frames
+        gaps = np.maximum(starts[pairs[:, 0]], starts[pairs[:, 1]]) - np.minimum(stops[pairs[:, 0]],
+                                                                                 stops[pairs[:, 1]])
+        pairs = pairs[gaps < 5]
+        candidates = itertools.chain(((index1, index2) for index1, index2 in pairs),
+                                     ((index2, index1) for index1, index2 in pairs))
+
+    results = []
+    for index1, index2 in candidates:
+        center1 = center_list[index1]
+        center2 = center_list[index2]
+        #distance = np.linalg.norm(np.array(center1) - np.array(center2))
+        # Instead of linalg, we just compare the first two coordinates
+        # of both contacts
+        x1 = center1[0]
+        y1 = center1[1]
+        x2 = center2[0]
+        y2 = center2[1]
+        distance = (abs(x1 - x2) ** 2 + abs(y1 - y2) ** 2) ** 0.5
+        # We only check for merges if the distance between the two contacts
+        # is less than the euclidean distance
+        if distance <= euclidean_distance:
+            results.append((int(index1), int(index2), distance))
+    return results
+
+
+def merging_contacts(contacts, version="kdtree", features=None):
     """
     We compare each contact with the rest, if the distance between the centers of both
     contacts is <= the euclidean distance, then we check if they also made contact during the
@@ -98,189 +253,379 @@ def merging_contacts(contacts):
     amount of frames are considered for merging. Just naively merging based on distance would
     cause problems if the contacts are too close too each other.
     This will fail if the contacts are close for more frames than the threshold.
+    The version is passed on to find_merge_candidates, the ContourFeatures to the functions that need bounding boxes.
     """
     import heapq
 
     # Get the important temporal spatial variables
-    sides, center_list, surfaces, lengths = calculate_temporal_spatial_variables(contacts)
+    sides, center_list, surfaces, lengths = calculate_temporal_spatial_variables(contacts, features=features)
     # Get their averages and adjust them when needed
     frame_threshold = np.mean(lengths) * settings.settings.tracking_temporal()
     euclidean_distance = np.mean(sides) * settings.settings.tracking_spatial()
     average_surface = np.mean(surfaces) * settings.settings.tracking_surface()
-    # Initialize two dictionaries for calculating the Minimal Spanning Tree
-    leaders = defaultdict()
-    clusters = defaultdict(set)
+    # Keep track of the clusters for calculating the Minimal Spanning Tree
+    clusters = unionfind.DisjointSet(len(contacts))
+    frame_sets = []
+    frame_ranges = []
+    for index, contact in enumerate(contacts):
+        frames = set(contact.keys())
+        frame_sets.append(frames)
+        frame_ranges.append((min(frames), max(frames)) if frames else (0, -5))
+
     # This list forms the heap to which we'll add all edges
     edges = []
-    for index1, contact1 in enumerate(contacts):
-        clusters[index1] = {index1}
-        leaders[index1] = index1
-
+    for index1, index2, distance in find_merge_candidates(center_list, frame_ranges, euclidean_distance,
+                                                          version=version):
+        contact1 = contacts[index1]
+        contact2 = contacts[index2]
         center1 = center_list[index1]
-        frames1 = set(contact1.keys())
+        frames1 = frame_sets[index1]
         length1 = len(frames1)
         surface1 = surfaces[index1]
-        for index2, contact2 in enumerate(contacts):
-            if index1 != index2:
-                center2 = center_list[index2]
-                #distance = np.linalg.norm(np.array(center1) - np.array(center2))
-                # Instead of linalg, we just compare the first two coordinates
-                # of both contacts
-                x1 = center1[0]
-                y1 = center1[1]
-                x2 = center2[0]
-                y2 = center2[1]
-                distance = (abs(x1 - x2) ** 2 + abs(y1 - y2) ** 2) ** 0.5
+        frames2 = frame_sets[index2]
+        #length2 = len(frames2)
+        # Calculate how many frames of overlap there is between two contacts
+        overlap = len(frames1 & frames2)
+        ratio = overlap / float(length1)
 
-                # We only check for merges if the distance between the two contacts
-                # is less than the euclidean distance
-                if distance <= euclidean_distance:
-                    frames2 = set(contact2.keys())
-                    #length2 = len(frames2)
-                    # Calculate how many frames of overlap there is between two contacts
-                    overlap = len(list(frames1 & frames2))
-                    ratio = overlap / float(length1)
-
-                    merge = False
-                    value = None
-                    if overlap:
-                        # We have 4 different cases where contacts can be merged
-                        # If the overlap is larger than the frame_threshold we always merge
-                        if overlap >= frame_threshold:
-                            merge = True
-                            value = (euclidean_distance - distance) * overlap
-                        # If the first contact is too short, but we have overlap nonetheless,
-                        # we also merge, we'll deal with picking the best value later
-                        elif length1 <= frame_threshold and overlap:
-                            merge = True
-                        # Some contacts are longer than the threshold, yet don't have overlap
-                        # that's larger than the threshold. However, because the overlap is
-                        # significant, we'll allow it to merge too
-                        elif ratio >= 0.5:
-                            merge = True
-                        # This deals with the edge cases where a contact is really small
-                        # yet because its duration is quite long, it wouldn't get merged
-                        elif ratio >= 0.2 and surface1 < average_surface:
-                            merge = True
-                    # In some cases we don't get a merge because there's no overlap
-                    # But still its clear these pixels belong to a contact in adjacent frames
-                    # If the gap between the two contacts isn't too large, we'll allow that one too
-                    else:
-                        if length1 <= frame_threshold and not overlap:
-                            gap = min([abs(f1 - f2) for f1 in frames1 for f2 in frames2])
-                            if gap < 5:  # I changed it to 5, which may or may not work
-                                merge = True
-                                # If we've found a merge, we'll add it to the heap
-                    if merge:
-                    # We use two different values for large and short contacts
-                        # here we check whether we should calculate a different value
-                        if not value:
-                            # For short contacts we calculate the average distance to the contact
-                            # Which seems to be much more reliable, yet is computationally more expensive
-                            value = closest_contact(contact1, contact2, center1, euclidean_distance)
-                            # Use a heap to get the minimum item
-                        heapq.heappush(edges, (-value, index1, index2))
+        merge = False
+        value = None
+        if overlap:
+            # We have 4 different cases where contacts can be merged
+            # If the overlap is larger than the frame_threshold we always merge
+            if overlap >= frame_threshold:
+                merge = True
+                value = (euclidean_distance - distance) * overlap
+            # If the first contact is too short, but we have overlap nonetheless,
+            # we also merge, we'll deal with picking the best value later
+            elif length1 <= frame_threshold and overlap:
+                merge = True
+            # Some contacts are longer than the threshold, yet don't have overlap
+            # that's larger than the threshold. However, because the overlap is
+            # significant, we'll allow it to merge too
+            elif ratio >= 0.5:
+                merge = True
+            # This deals with the edge cases where a contact is really small
+            # yet because its duration is quite long, it wouldn't get merged
+            elif ratio >= 0.2 and surface1 < average_surface:
+                merge = True
+        # In some cases we don't get a merge because there's no overlap
+        # But still its clear these pixels belong to a contact in adjacent frames
+        # If the gap between the two contacts isn't too large, we'll allow that one too
+        else:
+            if length1 <= frame_threshold and not overlap:
+                gap = min([abs(f1 - f2) for f1 in frames1 for f2 in frames2])
+                if gap < 5:  # I changed it to 5, which may or may not work
+                    merge = True
+                    # If we've found a merge, we'll add it to the heap
+        if merge:
+        # We use two different values for large and short contacts
+            # here we check whether we should calculate a different value
+            if not value:
+                # For short contacts we calculate the average distance to the contact
+                # Which seems to be much more reliable, yet is computationally more expensive
+                value = closest_contact(contact1, contact2, center1, euclidean_distance, features=features)
+                # Use a heap to get the minimum item
+            heapq.heappush(edges, (-value, index1, index2))
 
     explored = set()
     # While we have edges left in the heap or we've explored all contacts
     while edges and len(explored) != len(contacts):
         # Get an edge from the heap
         value, index1, index2 = heapq.heappop(edges)
-        leader1 = leaders[index1]
-        leader2 = leaders[index2]
-        # Check if the label of the two contacts isn't equal and the
+        # Check if the two contacts aren't in the same cluster yet and the
         # first contact hasn't been explored yet.
-        if leader1 != leader2 and index1 not in explored:
+        if not clusters.connected(index1, index2) and index1 not in explored:
             explored.add(index1)
-            # Find the shortest one, so we have to do less work
-            if len(contacts[leader1]) <= len(contacts[leader2]):
-                min_cluster, max_cluster = leader1, leader2
-            else:
-                min_cluster, max_cluster = leader2, leader1
-                # Merge the two contacts, so delete the nodes
-            # that are part of the short cluster
-            # and add them to the large cluster
-            for node in clusters[min_cluster]:
-                # Add it to the cluster of the max_cluster
-                clusters[max_cluster].add(node)
-                # Replace its label
-                leaders[node] = max_cluster
-                if node in clusters:
-                    # Delete the old cluster
-                    del clusters[node]
+            clusters.union(index1, index2)
 
-    new_contacts = []
     # I defer merging till the end, because else
     # we might have to move things around several times
-    # This is where we actually merge the contacts in
-    # each cluster
-    for key, indices in list(clusters.iteritems()):
+    return apply_merges(contacts, clusters)
+
+
+def apply_merges(contacts, clusters):
+    """
+    Creates a new contact out of the contacts in each cluster of the DisjointSet clusters
+    """
+    new_contacts = []
+    for indices in clusters.groups():
         new_contact = defaultdict(list)
         for index in indices:
-            contact = contacts[index]
-            merge_contours(new_contact, contact)
+            merge_contours(new_contact, contacts[index])
         new_contacts.append(new_contact)
-
     return new_contacts
 
 
-def find_contours(data):
+def find_frame_contours(frame_data):
+    """
+    Returns the contours of the nonzero regions in a single (rows x columns) frame
+    """
+    copy_data = frame_data.T * 1.
+    # Threshold the measurement_data
+    _, copy_data = cv2.threshold(copy_data, 0.0, 1, cv2.THRESH_BINARY)
+    # The astype conversion here is quite expensive!
+    # Also replaced # CHAIN_APPROX_NONE with CHAIN APPROX SIMPLE
+    contour_list, _ = cv2.findContours(copy_data.astype('uint8'), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contour_list
+
+
+def find_contours(data, version="batch", workers=None, timings=None):
+    """
+    Returns a dictionary with the frames as keys and the contours found in them as values.
+    The frames version thresholds and searches every frame one after the other.
+    The batch version thresholds the entire volume at once, skips the frames that are empty
+    and lets a couple of worker threads call findContours, which releases the GIL.
+    If you pass a timings dictionary, the time spent on every stage gets added to it.
+    """
+    if version == "frames":
+        return find_contours_frames(data)
+
+    if workers is None:
+        workers = settings.settings.tracking_workers()
+    if timings is None:
+        timings = {}
+
+    start_time = time.time()
+    binary, active_frames = binarize(data)
+    timings["binarize"] = timings.get("binarize", 0.) + time.time() - start_time
+
+    start_time = time.time()
+
+    def find_chunk_contours(frames):
+        # RETR_EXTERNAL with CHAIN_APPROX_SIMPLE, just like find_frame_contours
+        return [(frame, cv2.findContours(binary[frame], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0])
+                for frame in frames]
+
+    # Give every worker a couple of chunks, so they don't have to wait for the slowest one
+    chunk_size = max(1, len(active_frames) // (workers * 4))
+    chunks = [active_frames[index:index + chunk_size] for index in xrange(0, len(active_frames), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        results = map_threads(find_chunk_contours, chunks, workers)
+    else:
+        results = [find_chunk_contours(chunk) for chunk in chunks]
+
+    # Dictionary to fill with results
+    contour_dict = defaultdict()
+    for frame, contour_list in itertools.chain.from_iterable(results):
+        if contour_list:
+            contour_dict[frame] = contour_list
+    timings["contours"] = timings.get("contours", 0.) + time.time() - start_time
+    logger.debug("tracking.find_contours: Found contours in {} of {} frames in {}".format(
+        len(contour_dict), data.shape[2], ", ".join("{} {:.3f}s".format(stage, duration)
+                                                    for stage, duration in sorted(timings.items()))))
+    return contour_dict
+
+
+def map_threads(function, items, workers):
+    """
+    Returns [function(item) for item in items], calculated by a couple of worker threads.
+    We don't use multiprocessing's ThreadPool, because closing it takes up to a tenth of a second.
+    """
+    results = [None] * len(items)
+    jobs = Queue.Queue()
+    for index in xrange(len(items)):
+        jobs.put(index)
+    errors = []
+
+    def work():
+        while True:
+            try:
+                index = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = function(items[index])
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in xrange(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def binarize(data):
+    """
+    Returns a (frames x columns x rows) uint8 volume that's 1 wherever data is larger than zero, so every frame
+    is a contiguous transposed frame ready for findContours, and the indices of the frames that aren't empty.
+    A SparseMeasurement knows which frames are empty, so we only fill those that aren't.
+    """
+    rows, columns, number_of_frames = data.shape
+    if hasattr(data, "frame_counts"):
+        active_frames = np.flatnonzero(data.frame_counts())
+        binary = np.zeros((number_of_frames, columns, rows), dtype=np.uint8)
+        for frame in active_frames:
+            binary[frame] = data[:, :, frame].T > 0
+    else:
+        # Viewing the booleans as uint8 is free, so we only make a copy when we transpose them
+        binary = np.ascontiguousarray(np.transpose((data > 0).view(np.uint8), (2, 1, 0)))
+        active_frames = np.flatnonzero(binary.reshape((number_of_frames, -1)).any(axis=1))
+    return binary, active_frames.tolist()
+
+
+def find_contours_frames(data):
     # Dictionary to fill with results
     contour_dict = defaultdict()
     # Find the contours in this frame
     rows, cols, num_frames = data.shape
     for frame in xrange(num_frames):
-        copy_data = data[:, :, frame].T * 1.
-        # Threshold the measurement_data
-        _, copy_data = cv2.threshold(copy_data, 0.0, 1, cv2.THRESH_BINARY)
-        # The astype conversion here is quite expensive!
-        # Also replaced # CHAIN_APPROX_NONE with CHAIN APPROX SIMPLE
-        contour_list, _ = cv2.findContours(copy_data.astype('uint8'), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contour_list = find_frame_contours(data[:, :, frame])
         if contour_list:
             contour_dict[frame] = contour_list
     return contour_dict
 
 
-def create_graph(contour_dict, euclidean_distance=15):
+def boxes_overlap(box1, box2):
+    """
+    Checks whether two bounding boxes (x, y, width, height) as returned by cv2.boundingRect overlap
+    """
+    x1, y1, width1, height1 = box1
+    x2, y2, width2, height2 = box2
+    return x1 < x2 + width2 and x2 < x1 + width1 and y1 < y2 + height2 and y2 < y1 + height1
+
+
+class GridIndex(object):
+    """
+    Hashes the bounding boxes of a frame's contours into square cells of cell_size,
+    so we only have to compare a contour with the contours whose bounding box overlaps with its own
+    """
+    def __init__(self, contours, cell_size=15, features=None):
+        self.cell_size = max(1, int(cell_size))
+        if features is not None:
+            self.boxes = [features.get_rect(contour) for contour in contours]
+        else:
+            self.boxes = [cv2.boundingRect(contour) for contour in contours]
+        self.cells = defaultdict(list)
+        for index, box in enumerate(self.boxes):
+            for cell in self.get_cells(box):
+                self.cells[cell].append(index)
+
+    def get_cells(self, box):
+        x, y, width, height = box
+        for cell_x in xrange(x // self.cell_size, (x + width - 1) // self.cell_size + 1):
+            for cell_y in xrange(y // self.cell_size, (y + height - 1) // self.cell_size + 1):
+                yield cell_x, cell_y
+
+    def query(self, box):
+        """
+        Returns the indices of the contours whose bounding box overlaps with box
+        """
+        candidates = set()
+        for cell in self.get_cells(box):
+            candidates.update(self.cells.get(cell, []))
+        return sorted(index for index in candidates if boxes_overlap(box, self.boxes[index]))
+
+
+def create_graph(contour_dict, euclidean_distance=15, statistics=None, features=None):
+    """
+    Connects every contour with the contours in the previous frame it overlaps with.
+    A point of one contour can only fall within another contour if their bounding boxes overlap,
+    so we use a GridIndex per frame to only test those pairs with pointPolygonTest.
+    If you pass a statistics dictionary, the number of pairs and how many of them were pruned get added to it.
+    """
     # Create a graph
     graph = defaultdict(set)
+    indexes = {}
+    total_pairs = 0
+    tested_pairs = 0
     # Now go through the contour_dict and for each contour, check if there's a matching contour in the adjacent frame
-    for frame in contour_dict:
+    for frame in sorted(contour_dict):
+        if frame not in indexes:
+            indexes[frame] = GridIndex(contour_dict[frame], cell_size=euclidean_distance, features=features)
+        # Get the contours from the previous frame
+        f = frame - 1
+        if f not in contour_dict:
+            continue
+        index = indexes[frame]
+        other_contours = contour_dict[f]
+        other_index = indexes[f]
+        total_pairs += len(contour_dict[frame]) * len(other_contours)
+        for index1, contour1 in enumerate(contour_dict[frame]):
+            # Only iterate through the contacts in the adjacent frame whose bounding boxes overlap
+            for index2 in other_index.query(index.boxes[index1]):
+                tested_pairs += 1
+                contour2 = other_contours[index2]
+                # Pick the shortest contour, to do the least amount of work
+                if len(contour1) <= len(contour2):
+                    short_contour, long_contour = contour1, contour2
+                else:
+                    short_contour, long_contour = contour2, contour1
+
+                # We iterate through all the coordinates in the short contour and test if
+                # they fall within or on the border of the larger contour. We stop comparing
+                # ones we've found a match
+                for coordinates in short_contour:
+                    coordinates = (coordinates[0][0], coordinates[0][1])
+                    if cv2.pointPolygonTest(long_contour, coordinates, 0) > -1.0:
+                        # Create a bi-directional edge between the two keys
+                        graph[(frame, index1)].add((f, index2))
+                        graph[(f, index2)].add((frame, index1))
+                        break
+        # We won't need the index of the previous frame again
+        del indexes[f]
+
+    if statistics is not None:
+        statistics["pairs"] = statistics.get("pairs", 0) + total_pairs
+        statistics["pruned"] = statistics.get("pruned", 0) + total_pairs - tested_pairs
+    logger.debug("tracking.create_graph: Pruned {} out of {} contour pairs".format(total_pairs - tested_pairs,
+                                                                                    total_pairs))
+    return graph
+
+
+def label_contours(contours, shape, offset=(0, 0)):
+    """
+    Fills the contours in a label image of shape (which is transposed, just like the contours), where
+    contour i gets label i + 1. The offset gets added to the coordinates of the contours.
+    """
+    labels = np.zeros(shape, dtype=np.int32)
+    for index in xrange(len(contours)):
+        cv2.drawContours(labels, contours, index, color=index + 1, thickness=-1, offset=offset)
+    return labels
+
+
+def create_graph_mask(contour_dict, features=None):
+    """
+    Connects every contour with the contours in the previous frame it overlaps with, like create_graph.
+    Instead of testing points with pointPolygonTest, we fill every frame's contours once in a label image
+    and get the pairs of labels that share a pixel with the previous frame's label image.
+    """
+    graph = defaultdict(set)
+    previous_frame, previous_labels, previous_origin = None, None, None
+    for frame in sorted(contour_dict):
         contours = contour_dict[frame]
-        for index1, contour1 in enumerate(contours):
-            # Get the contours from the previous frame
-            for f in [frame - 1]:
-                if f in contour_dict:
-                    other_contours = contour_dict[f]
-                    # Iterate through the contacts in the adjacent frame
-                    for index2, contour2 in enumerate(other_contours):
-                        # Pick the shortest contour, to do the least amount of work
-                        if len(contour1) <= len(contour2):
-                            short_contour, long_contour = contour1, contour2
-                        else:
-                            short_contour, long_contour = contour2, contour1
-
-                        # Compare the first two coordinates, if they aren't even close. Don't bother
-                        coord1 = short_contour[0]
-                        coord2 = long_contour[0]
-                        distance = coord1[0][0] - coord2[0][0]
-                        # Taking a safe margin
-                        if distance <= 2 * euclidean_distance:
-                            match = False
-                            # We iterate through all the coordinates in the short contour and test if
-                            # they fall within or on the border of the larger contour. We stop comparing
-                            # ones we've found a match
-                            for coordinates in short_contour:
-                                if not match:
-                                    coordinates = (coordinates[0][0], coordinates[0][1])
-                                    if cv2.pointPolygonTest(long_contour, coordinates, 0) > -1.0:
-                                        match = True
-                                        # Create a bi-directional edge between the two keys
-                                        graph[(frame, index1)].add((f, index2))
-                                        graph[(f, index2)].add((frame, index1))
-                                        # Perhaps this could be sped up, by keeping a cache of centroids of contacts
-                                        # then check if there was a contact in the same place on the last frame
-                                        # if so, link them and stop looking
+        # The label image only has to cover the bounding box of this frame's contours
+        if features is not None:
+            _, min_x, max_x, min_y, max_y = features.bounding_box({frame: contours})
+        else:
+            _, min_x, max_x, min_y, max_y = update_bounding_box({frame: contours})
+        labels = label_contours(contours, shape=(max_y - min_y, max_x - min_x), offset=(-min_x, -min_y))
+
+        f = frame - 1
+        if previous_frame == f:
+            # Compare the part where the two label images overlap
+            previous_min_x, previous_min_y = previous_origin
+            previous_height, previous_width = previous_labels.shape
+            start_x, stop_x = max(min_x, previous_min_x), min(max_x, previous_min_x + previous_width)
+            start_y, stop_y = max(min_y, previous_min_y), min(max_y, previous_min_y + previous_height)
+            if start_x < stop_x and start_y < stop_y:
+                window = labels[start_y - min_y:stop_y - min_y, start_x - min_x:stop_x - min_x]
+                previous_window = previous_labels[start_y - previous_min_y:stop_y - previous_min_y,
+                                                  start_x - previous_min_x:stop_x - previous_min_x]
+                overlap = (window > 0) & (previous_window > 0)
+                # Combine the two labels into a single number, so we can find the unique pairs in one go
+                number_of_labels = len(contour_dict[f]) + 1
+                pairs = np.unique(window[overlap].astype(np.int64) * number_of_labels + previous_window[overlap])
+                for pair in pairs:
+                    label1, label2 = divmod(int(pair), number_of_labels)
+                    # Create a bi-directional edge between the two keys
+                    graph[(frame, label1 - 1)].add((f, label2 - 1))
+                    graph[(f, label2 - 1)].add((frame, label1 - 1))
+        previous_frame, previous_labels, previous_origin = frame, labels, (min_x, min_y)
     return graph
 
 
@@ -315,22 +660,514 @@ def search_graph(graph, contour_dict):
     return contacts
 
 
-def track_contours_graph(data):
+def track_contours_graph(data, linking="polygon", features=None, merge=True):
     """
     This tracking algorithm uses a graph based approach.
     It finds all the contours in each frame, connects them based on whether they have overlap in adjacent frames.
     Then finds connected components using a simple graph search. These resulting connected components might
     be unconnected, yet part of the same contact. So we calculate two threshold based on the average duration and
     width/height of the connected components. These are then used to merge connected components with sufficient overlap.
+    The features of the contours get calculated once and are added to features (a ContourFeatures), if you pass it.
+    If merge is False, you get the connected components before they're merged.
     """
     # Find all the contours, put them in a dictionary where the keys are the frames
     # and the values are the contours
     contour_dict = find_contours(data)
+    if features is None:
+        features = ContourFeatures()
+    features.add(contour_dict)
     # Create a graph by connecting contours that have overlap with contours in the previous frame
-    graph = create_graph(contour_dict, euclidean_distance=15)
+    # either by testing their points with pointPolygonTest or by comparing their filled masks
+    if linking == "mask":
+        graph = create_graph_mask(contour_dict, features=features)
+    else:
+        graph = create_graph(contour_dict, euclidean_distance=15, features=features)
     # Search through the graph for all connected components
     contacts = search_graph(graph, contour_dict)
     # Merge connected components using a minimal spanning tree, where the contacts larger than the threshold are
     # only allowed to merge if they have overlap that's >= than the frame threshold
-    contacts = merging_contacts(contacts)
-    return contacts
\ No newline at end of file
+    if merge:
+        contacts = merging_contacts(contacts, features=features)
+    return contacts
+
+def label_structure(connectivity=0):
+    """
+    Returns the structuring element for scipy.ndimage.label on a (rows x columns x frames) volume.
+    A connectivity of 1, 2 or 3 is passed on to generate_binary_structure. The default (0) mimics the graph tracker:
+    sensors are connected to their 8 neighbours within a frame and to the same sensor in the adjacent frames.
+    """
+    from scipy.ndimage import generate_binary_structure
+
+    if connectivity:
+        return generate_binary_structure(3, connectivity)
+
+    structure = np.zeros((3, 3, 3), dtype=np.bool)
+    structure[:, :, 1] = True
+    structure[1, 1, :] = True
+    return structure
+
+
+def active_volume(data):
+    """
+    Returns a boolean volume with the nonzero sensors, cropped to the rows, columns and frames that have any,
+    and the origin of the cropped volume in data. Most of a measurement is empty, so this saves the labeling
+    a lot of work. SparseMeasurements are thresholded without making a dense copy.
+    """
+    from . import sparse
+
+    if isinstance(data, sparse.SparseMeasurement):
+        rows, columns, frames = data.shape
+        frame_ids = np.repeat(np.arange(frames), np.diff(data.indptr))
+        active = data.values > 0.0
+        coordinates = [data.indices[active] // columns, data.indices[active] % columns, frame_ids[active]]
+        if not len(coordinates[0]):
+            return None, None
+        origin = tuple(int(coordinate.min()) for coordinate in coordinates)
+        shape = tuple(int(coordinate.max()) - start + 1 for coordinate, start in zip(coordinates, origin))
+        mask = np.zeros(shape, dtype=np.bool)
+        mask[tuple(coordinate - start for coordinate, start in zip(coordinates, origin))] = True
+        return mask, origin
+
+    mask = np.asarray(data) > 0.0
+    slices = []
+    for axis in xrange(3):
+        # Check which rows, columns or frames have any nonzero sensors
+        other_axes = tuple(other_axis for other_axis in xrange(3) if other_axis != axis)
+        active = np.flatnonzero(mask.any(axis=other_axes))
+        if not len(active):
+            return None, None
+        slices.append(slice(active[0], active[-1] + 1))
+    return mask[tuple(slices)], tuple(int(s.start) for s in slices)
+
+
+def find_labeled_contacts(labels, number_of_labels, origin=(0, 0, 0)):
+    """
+    Turns a labeled volume into the same contacts the graph tracker creates:
+    dictionaries with the frames as keys and a list of contours as values.
+    Just like search_graph, components that are only visible in a single frame get dropped.
+    """
+    from scipy.ndimage import find_objects
+
+    origin_x, origin_y, origin_z = origin
+    contacts = []
+    for label, slices in enumerate(find_objects(labels, max_label=number_of_labels), start=1):
+        if slices is None:
+            continue
+        slice_x, slice_y, slice_z = slices
+        if slice_z.stop - slice_z.start < 2:
+            continue
+
+        contact = defaultdict(list)
+        # The contours are calculated on the transposed frames, just like find_contours
+        offset = (origin_x + slice_x.start, origin_y + slice_y.start)
+        for frame in xrange(slice_z.start, slice_z.stop):
+            mask = (labels[slice_x, slice_y, frame] == label).T.astype(np.uint8)
+            contour_list, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+            if contour_list:
+                contact[origin_z + frame].extend(contour_list)
+        contacts.append(contact)
+    return contacts
+
+
+def track_contours_label(data, connectivity=0, features=None, merge=True):
+    """
+    This tracking algorithm labels the connected components of the thresholded (rows x columns x frames) volume
+    in one go, instead of finding contours per frame and linking them in a graph.
+    The components are turned into contours and then merged with the same heuristics as the graph tracker.
+    The features of the contours are added to features (a ContourFeatures), if you pass it.
+    If merge is False, you get the connected components before they're merged.
+    """
+    from scipy.ndimage import label
+
+    mask, origin = active_volume(data)
+    if mask is None:
+        return []
+    labels, number_of_labels = label(mask, structure=label_structure(connectivity))
+    contacts = find_labeled_contacts(labels, number_of_labels, origin=origin)
+    if features is None:
+        features = ContourFeatures()
+    for contact in contacts:
+        features.add(contact)
+    # Merge connected components using a minimal spanning tree, just like track_contours_graph
+    if merge:
+        contacts = merging_contacts(contacts, features=features)
+    return contacts
+
+
+def track_contours(data, engine=None, features=None, merge=True, denoise=None, statistics=None):
+    """
+    Tracks the contacts in data with the engine from the settings, unless you pass one: graph or label.
+    Pass a ContourFeatures if you want to reuse the features of the contours afterwards.
+    If merge is False, you get the connected components before they're merged.
+    If denoise is True (by default the denoising setting), the noise gets removed from data first,
+    see denoising.denoise, which adds its statistics to statistics, if you pass a dictionary.
+    """
+    if engine is None:
+        engine = settings.settings.tracking_engine()
+    if denoise is None:
+        denoise = settings.settings.denoising()
+    if denoise:
+        data = denoising.denoise(data, min_area=settings.settings.denoising_min_area(),
+                                 persistence=settings.settings.denoising_persistence(), statistics=statistics)
+
+    if engine == "graph":
+        return track_contours_graph(data, linking=settings.settings.tracking_linking(), features=features,
+                                    merge=merge)
+    elif engine == "label":
+        return track_contours_label(data, connectivity=settings.settings.tracking_connectivity(),
+                                    features=features, merge=merge)
+    else:
+        raise Exception("Unknown tracking engine: {}".format(engine))
+
+
+def read_frames(measurement_data, start, stop):
+    """
+    Returns a dense copy (or view) of the frames from start till stop, only a lazy MeasurementData
+    has to read them from the PyTables file
+    """
+    if hasattr(measurement_data, "frames"):
+        return measurement_data.frames(start, stop)
+    return np.asarray(measurement_data[:, :, start:stop])
+
+
+def stitch_contacts(contacts):
+    """
+    Merges the contacts that share a contour, which happens when they were tracked in overlapping windows.
+    Every contour is only kept once.
+    """
+    clusters = unionfind.DisjointSet(len(contacts))
+    owners = {}
+    for index, contact in enumerate(contacts):
+        for frame, contours in contact.iteritems():
+            for contour in contours:
+                # Contours that were found in the same frame are exactly the same, no matter the window
+                key = (frame, contour.tostring())
+                if key in owners:
+                    clusters.union(owners[key], index)
+                else:
+                    owners[key] = index
+
+    stitched_contacts = []
+    for indices in clusters.groups():
+        stitched_contact = defaultdict(list)
+        seen = set()
+        for index in indices:
+            for frame, contours in contacts[index].iteritems():
+                for contour in contours:
+                    key = (frame, contour.tostring())
+                    if key not in seen:
+                        seen.add(key)
+                        stitched_contact[frame].append(contour)
+        stitched_contacts.append(stitched_contact)
+    return stitched_contacts
+
+
+def track_contours_windowed(measurement_data, window=2000, overlap=50, padding=1, engine=None, features=None,
+                            merge=True, denoise=None, statistics=None):
+    """
+    Tracks the contacts of a long (rows x columns x frames) measurement window frames at a time,
+    so we only need a padded copy of window + 2 * overlap frames instead of the entire measurement.
+    Every window is extended by overlap frames on both sides. We only look for the connected components in each
+    window, those that cross the boundary of a window are found (partially) in both windows, so they share
+    contours in the overlapping frames and get stitched together. The components are merged afterwards,
+    so the merging uses the statistics of the entire measurement, just like track_contours does.
+    Just like track_contours, the contours are shifted by the padding.
+    The features of the contours are added to features (a ContourFeatures), if you pass it.
+    If merge is False, you get the stitched connected components before they're merged.
+    If denoise is True (by default the denoising setting), every window gets denoised with the noise floor
+    of the entire measurement and persistence - 1 extra frames on both sides, so the windows agree on
+    the overlapping frames and we get the same contours as when we denoise the entire measurement.
+    The statistics of the denoising get added to statistics, if you pass a dictionary, counting every frame once.
+    """
+    rows, columns, number_of_frames = measurement_data.shape
+    if denoise is None:
+        denoise = settings.settings.denoising()
+    if denoise:
+        floor = denoising.noise_floor(measurement_data)
+        min_area = settings.settings.denoising_min_area()
+        persistence = settings.settings.denoising_persistence()
+        margin = max(persistence - 1, 0)
+
+    contacts = []
+    for start in xrange(0, number_of_frames, window):
+        window_start = max(0, start - overlap)
+        window_stop = min(number_of_frames, start + window + overlap)
+        if denoise:
+            read_start = max(0, window_start - margin)
+            read_stop = min(number_of_frames, window_stop + margin)
+            raw_frames = read_frames(measurement_data, read_start, read_stop)
+            frames = denoising.denoise(raw_frames, min_area=min_area, persistence=persistence, floor=floor)
+            if statistics is not None:
+                # Only count the frames of this window, not the ones it shares with its neighbours
+                own_frames = slice(start - read_start, min(start + window, number_of_frames) - read_start)
+                denoising.update_statistics(statistics, raw_frames[:, :, own_frames], frames[:, :, own_frames])
+            frames = frames[:, :, window_start - read_start:window_stop - read_start]
+        else:
+            frames = read_frames(measurement_data, window_start, window_stop)
+        data = np.zeros((rows + 2 * padding, columns + 2 * padding, window_stop - window_start), np.float32)
+        data[padding:rows + padding, padding:columns + padding, :] = frames
+        for contact in track_contours(data, engine=engine, merge=False, denoise=False):
+            contacts.append(dict((frame + window_start, contours) for frame, contours in contact.iteritems()
+                                 if contours))
+
+    # merging_contacts isn't entirely independent of the order of the components, so at least make it deterministic
+    contacts = sorted([contact for contact in stitch_contacts(contacts) if contact], key=min)
+    # The windows each have their own frame numbers, so we only add the contours once they've been shifted back
+    if features is None:
+        features = ContourFeatures()
+    for contact in contacts:
+        features.add(contact)
+    if merge:
+        contacts = sorted(merging_contacts(contacts, features=features), key=min)
+    return contacts
+
+
+def copy_components(components):
+    """
+    merging_contacts empties the components it merges, so this gives it copies of the dictionaries and lists
+    (the contours themselves are shared)
+    """
+    return [defaultdict(list, ((frame, list(contours)) for frame, contours in component.iteritems()))
+            for component in components]
+
+
+class StageCache(object):
+    """
+    Holds on to the connected components (and the ContourFeatures of their contours) of the measurements we've
+    tracked recently. The thresholds from the settings only affect merging_contacts, so when they change
+    we only have to merge the components again, instead of finding the contours and linking them.
+    Every entry also has a dictionary with the contacts created from the merged components the last time,
+    so contacts that merged the same way don't have to be created again, see results and set_results.
+    Once there are more than max_size measurements (by default the stage_cache_size setting),
+    the least recently used one gets dropped.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """
+        Returns a copy of the components and their features or (None, None) if key isn't cached
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None, None
+        # Move it to the end, so it's the most recently used one
+        self.entries[key] = entry
+        self.hits += 1
+        components, features, _ = entry
+        return copy_components(components), features
+
+    def put(self, key, components, features):
+        self.entries.pop(key, None)
+        self.entries[key] = [copy_components(components), features, {}]
+        max_size = self.max_size if self.max_size is not None else settings.settings.stage_cache_size()
+        while len(self.entries) > max_size:
+            self.entries.popitem(last=False)
+
+    def results(self, key):
+        """
+        Returns the dictionary with what the caller made from the merged components of key the last time,
+        using component_signature as the key, or None if key isn't cached
+        """
+        entry = self.entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def set_results(self, key, results):
+        """
+        Replaces the results of key, so they only hold the contacts of the last time it was merged
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[2] = results
+
+    def discard(self, prefix):
+        """
+        Drops the entries whose key starts with prefix, like (subject_id, session_id, measurement_id)
+        for a measurement that gets deleted, because its id can be reused by the next measurement
+        """
+        for key in [key for key in self.entries if key[:len(prefix)] == prefix]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+
+def component_signature(component, features):
+    """
+    Describes a (merged) component by the rows of its contours in features, so two components with the same contours
+    get the same signature
+    """
+    return tuple(sorted((frame, features.get_row(contour))
+                        for frame, contours in component.iteritems() for contour in contours))
+
+
+stage_cache = StageCache()
+
+
+def pack_components(components):
+    """
+    Packs the (unmerged) components into flat arrays, so they can be stored in the PyTables file:
+    points holds the points of every contour, contour i has points[offsets[i]:offsets[i + 1]],
+    lies in frames[i] and belongs to components[labels[i]]. The order of the components, the frames and the contours
+    is kept, so merging the unpacked components gives the same contacts.
+    """
+    contours, frames, labels = [], [], []
+    for label, component in enumerate(components):
+        for frame in sorted(component):
+            for contour in component[frame]:
+                contours.append(contour.reshape(-1, 2))
+                frames.append(frame)
+                labels.append(label)
+
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(contour) for contour in contours])
+    points = np.concatenate(contours).astype(np.int32) if contours else np.zeros((0, 2), dtype=np.int32)
+    return {"points": points,
+            "offsets": offsets,
+            "frames": np.array(frames, dtype=np.int32),
+            "labels": np.array(labels, dtype=np.int32)}
+
+
+def unpack_components(arrays, features=None):
+    """
+    Returns the components pack_components packed into arrays.
+    The contours are views on the points array, if you pass ContourFeatures, they get added to it.
+    """
+    points = np.ascontiguousarray(arrays["points"], dtype=np.int32).reshape(-1, 1, 2)
+    offsets = arrays["offsets"]
+    labels = arrays["labels"]
+    number_of_components = int(labels.max()) + 1 if len(labels) else 0
+    components = [defaultdict(list) for _ in xrange(number_of_components)]
+    contour_dict = defaultdict(list)
+    for index, (frame, label) in enumerate(itertools.izip(arrays["frames"].tolist(), labels.tolist())):
+        contour = points[offsets[index]:offsets[index + 1]]
+        components[label][frame].append(contour)
+        contour_dict[frame].append(contour)
+
+    if features is not None:
+        features.add(contour_dict)
+    return components
+
+
+class OnlineTracker(object):
+    """
+    Tracks contacts one frame at a time, so they can be tracked while the measurement is still being recorded.
+    A contour gets linked to the open contacts whose bounding box in their last frame lies within margin sensors of
+    its own bounding box, so a contact that falls apart in a couple of pieces stays together. Contours in the same
+    frame that lie within margin sensors of each other end up in the same contact too. If a contour gets linked
+    to several open contacts, they get merged. Contacts that have been absent for gap frames are finished
+    and returned by push, so we only hold on to the open contacts.
+    Unlike track_contours, we can't merge contacts based on the statistics of the entire measurement.
+    The default gap of 4 bridges the same gaps as merging_contacts.
+    """
+
+    def __init__(self, gap=None, padding=None, margin=2):
+        if gap is None:
+            gap = settings.settings.tracking_gap()
+        if padding is None:
+            padding = settings.settings.padding_factor()
+        self.gap = gap
+        self.padding = padding
+        self.margin = margin
+        # The frame the next call to push will get
+        self.frame = 0
+        self.shape = None
+        self.open_contacts = []
+
+    def first_open_frame(self):
+        """
+        Returns the first frame of the oldest open contact, or the next frame if there are no open contacts
+        """
+        return min([min(contact) for contact in self.open_contacts] + [self.frame])
+
+    def push(self, frame_data):
+        """
+        Tracks the contours in the next (rows x columns) frame and returns a list of the contacts that have finished.
+        Just like track_contours, the contours have been shifted by the padding.
+        """
+        if self.shape is None:
+            self.shape = frame_data.shape
+        elif frame_data.shape != self.shape:
+            raise Exception("The frames don't all have the same shape")
+
+        frame = self.frame
+        self.frame += 1
+        padding = self.padding
+        if padding:
+            rows, columns = frame_data.shape
+            data = np.zeros((rows + 2 * padding, columns + 2 * padding), np.float32)
+            data[padding:-padding, padding:-padding] = frame_data
+        else:
+            data = frame_data
+        contours = find_frame_contours(data)
+        if contours:
+            self.link(frame, contours)
+        return self.close(lambda last_frame: frame - last_frame >= self.gap)
+
+    def link(self, frame, contours):
+        """
+        Adds the contours to the open contacts they're close to, or to new contacts if they're not close to any
+        """
+        margin = self.margin
+        boxes = [cv2.boundingRect(contour) for contour in contours]
+        grown_boxes = [(x - margin, y - margin, width + 2 * margin, height + 2 * margin)
+                       for x, y, width, height in boxes]
+        number_of_contacts = len(self.open_contacts)
+        clusters = unionfind.DisjointSet(number_of_contacts + len(contours))
+        for index, contact in enumerate(self.open_contacts):
+            _, min_x, max_x, min_y, max_y = update_bounding_box({frame: contact[max(contact)]})
+            contact_box = (min_x, min_y, max_x - min_x, max_y - min_y)
+            for contour_index, grown_box in enumerate(grown_boxes):
+                if boxes_overlap(grown_box, contact_box):
+                    clusters.union(index, number_of_contacts + contour_index)
+        for contour_index, grown_box in enumerate(grown_boxes):
+            for other_index in xrange(contour_index):
+                if boxes_overlap(grown_box, boxes[other_index]):
+                    clusters.union(number_of_contacts + contour_index, number_of_contacts + other_index)
+
+        open_contacts = []
+        for indices in clusters.groups():
+            # The groups are sorted, so if there are any open contacts, the first index is one of them
+            if indices[0] < number_of_contacts:
+                contact = self.open_contacts[indices[0]]
+            else:
+                contact = defaultdict(list)
+            for index in indices:
+                if index >= number_of_contacts:
+                    contact[frame].append(contours[index - number_of_contacts])
+                elif contact is not self.open_contacts[index]:
+                    merge_contours(contact, self.open_contacts[index])
+            open_contacts.append(contact)
+        self.open_contacts = open_contacts
+
+    def close(self, is_finished):
+        """
+        Removes the open contacts for which is_finished(last_frame) is True and returns those that last
+        more than a single frame, sorted by their first frame
+        """
+        finished, open_contacts = [], []
+        for contact in self.open_contacts:
+            if is_finished(max(contact)):
+                if len(contact) > 1:
+                    finished.append(contact)
+            else:
+                open_contacts.append(contact)
+        self.open_contacts = open_contacts
+        return sorted(finished, key=min)
+
+    def finish(self):
+        """
+        Call this when there are no more frames, returns the contacts that were still open
+        """
+        return self.close(lambda last_frame: True)
@@ -0,0 +1,69 @@
+"""
+Disjoint-set (union-find) for clustering, used when merging contacts and in the agglomerative clustering.
+"""
+import numpy as np
+
+
+class DisjointSet(object):
+    """
+    Keeps track of which of size nodes belong to the same cluster. The parents and ranks are stored in arrays,
+    find compresses the paths it walks and union attaches the lower ranked tree to the higher ranked one,
+    so both are nearly constant time.
+    """
+
+    def __init__(self, size):
+        self.parents = np.arange(size, dtype=np.int64)
+        self.ranks = np.zeros(size, dtype=np.int32)
+        self.number_of_sets = size
+
+    def __len__(self):
+        return len(self.parents)
+
+    def find(self, node):
+        """
+        Returns the root of the cluster node belongs to
+        """
+        parents = self.parents
+        root = node
+        while parents[root] != root:
+            root = parents[root]
+        # Point every node we've passed directly to the root
+        while parents[node] != root:
+            parents[node], node = root, parents[node]
+        return int(root)
+
+    def union(self, node1, node2):
+        """
+        Merges the clusters of node1 and node2 and returns the root of the merged cluster
+        """
+        root1, root2 = self.find(node1), self.find(node2)
+        if root1 == root2:
+            return root1
+        if self.ranks[root1] < self.ranks[root2]:
+            root1, root2 = root2, root1
+        self.parents[root2] = root1
+        if self.ranks[root1] == self.ranks[root2]:
+            self.ranks[root1] += 1
+        self.number_of_sets -= 1
+        return root1
+
+    def connected(self, node1, node2):
+        return self.find(node1) == self.find(node2)
+
+    def roots(self):
+        """
+        Returns the root of every node as an array
+        """
+        for node in xrange(len(self.parents)):
+            self.find(node)
+        return self.parents.copy()
+
+    def groups(self):
+        """
+        Returns a list with the (sorted) nodes of every cluster, ordered by their smallest node
+        """
+        roots = self.roots()
+        order = np.argsort(roots, kind="mergesort")
+        boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+        groups = [group.tolist() for group in np.split(order, boundaries)] if len(order) else []
+        return sorted(groups, key=lambda group: group[0])
@@ -389,16 +389,14 @@ class ImageColorTable():
 def agglomerative_clustering(data, num_clusters):
     from collections import defaultdict
     import heapq
+    from . import unionfind
 
     distances = defaultdict(dict)
     heap = []
 
-    clusters = {}
-    leaders = {}
+    clusters = unionfind.DisjointSet(len(data))
 
     for index1, trial1 in enumerate(data):
-        clusters[index1] = {index1}
-        leaders[index1] = index1
         for index2, trial2 in enumerate(data):
             if index1 != index2:
                 dist = np.sum(np.sqrt((trial1 - trial2) ** 2))
@@ -407,24 +405,17 @@ def agglomerative_clustering(data, num_clusters):
 
     explored = set()
     # Keep going as long as there are clusters left
-    while heap and len(clusters) > num_clusters:
+    while heap and clusters.number_of_sets > num_clusters:
         dist, (index1, index2) = heapq.heappop(heap)
-        leader1 = leaders[index1]
-        leader2 = leaders[index2]
 
-        if leader1 != leader2 and index1 not in explored:
+        if not clusters.connected(index1, index2) and index1 not in explored:
             explored.add(index1)
-            for node in clusters[leader2]:
-                clusters[leader1].add(node)
-                leaders[node] = leader1
-                if node in clusters:
-                    del clusters[node]
-
-    labels = [0 for _ in xrange(len(leaders))]
-    keys = list(clusters.keys())
-    for leader in clusters:
-        for node in clusters[leader]:
-            labels[node] = keys.index(leader)
+            clusters.union(index1, index2)
+
+    labels = [0 for _ in xrange(len(data))]
+    for label, nodes in enumerate(clusters.groups()):
+        for node in nodes:
+            labels[node] = label
 
     return labels
 
@@ -1,14 +1,17 @@
 from collections import defaultdict
-import cv2
+import copy
 from itertools import izip
+import logging
 
 import numpy as np
 from pubsub import pub
 
-from ..functions import utility, calculations, tracking
+from ..functions import utility, calculations, tracking, sparse
 from ..settings import settings
 from ..models import table
 
+logger = logging.getLogger("logger")
+
 # from memory_profiler import profile
 
 class Contacts(object):
@@ -21,6 +24,10 @@ class Contacts(object):
                                                   subject_id=self.subject_id,
                                                   session_id=self.session_id,
                                                   measurement_id=self.measurement_id)
+        self.tracking_table = table.TrackingTable(table=self.table,
+                                                  subject_id=self.subject_id,
+                                                  session_id=self.session_id,
+                                                  measurement_id=self.measurement_id)
 
     def create_contacts(self, contacts):
         """
@@ -144,37 +151,37 @@ class Contacts(object):
     # @profile
     def track_contacts(self, measurement, measurement_data, plate):
         pub.sendMessage("update_statusbar", status="Starting tracking")
-        # Add padding to the measurement
-        x = measurement.number_of_rows
-        y = measurement.number_of_columns
-        z = measurement.number_of_frames
-        padding_factor = settings.settings.padding_factor()
-        data = np.zeros((x + 2 * padding_factor, y + 2 * padding_factor, z), np.float32)
-        data[padding_factor:-padding_factor, padding_factor:-padding_factor, :] = measurement_data
-        raw_contacts = tracking.track_contours_graph(data)
-
-        contacts = []
-        # Convert them to class objects
-        for index, raw_contact in enumerate(raw_contacts):
-            contact = Contact(subject_id=self.subject_id,
+        components, features = None, None
+        key = tracking_key(measurement)
+        if (self.subject_id, self.session_id, self.measurement_id, key) not in tracking.stage_cache:
+            # Resume from the components we've stored, so we don't have to find the contours again
+            components, features = self.get_components(key)
+            if components is None:
+                measurement_data = read_measurement_data(measurement, measurement_data)
+                components, features = track_components(measurement, measurement_data)
+                self.store_components(key, components)
+        return track_contacts(measurement=measurement,
+                              measurement_data=measurement_data,
+                              plate=plate,
+                              subject_id=self.subject_id,
                               session_id=self.session_id,
-                              measurement_id=self.measurement_id)
-            contact.create_contact(contact=raw_contact,
-                                   measurement_data=measurement_data,
-                                   orientation=measurement.orientation)
-            contact.calculate_results(plate=plate, measurement=measurement)
-            # Skip contacts that have only been around for one frame
-            if contact.length > 1:
-                contacts.append(contact)
+                              measurement_id=self.measurement_id,
+                              components=components,
+                              features=features)
 
-        # Sort the contacts based on their position along the first dimension
-        contacts = sorted(contacts, key=lambda contact: contact.min_z)
-        # We don't calculate the spatiotemporal results, because there are no labels yet to do so
+    def get_components(self, key):
+        """
+        Returns the stored components and their ContourFeatures or (None, None) if they weren't tracked
+        with the same tracker version and settings as key (see tracking_key)
+        """
+        arrays = self.tracking_table.get_components(key)
+        if arrays is None:
+            return None, None
+        features = tracking.ContourFeatures()
+        return tracking.unpack_components(arrays, features=features), features
 
-        # Update their index
-        for contact_id, contact in enumerate(contacts):
-            contact.contact_id = "contact_{}".format(contact_id)
-        return contacts
+    def store_components(self, key, components):
+        self.tracking_table.store_components(key, tracking.pack_components(components))
 
     def verify_contacts(self, contacts):
         """
@@ -276,6 +283,273 @@ class Contacts(object):
                 contact.diag_duration = diag_contact[2]
 
 
+def tracking_window(measurement):
+    """
+    Returns the window size if measurement is long enough to be tracked a window at a time, else None
+    """
+    window = settings.settings.tracking_window()
+    return window if window and measurement.number_of_frames > window else None
+
+
+def tracking_key(measurement):
+    """
+    Describes the tracker version and everything from the settings that affects the unmerged components,
+    if any of these change, the components have to be tracked again
+    """
+    window = tracking_window(measurement)
+    denoising = settings.settings.denoising()
+    return "version={} shape={} padding={} engine={} linking={} connectivity={} window={} denoising={}".format(
+        tracking.tracker_version,
+        (measurement.number_of_rows, measurement.number_of_columns, measurement.number_of_frames),
+        settings.settings.padding_factor(), settings.settings.tracking_engine(), settings.settings.tracking_linking(),
+        settings.settings.tracking_connectivity(),
+        (window, settings.settings.tracking_window_overlap()) if window else None,
+        (settings.settings.denoising_min_area(), settings.settings.denoising_persistence()) if denoising else None)
+
+
+def read_measurement_data(measurement, measurement_data):
+    """
+    Unless we track measurement a window at a time, we need all the frames of a lazy MeasurementData object anyway
+    """
+    if hasattr(measurement_data, "read") and not tracking_window(measurement):
+        return measurement_data.read()
+    return measurement_data
+
+
+def track_components(measurement, measurement_data):
+    """
+    Finds the contours in measurement_data and links them into components, without merging them.
+    Returns the components and the ContourFeatures of their contours.
+    """
+    x = measurement.number_of_rows
+    y = measurement.number_of_columns
+    z = measurement.number_of_frames
+    padding_factor = settings.settings.padding_factor()
+    window = tracking_window(measurement)
+    # Calculate the bounding boxes of the contours once, both tracking and creating the contacts need them
+    features = tracking.ContourFeatures()
+    # Keep track of how much noise the denoising removes, if it's turned on
+    statistics = {} if settings.settings.denoising() else None
+    if window:
+        # Long measurements are tracked a window at a time, so we never need a padded copy of all the frames.
+        # A lazy MeasurementData object only reads the frames of the current window.
+        components = tracking.track_contours_windowed(measurement_data, window=window,
+                                                      overlap=settings.settings.tracking_window_overlap(),
+                                                      padding=padding_factor, features=features, merge=False,
+                                                      statistics=statistics)
+    else:
+        measurement_data = read_measurement_data(measurement, measurement_data)
+        # Add padding to the measurement
+        if isinstance(measurement_data, sparse.SparseMeasurement):
+            # No need to make a dense copy, just shift the sensor positions
+            data = measurement_data.pad(padding_factor)
+        else:
+            data = np.zeros((x + 2 * padding_factor, y + 2 * padding_factor, z), np.float32)
+            data[padding_factor:-padding_factor, padding_factor:-padding_factor, :] = measurement_data
+        components = tracking.track_contours(data, features=features, merge=False, statistics=statistics)
+    if statistics:
+        logger.info("contactmodel.track_components: Denoising {} removed {} of {} sensors and {} of {} blobs".format(
+            getattr(measurement, "measurement_name", measurement.measurement_id),
+            statistics["sensors_before"] - statistics["sensors_after"], statistics["sensors_before"],
+            statistics["blobs_before"] - statistics["blobs_after"], statistics["blobs_before"]))
+    return components, features
+
+
+def track_contacts(measurement, measurement_data, plate, subject_id, session_id, measurement_id,
+                   components=None, features=None):
+    """
+    Tracks the contacts in measurement_data and calculates their results.
+    If you pass the components (and their features) from track_components, we only have to merge them.
+    This doesn't touch the PyTables file or the GUI, so it can be used from worker processes.
+    """
+    measurement_data = read_measurement_data(measurement, measurement_data)
+    # If we've tracked this measurement before with the same settings, we only have to merge the components again
+    # The worker processes that import measurements don't have a measurement_id yet
+    cache_key = None
+    if measurement_id is not None:
+        cache_key = (subject_id, session_id, measurement_id, tracking_key(measurement))
+    if components is None and cache_key:
+        components, features = tracking.stage_cache.get(cache_key)
+    if components is None:
+        components, features = track_components(measurement, measurement_data)
+
+    if cache_key and cache_key not in tracking.stage_cache:
+        tracking.stage_cache.put(cache_key, components, features)
+    # Only this stage depends on the tracking thresholds
+    raw_contacts = tracking.merging_contacts(components, features=features)
+    if tracking_window(measurement):
+        raw_contacts = sorted(raw_contacts, key=min)
+
+    # Most contacts merge the same way as last time, so we can copy those instead of creating them again
+    created_contacts = tracking.stage_cache.results(cache_key) if cache_key else None
+    # Only keep the contacts of this time around, so the results don't keep growing
+    new_contacts = {}
+    contacts = []
+    # Convert them to class objects
+    for index, raw_contact in enumerate(raw_contacts):
+        signature = tracking.component_signature(raw_contact, features) if created_contacts is not None else None
+        if created_contacts is not None and signature in created_contacts:
+            contact = copy.deepcopy(created_contacts[signature])
+            new_contacts[signature] = created_contacts[signature]
+            # The start and end force percentages might have changed since
+            contact.validate_contact(measurement_data)
+        else:
+            contact = Contact(subject_id=subject_id,
+                              session_id=session_id,
+                              measurement_id=measurement_id)
+            contact.create_contact(contact=raw_contact,
+                                   measurement_data=measurement_data,
+                                   orientation=measurement.orientation,
+                                   features=features)
+            contact.calculate_results(plate=plate, measurement=measurement)
+            if created_contacts is not None:
+                # Store a copy, because the contact will get labeled
+                new_contacts[signature] = copy.deepcopy(contact)
+        # Skip contacts that have only been around for one frame
+        if contact.length > 1:
+            contacts.append(contact)
+    if created_contacts is not None:
+        tracking.stage_cache.set_results(cache_key, new_contacts)
+
+    # Sort the contacts based on their position along the first dimension
+    contacts = sorted(contacts, key=lambda contact: contact.min_z)
+    # We don't calculate the spatiotemporal results, because there are no labels yet to do so
+
+    # Update their index
+    for contact_id, contact in enumerate(contacts):
+        contact.contact_id = "contact_{}".format(contact_id)
+    return contacts
+
+
+def box_overlap(contact1, contact2):
+    """
+    Returns the intersection over union of the bounding boxes (including the frames) of two contacts
+    """
+    intersection, volume1, volume2 = 1., 1., 1.
+    for start1, stop1, start2, stop2 in [(contact1.min_x, contact1.max_x, contact2.min_x, contact2.max_x),
+                                         (contact1.min_y, contact1.max_y, contact2.min_y, contact2.max_y),
+                                         (contact1.min_z, contact1.max_z + 1, contact2.min_z, contact2.max_z + 1)]:
+        intersection *= max(0, min(stop1, stop2) - max(start1, start2))
+        volume1 *= stop1 - start1
+        volume2 *= stop2 - start2
+    union = volume1 + volume2 - intersection
+    return intersection / union if union > 0 else 0.
+
+
+def transfer_labels(old_contacts, new_contacts, min_overlap=0.5):
+    """
+    Gives the new contacts the labels of the old contacts they match with, so re-tracking doesn't throw away
+    the labeling. Two contacts match if their bounding boxes overlap for at least min_overlap (intersection over
+    union), the best matches go first and every old contact only passes on its label once.
+    Returns the number of contacts that got a label.
+    """
+    pairs = []
+    for old_index, old_contact in enumerate(old_contacts):
+        # -2 means unlabeled, so there's nothing to pass on
+        if old_contact.contact_label == -2:
+            continue
+        for new_index, new_contact in enumerate(new_contacts):
+            overlap = box_overlap(old_contact, new_contact)
+            if overlap >= min_overlap:
+                pairs.append((overlap, old_index, new_index))
+
+    used_old, used_new = set(), set()
+    for overlap, old_index, new_index in sorted(pairs, reverse=True):
+        if old_index in used_old or new_index in used_new:
+            continue
+        new_contacts[new_index].contact_label = old_contacts[old_index].contact_label
+        used_old.add(old_index)
+        used_new.add(new_index)
+    return len(used_new)
+
+
+class FrameBuffer(object):
+    """
+    Holds the most recent frames of a measurement that's still being recorded. It can be indexed like
+    measurement_data[min_x:max_x, min_y:max_y, frame], as long as the frame hasn't been dropped yet.
+    """
+
+    def __init__(self):
+        self.frames = {}
+        self.number_of_frames = 0
+        self.frame_shape = None
+
+    @property
+    def shape(self):
+        return self.frame_shape + (self.number_of_frames,)
+
+    def append(self, frame_data):
+        self.frame_shape = frame_data.shape
+        self.frames[self.number_of_frames] = frame_data
+        self.number_of_frames += 1
+
+    def drop(self, first_frame):
+        """
+        Removes all the frames before first_frame
+        """
+        for frame in [frame for frame in self.frames if frame < first_frame]:
+            del self.frames[frame]
+
+    def __getitem__(self, key):
+        x, y, frame = key
+        return self.frames[frame][x, y]
+
+
+class OnlineContactTracker(object):
+    """
+    Tracks the contacts of a measurement while it's being recorded. Every time you push a frame, you get back
+    the Contacts that have finished, with their results calculated just like track_contacts does.
+    We only keep the frames of the contacts that are still open, so memory doesn't grow with the length
+    of the measurement. The measurement needs a frequency and orientation.
+    """
+
+    def __init__(self, measurement, plate, subject_id, session_id, measurement_id, gap=None):
+        self.measurement = measurement
+        self.plate = plate
+        self.subject_id = subject_id
+        self.session_id = session_id
+        self.measurement_id = measurement_id
+        self.tracker = tracking.OnlineTracker(gap=gap, padding=settings.settings.padding_factor())
+        self.frames = FrameBuffer()
+        self.number_of_contacts = 0
+
+    def push(self, frame_data):
+        """
+        Adds the next (rows x columns) frame and returns a list of the Contacts that have finished
+        """
+        self.frames.append(frame_data)
+        contacts = self.create_contacts(self.tracker.push(frame_data))
+        # We no longer need the frames before the oldest open contact
+        self.frames.drop(self.tracker.first_open_frame())
+        return contacts
+
+    def finish(self):
+        """
+        Call this when the recording has stopped, returns the Contacts that were still open
+        """
+        contacts = self.create_contacts(self.tracker.finish())
+        self.frames.drop(self.frames.number_of_frames)
+        return contacts
+
+    def create_contacts(self, raw_contacts):
+        contacts = []
+        for raw_contact in raw_contacts:
+            contact = Contact(subject_id=self.subject_id,
+                              session_id=self.session_id,
+                              measurement_id=self.measurement_id)
+            contact.create_contact(contact=raw_contact,
+                                   measurement_data=self.frames,
+                                   orientation=self.measurement.orientation)
+            contact.calculate_results(plate=self.plate, measurement=self.measurement)
+            # Skip contacts that have only been around for one frame
+            if contact.length > 1:
+                # They're numbered in the order in which they finish
+                contact.contact_id = "contact_{}".format(self.number_of_contacts)
+                self.number_of_contacts += 1
+                contacts.append(contact)
+        return contacts
+
+
 class Contact(object):
     """
     This class has only one real function and that's to take a contact and create some
@@ -384,12 +658,18 @@ class Contact(object):
                                 "pressure_over_time",
                                 "cop_x", "cop_y", "vcop_xy", "vcop_x", "vcop_y", "max_of_max"]
 
-    def create_contact(self, contact, measurement_data, orientation):
+    def create_contact(self, contact, measurement_data, orientation, features=None):
         self.orientation = orientation  # True means the contact is upside down
+        # If we got the ContourFeatures from the tracking, we don't have to calculate the bounding boxes again
+        get_bounding_box = features.bounding_box if features is not None else utility.update_bounding_box
         frames = sorted(contact.keys())
+        frame_boxes = {}
         for frame in frames:
             # Adjust the contour for the padding
             contours = contact[frame]
+            _, min_x, max_x, min_y, max_y = get_bounding_box({frame: contours})
+            frame_boxes[frame] = (min_x - self.padding, max_x - self.padding,
+                                  min_y - self.padding, max_y - self.padding)
             self.contour_list[frame] = []
             for contour in contours:
                 if self.padding:
@@ -399,7 +679,7 @@ class Contact(object):
                     contour = np.array(new_contour)
                 self.contour_list[frame].append(contour)
 
-        _, min_x, max_x, min_y, max_y = utility.update_bounding_box(contact)
+        _, min_x, max_x, min_y, max_y = get_bounding_box(contact)
         # Subtract the amount of padding everywhere
         if self.padding:
             min_x -= self.padding
@@ -414,7 +694,7 @@ class Contact(object):
         self.min_z, self.max_z = frames[0], frames[-1]
 
         # Create self.measurement_data from the measurement_data
-        self.convert_contour_to_slice(measurement_data)
+        self.convert_contour_to_slice(measurement_data, frame_boxes=frame_boxes)
         # Check if the contact is valid
         self.validate_contact(measurement_data)
         # If the contact is upside down, fix that
@@ -422,26 +702,28 @@ class Contact(object):
             self.data = np.rot90(np.rot90(self.data))
 
     # @profile
-    def convert_contour_to_slice(self, measurement_data):
+    def convert_contour_to_slice(self, measurement_data, frame_boxes=None):
         """
         Creates self.measurement_data which contains the pixels that are enclosed by the contour
+        frame_boxes can contain the bounding box (min_x, max_x, min_y, max_y) of the contours in every frame
         """
         # Create an empty array that should fit the entire contact
         self.data = np.zeros((self.width, self.height, self.length))
 
         for index, (frame, contours) in enumerate(sorted(self.contour_list.iteritems())):
-            # Pass a single contour as if it were a contact
-            center, min_x, max_x, min_y, max_y = utility.update_bounding_box({frame: contours})
-            # Get the non_zero pixels coordinates for that frame
-            pixels = np.transpose(np.nonzero(measurement_data[min_x:max_x + 1, min_y:max_y + 1, frame]))
-            # Check if they are in any of the contours
-            for pixel in pixels:
-                for contour in contours:
-                    # Remember the coordinates are only for the slice, so we need to add padding
-                    coordinate = (min_x + pixel[0], min_y + pixel[1])
-                    if cv2.pointPolygonTest(contour, coordinate, 0) > -1.0:
-                        self.data[coordinate[0] - self.min_x, coordinate[1] - self.min_y, index] = measurement_data[
-                            coordinate[0], coordinate[1], frame]
+            if frame_boxes is not None:
+                min_x, max_x, min_y, max_y = frame_boxes[frame]
+            else:
+                # Pass a single contour as if it were a contact
+                center, min_x, max_x, min_y, max_y = utility.update_bounding_box({frame: contours})
+            min_x, max_x, min_y, max_y = int(min_x), int(max_x), int(min_y), int(max_y)
+            # Fill the contours in a mask of their bounding box, which is transposed just like the contours
+            mask = tracking.label_contours(contours, shape=(max_y - min_y, max_x - min_x),
+                                           offset=(-min_x, -min_y)).T > 0
+            # Copy the pixels that are enclosed by the contours
+            x, y = np.nonzero(mask)
+            frame_data = measurement_data[min_x:max_x, min_y:max_y, frame]
+            self.data[x + min_x - self.min_x, y + min_y - self.min_y, index] = frame_data[x, y]
 
     def calculate_results(self, plate, measurement):
         """
@@ -582,6 +864,21 @@ class MockContacts(Contacts):
         self.measurement_id = measurement_id
         # We don't want to call super, because we don't want a table connection
         # super(MockContacts, self).__init__(subject_id, session_id, measurement_id)
+        self.tracking_table = MockTrackingTable()
+
+
+class MockTrackingTable(object):
+    """
+    Keeps the components in memory instead of storing them like table.TrackingTable
+    """
+    def __init__(self):
+        self.components = {}
+
+    def store_components(self, key, arrays):
+        self.components = {key: arrays}
+
+    def get_components(self, key):
+        return self.components.get(key)
 
 
 class MockContact(Contact):
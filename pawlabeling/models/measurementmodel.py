@@ -1,7 +1,15 @@
+import os
+import logging
+
+import numpy as np
+import tables
+
 from ..models import table
-from ..functions import io, calculations
+from ..functions import io, calculations, cache, sparse, tracking
 from ..settings import settings
 
+logger = logging.getLogger("logger")
+
 class Measurements(object):
     def __init__(self, subject_id, session_id):
         self.subject_id = subject_id
@@ -14,14 +22,8 @@ class Measurements(object):
     def create_measurement(self, measurement, plates):
         measurement_object = Measurement(subject_id=self.subject_id, session_id=self.session_id)
 
-        # Be sure to strip the zip of if its there
-        measurement_name = measurement["measurement_name"]
-        if measurement_name[-3:] == "zip":
-            measurement_name = measurement_name[:-4]
-
         # If it already exists, restore the Measurement object and return that
-        result = self.measurements_table.get_measurement(measurement_name=measurement_name)
-        if result:
+        if self.measurement_exists(measurement):
             return
 
         measurement_id = self.measurements_table.get_new_id()
@@ -39,6 +41,21 @@ class Measurements(object):
         self.measurement_group = self.measurements_table.create_measurement(**measurement)
         return measurement_object
 
+    def measurement_exists(self, measurement):
+        # Be sure to strip the zip of if its there
+        measurement_name = strip_measurement_name(measurement["measurement_name"])
+        result = self.measurements_table.get_measurement(measurement_name=measurement_name)
+        return True if result else False
+
+    def store_measurement(self, measurement_object):
+        """
+        Stores a measurement that was created by import_measurement, giving it a new measurement_id
+        """
+        measurement_object.measurement_id = self.measurements_table.get_new_id()
+        self.measurement_group = self.measurements_table.create_measurement(**measurement_object.to_dict())
+        self.create_measurement_data(measurement_object, measurement_object.measurement_data)
+        return measurement_object
+
     def delete_measurement(self, measurement):
         # Delete both the row and the group
         self.measurements_table.remove_row(table=self.measurements_table.measurements_table,
@@ -46,6 +63,8 @@ class Measurements(object):
                                            item_id=measurement.measurement_id)
         self.measurements_table.remove_group(where="/{}/{}".format(self.subject_id, self.session_id),
                                              name=measurement.measurement_id)
+        # Its id might get reused, so don't let the next measurement reuse its tracking either
+        tracking.stage_cache.discard((self.subject_id, self.session_id, measurement.measurement_id))
         # If we've removed all the sessions, clean up after yourself
         try:
             self.measurements_table.get_measurements()
@@ -69,16 +88,33 @@ class Measurements(object):
         return measurements
 
     def create_measurement_data(self, measurement, measurement_data):
+        # Most sensors are zero most of the time, so this usually takes up a lot less space
+        measurement_data = sparse.compress(measurement_data)
         self.measurements_table.store_data(group=self.measurement_group,
                                            item_id=measurement.measurement_id,
                                            data=measurement_data)
+        # Store the force and number of active sensors of every frame next to it, so we never have to recalculate them
+        for item_id in ["frame_sums", "frame_counts"]:
+            data = getattr(measurement, item_id, None)
+            if data is not None:
+                self.measurements_table.store_data(group=self.measurement_group, item_id=item_id, data=data)
 
     def get_measurement_data(self, measurement):
+        """
+        Returns a MeasurementData object, which only reads the frames from the PyTables file when they're requested.
+        We hold on to it on the measurement, so we don't have to calculate its maximal projection twice.
+        """
+        measurement_data = getattr(measurement, "measurement_data", None)
+        if isinstance(measurement_data, MeasurementData):
+            return measurement_data
+
         group = self.measurements_table.get_group(self.measurements_table.session_group,
                                                   measurement.measurement_id)
         item_id = measurement.measurement_id
-        measurement_data = self.measurements_table.get_data(group=group, item_id=item_id)
-        return measurement_data
+        if not hasattr(group, item_id):
+            return None
+        measurement.measurement_data = MeasurementData(group.__getattr__(item_id))
+        return measurement.measurement_data
 
     def update_n_max(self):
         n_max = 0
@@ -91,6 +127,131 @@ class Measurements(object):
     def update(self, measurement):
         self.measurements_table.update_measurement(item_id=measurement.measurement_id, **measurement.to_dict())
 
+class MeasurementData(object):
+    """
+    Lazy wrapper around a measurement stored in the PyTables file, either as a CArray or as the group of
+    a SparseMeasurement. Indexing it reads only the requested frames, the maximal projection gets cached.
+    """
+    # Number of frames we read at once when we have to go through the whole measurement
+    block_size = 64
+
+    def __init__(self, node):
+        self.node = node
+        self.sparse = isinstance(node, tables.Group)
+        if self.sparse:
+            self.shape = tuple(int(size) for size in node._v_attrs.shape)
+            self.dtype = node.values.dtype
+            # The frame offsets are tiny, the indices and values are only read when we need them
+            self.indptr = node.indptr.read()
+        else:
+            self.shape = node.shape
+            self.dtype = node.dtype
+        self.ndim = 3
+        self._max_projection = None
+        self._summary = None
+
+    def frame(self, index):
+        """
+        Returns a dense (rows x columns) copy of frame index
+        """
+        rows, columns, frames = self.shape
+        if index < 0:
+            index += frames
+        if not self.sparse:
+            return self.node[:, :, index]
+
+        start, stop = self.indptr[index], self.indptr[index + 1]
+        result = np.zeros(rows * columns, dtype=self.dtype)
+        result[self.node.indices[start:stop]] = self.node.values[start:stop]
+        return result.reshape((rows, columns))
+
+    def frames(self, start, stop):
+        """
+        Returns a dense (rows x columns x stop - start) copy of the frames from start till stop
+        """
+        if not self.sparse:
+            return self.node[:, :, start:stop]
+
+        block = np.zeros(self.shape[:2] + (stop - start,), dtype=self.dtype)
+        for index, frame in enumerate(xrange(start, stop)):
+            block[:, :, index] = self.frame(frame)
+        return block
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != 3:
+            return self.toarray()[key]
+
+        x, y, z = key
+        if isinstance(z, (int, long, np.integer)):
+            return self.frame(z)[x, y]
+        if isinstance(z, slice) and z.step in (None, 1):
+            start, stop, _ = z.indices(self.shape[2])
+            return self.frames(start, max(start, stop))[x, y]
+        return self.toarray()[key]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def max_projection(self):
+        """
+        Returns the maximal value of every sensor, reading the measurement a block of frames at a time
+        """
+        if self._max_projection is None:
+            if self.sparse:
+                self._max_projection = self.read().max_projection()
+            else:
+                frames = self.shape[2]
+                self._max_projection = np.zeros(self.shape[:2], dtype=self.dtype)
+                for start in xrange(0, frames, self.block_size):
+                    block = self.frames(start, min(start + self.block_size, frames))
+                    np.maximum(self._max_projection, block.max(axis=2), out=self._max_projection)
+        return self._max_projection
+
+    def max(self, axis=None):
+        if axis == 2:
+            return self.max_projection()
+        if axis is None:
+            return self.max_projection().max()
+        return self.toarray().max(axis=axis)
+
+    def frame_sums(self):
+        """
+        Returns the total force of every frame
+        """
+        return self.get_summary_data("frame_sums")
+
+    def frame_counts(self):
+        """
+        Returns the number of nonzero sensors in every frame
+        """
+        return self.get_summary_data("frame_counts")
+
+    def get_summary_data(self, item_id):
+        # They're stored next to the measurement, unless it was imported before we started storing them
+        group = self.node._v_parent
+        if hasattr(group, item_id):
+            return group.__getattr__(item_id).read()
+        if self._summary is None:
+            self._summary = calculations.summarize_measurement(self, block_size=self.block_size)
+        return self._summary[item_id]
+
+    def read(self):
+        """
+        Returns the whole measurement the way its stored: a dense array or a SparseMeasurement
+        """
+        if self.sparse:
+            return sparse.SparseMeasurement(shape=self.shape, indptr=self.indptr,
+                                            indices=self.node.indices.read(),
+                                            values=self.node.values.read())
+        return self.node.read()
+
+    def toarray(self):
+        data = self.read()
+        if isinstance(data, sparse.SparseMeasurement):
+            data = data.toarray()
+        return data
+
+
 class Measurement(object):
     def __init__(self, subject_id, session_id):
         self.subject_id = subject_id
@@ -103,15 +264,11 @@ class Measurement(object):
         measurement_name = measurement["measurement_name"]
 
         # Strip the .zip from the measurement_name
-        if measurement_name[-3:] == "zip":
-            self.zipped = True
-            self.measurement_name = measurement_name[:-4]
-        else:
-            self.zipped = False
-            self.measurement_name = measurement_name
-
-        # Get the raw string from the file path
-        input_file = self.load_file_path(file_path=file_path)
+        self.measurement_name = strip_measurement_name(measurement_name)
+        # Archives with multiple measurements don't have .zip at the end of their measurement_name
+        self.zipped = file_path[-3:] == "zip"
+        # The model zips the file in the background once the measurement has been stored
+        self.file_path = file_path
 
         # Get the plate info, so we can get the brand
         self.plate_id = measurement["plate_id"]
@@ -121,30 +278,57 @@ class Measurement(object):
         self.time = measurement["time"]
         self.processed = False
 
-        # Extract the measurement_data
-        self.measurement_data = io.load(input_file, brand=self.plate.brand)
-        # io.load only logs when there's an exception and returns None
+        # Check whether the file matches the plate, before we spend any time on reading the whole thing
+        member = measurement.get("member")
+        file_format = io.detect_file_format(file_path, member=member)
+        if file_format is not None and file_format != self.plate.brand:
+            message = "{} looks like a {} file, but the plate is a {}".format(self.measurement_name, file_format,
+                                                                             self.plate.brand)
+            logger.error(message)
+            raise Exception(message)
+
+        # If we've parsed this file before, we can get a memory-mapped copy from the cache
+        cache_key = cache.get_key(file_path, member=member, brand=self.plate.brand)
+        self.measurement_data, summary = cache.load(cache_key, settings.settings.cache_folder())
         if self.measurement_data is None:
-            raise Exception
+            self.measurement_data, summary = self.load_measurement_data(file_path, member)
+            cache.store(cache_key, self.measurement_data, summary,
+                        cache_folder=settings.settings.cache_folder(),
+                        cache_size=settings.settings.cache_size())
 
         self.number_of_rows, self.number_of_columns, self.number_of_frames = self.measurement_data.shape
-        self.orientation = calculations.check_orientation(self.measurement_data)
-        self.maximum_value = self.measurement_data.max()  # Perhaps round this and store it as an int?
+        self.orientation = summary["orientation"]
+        self.maximum_value = summary["maximum_value"]  # Perhaps round this and store it as an int?
+        self.first_frame = summary["first_frame"]
+        self.last_frame = summary["last_frame"]
+        # The cache gives us lists
+        self.frame_sums = np.asarray(summary["frame_sums"], dtype=np.float64)
+        self.frame_counts = np.asarray(summary["frame_counts"], dtype=np.int64)
         self.frequency = measurement["frequency"]
 
-    def load_file_path(self, file_path):
-        # Check if the file is zipped or not and extract the raw measurement_data
-        if self.zipped:
-            # Unzip the file
-            input_file = io.open_zip_file(file_path)
-        else:
-            with open(file_path, "r") as infile:
-                input_file = infile.read()
+    def load_measurement_data(self, file_path, member=None):
+        # Get a file-like object for the file path
+        input_file = self.load_file_path(file_path=file_path, member=member)
+
+        # Extract the measurement_data, the loaders parse the file while its being read
+        try:
+            measurement_data = io.load(input_file, brand=self.plate.brand)
+        finally:
+            input_file.close()
+        # io.load only logs when there's an exception and returns None
+        if measurement_data is None:
+            raise Exception
 
-            # If the user wants us to zip it, zip it so they don't keep taking up so much space!
-            if settings.settings.zip_files():
-                io.zip_file(file_path)
+        summary = calculations.summarize_measurement(measurement_data)
+        return measurement_data, summary
 
+    def load_file_path(self, file_path, member=None):
+        # Check if the file is zipped or not and return a stream of the raw measurement_data
+        if self.zipped:
+            # Decompress the member while its being read
+            input_file = io.open_zip_member(file_path, member=member)
+        else:
+            input_file = open(file_path, "rb")
         return input_file
 
     def restore(self, measurement):
@@ -165,11 +349,142 @@ class Measurement(object):
             "frequency": self.frequency,
             "orientation": self.orientation,
             "maximum_value": self.maximum_value,
+            "first_frame": self.first_frame,
+            "last_frame": self.last_frame,
             "date": self.date,
             "time": self.time,
             "processed": self.processed
         }
 
+def strip_measurement_name(measurement_name):
+    """
+    Returns the name a measurement gets stored under: its file name without .zip
+    """
+    if measurement_name[-3:] == "zip":
+        return measurement_name[:-4]
+    return measurement_name
+
+
+def unique_measurements(measurements):
+    """
+    Returns the measurement dictionaries without the ones that would be stored under the same name
+    as an earlier one, like x.txt and x.txt.zip
+    """
+    measurement_names = set()
+    result = []
+    for measurement in measurements:
+        measurement_name = strip_measurement_name(measurement["measurement_name"])
+        if measurement_name not in measurement_names:
+            measurement_names.add(measurement_name)
+            result.append(measurement)
+    return result
+
+
+def import_measurement(job):
+    """
+    Input: tuple with the subject_id, session_id, measurement dictionary, the plates
+    and the settings from Settings.worker_settings
+    Output: the Measurement and its tracked contacts or (None, None) if it couldn't be loaded
+
+    This is used by the worker processes of Model.create_measurements, so it shouldn't touch
+    the PyTables file or the GUI. Settings only opens the PyTables file when its table is used
+    and the settings we need come with the job. The measurement_id gets assigned when the results are stored.
+    """
+    from . import contactmodel
+
+    subject_id, session_id, measurement, plates, worker_settings = job
+    measurement_object = Measurement(subject_id=subject_id, session_id=session_id)
+    try:
+        with settings.settings.overridden(worker_settings):
+            measurement_object.create_measurement(measurement_id=None, measurement=measurement, plates=plates)
+            contacts = contactmodel.track_contacts(measurement=measurement_object,
+                                                   measurement_data=measurement_object.measurement_data,
+                                                   plate=measurement_object.plate,
+                                                   subject_id=subject_id,
+                                                   session_id=session_id,
+                                                   measurement_id=None)
+    except Exception as e:
+        logger.warning("Couldn't import {}. Exception: {}".format(measurement["measurement_name"], e))
+        return None, None
+
+    # Sending back a sparse copy is a lot cheaper than pickling the (memory-mapped) dense array
+    measurement_object.measurement_data = sparse.compress(measurement_object.measurement_data)
+    return measurement_object, contacts
+
+
+def share_measurement_data(measurement_data, folder, name):
+    """
+    Writes measurement_data (a dense array or a SparseMeasurement) to .npy files in folder, so worker processes
+    can memory-map them instead of getting their own pickled copy. Returns a dictionary with the paths.
+    """
+    if isinstance(measurement_data, sparse.SparseMeasurement):
+        arrays = {"indptr": measurement_data.indptr,
+                  "indices": measurement_data.indices,
+                  "values": measurement_data.values}
+    else:
+        arrays = {"data": np.asarray(measurement_data, dtype=np.float32)}
+
+    paths = {"shape": tuple(measurement_data.shape)}
+    for key, array in arrays.items():
+        paths[key] = os.path.join(folder, "{}_{}.npy".format(name, key))
+        np.save(paths[key], array)
+    return paths
+
+
+def load_shared_measurement_data(paths):
+    """
+    Returns the read-only memory-mapped measurement_data that share_measurement_data wrote
+    """
+    if "data" in paths:
+        return np.load(paths["data"], mmap_mode="r")
+    return sparse.SparseMeasurement(shape=paths["shape"],
+                                    indptr=np.load(paths["indptr"], mmap_mode="r"),
+                                    indices=np.load(paths["indices"], mmap_mode="r"),
+                                    values=np.load(paths["values"], mmap_mode="r"))
+
+
+def track_measurement(job):
+    """
+    Input: tuple with the subject_id, session_id, the measurement's dictionary (see Measurement.to_dict),
+    the plate, the paths of its shared measurement_data, its stored components
+    (see tracking.pack_components) or None if they have to be tracked again and the settings from
+    Settings.worker_settings
+    Output: the measurement_id, its tracked contacts or None if tracking failed
+    and the packed components if they had to be tracked again, so they can be stored
+
+    This is used by the worker processes of Model.track_session, so just like import_measurement
+    it shouldn't touch the PyTables file or the GUI.
+    """
+    from . import contactmodel
+
+    subject_id, session_id, measurement, plate, paths, arrays, worker_settings = job
+    measurement_object = Measurement(subject_id=subject_id, session_id=session_id)
+    measurement_object.restore(measurement)
+    try:
+        with settings.settings.overridden(worker_settings):
+            measurement_data = load_shared_measurement_data(paths)
+            if arrays is not None:
+                # Only merging depends on the thresholds, so we don't have to find the contours again
+                features = tracking.ContourFeatures()
+                components = tracking.unpack_components(arrays, features=features)
+                arrays = None
+            else:
+                components, features = contactmodel.track_components(measurement_object, measurement_data)
+                arrays = tracking.pack_components(components)
+            contacts = contactmodel.track_contacts(measurement=measurement_object,
+                                                   measurement_data=measurement_data,
+                                                   plate=plate,
+                                                   subject_id=subject_id,
+                                                   session_id=session_id,
+                                                   measurement_id=measurement_object.measurement_id,
+                                                   components=components,
+                                                   features=features)
+    except Exception as e:
+        logger.warning("Couldn't track {}. Exception: {}".format(measurement["measurement_name"], e))
+        return measurement_object.measurement_id, None, None
+    return measurement_object.measurement_id, contacts, arrays
+
+
 class MockMeasurement(object):
     def __init__(self, measurement_id, data, frequency):
         self.measurement_id = measurement_id
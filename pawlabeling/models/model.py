@@ -1,8 +1,14 @@
 from collections import defaultdict
+import os
+import shutil
+import tempfile
+import itertools
+import multiprocessing
 # import numpy as np
 import pandas as pd
 from pubsub import pub
 # from ..functions import utility, io, tracking, calculations
+from ..functions import io
 from ..settings import settings
 from ..models import table, subjectmodel, sessionmodel, measurementmodel, contactmodel, platemodel
 # from memory_profiler import profile
@@ -55,6 +61,7 @@ class Model():
         self.outlier_toggle = False
         self.average_toggle = False
         self.dataframe = None
+        self.zip_queue = None
 
         # Various
         pub.subscribe(self.changed_settings, "changed_settings")
@@ -93,6 +100,95 @@ class Model():
 
         self.create_measurement_data(measurement, measurement_data)
         self.create_contacts(measurement, measurement_data, plate)
+        self.zip_measurement(measurement)
+
+    def create_measurements(self, measurements):
+        """
+        Parses and tracks the measurements in a pool of worker processes, while this process
+        stores the results in the PyTables file one at a time and in their original order.
+        """
+        if not self.session_id:
+            pub.sendMessage("update_statusbar", status="Model.create_measurements: Session not selected")
+            pub.sendMessage("message_box", message="Please select a session")
+            return
+
+        self.measurement_model = measurementmodel.Measurements(subject_id=self.subject_id,
+                                                               session_id=self.session_id)
+        # Only the measurements we haven't imported yet and only once if several files get the same name
+        measurements = [measurement for measurement in measurementmodel.unique_measurements(measurements)
+                        if not self.measurement_model.measurement_exists(measurement)]
+        if not measurements:
+            return
+
+        # The workers get the settings with their jobs, so they never have to open the PyTables file
+        worker_settings = settings.settings.worker_settings()
+        jobs = [(self.subject_id, self.session_id, measurement, self.plates, worker_settings)
+                for measurement in measurements]
+        processes = min(settings.settings.import_processes(), len(jobs))
+        if processes > 1:
+            pool = multiprocessing.Pool(processes=processes)
+            results = pool.imap(measurementmodel.import_measurement, jobs)
+        else:
+            pool = None
+            results = itertools.imap(measurementmodel.import_measurement, jobs)
+
+        try:
+            for index, (measurement, contacts) in enumerate(results):
+                if measurement is not None:
+                    self.store_measurement(measurement, contacts)
+                pub.sendMessage("update_progress", progress=(index + 1) * 100. / len(jobs))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        status = self.zip_status()
+        if status["pending"]:
+            pub.sendMessage("update_statusbar",
+                            status="Zipping {} measurements in the background".format(status["pending"]))
+
+    def store_measurement(self, measurement, contacts):
+        """
+        Stores a measurement and its contacts that were created by measurementmodel.import_measurement
+        """
+        self.measurement_model.store_measurement(measurement)
+        for contact in contacts:
+            contact.measurement_id = measurement.measurement_id
+
+        self.contact_model = contactmodel.Contacts(subject_id=self.subject_id,
+                                                   session_id=self.session_id,
+                                                   measurement_id=measurement.measurement_id)
+        self.contact_model.create_contacts(contacts)
+        self.contacts[measurement.measurement_name] = contacts
+        status = "Measurement {} created, number of contacts found: {}".format(measurement.measurement_name,
+                                                                               len(contacts))
+        pub.sendMessage("update_statusbar", status=status)
+        settings.settings.logger.info("model.store_measurement: {}".format(status))
+        self.zip_measurement(measurement)
+
+    def zip_measurement(self, measurement):
+        """
+        If the user wants us to zip the measurement's file, queue it so it gets zipped in the background
+        """
+        if measurement.zipped or not settings.settings.zip_files():
+            return
+
+        if self.zip_queue is None:
+            self.zip_queue = io.ZipQueue(workers=settings.settings.zip_workers(),
+                                         compress_level=settings.settings.zip_compress_level())
+        self.zip_queue.put(measurement.file_path)
+
+    def zip_status(self):
+        """
+        Returns how many files are still waiting to be zipped and how many were zipped or failed
+        """
+        if self.zip_queue is None:
+            return {"pending": 0, "zipped": 0, "failed": 0}
+        return self.zip_queue.status()
+
+    def wait_for_zip_queue(self):
+        if self.zip_queue is not None:
+            self.zip_queue.join()
 
     def create_measurement_data(self, measurement, measurement_data):
         self.measurement_model.create_measurement_data(measurement=measurement,
@@ -329,6 +425,72 @@ class Model():
         # Notify the measurement tree that something has changed
         pub.sendMessage("update_measurement_status")
 
+    def track_session(self):
+        """
+        Tracks the contacts of every measurement in the session again, in a pool of worker processes.
+        The measurement data is written to memory-mapped files (in shared memory if we can), so the workers
+        don't each get a pickled copy. Contacts that match the old ones keep their label.
+        Measurements that have their components stored only have to merge them again.
+        """
+        if not self.session_id or not self.measurements:
+            pub.sendMessage("update_statusbar", status="Model.track_session: Session not selected")
+            return
+
+        shared_folder = tempfile.mkdtemp(prefix="pawlabeling_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        pool = None
+        # Just like create_measurements, the workers get the settings with their jobs
+        worker_settings = settings.settings.worker_settings()
+        try:
+            jobs = []
+            measurements = {}
+            tracking_keys = {}
+            for measurement in self.measurements.values():
+                measurement_data = self.measurement_model.get_measurement_data(measurement)
+                if measurement_data is None:
+                    continue
+                paths = measurementmodel.share_measurement_data(measurement_data.read(), shared_folder,
+                                                                measurement.measurement_id)
+                tracking_keys[measurement.measurement_id] = contactmodel.tracking_key(measurement)
+                contact_model = self.contact_models[measurement.measurement_name]
+                arrays = contact_model.tracking_table.get_components(tracking_keys[measurement.measurement_id])
+                jobs.append((self.subject_id, self.session_id, measurement.to_dict(),
+                             self.plates[measurement.plate_id], paths, arrays, worker_settings))
+                measurements[measurement.measurement_id] = measurement
+            if not jobs:
+                return
+
+            processes = min(settings.settings.import_processes(), len(jobs))
+            if processes > 1:
+                pool = multiprocessing.Pool(processes=processes)
+                results = pool.imap_unordered(measurementmodel.track_measurement, jobs)
+            else:
+                results = itertools.imap(measurementmodel.track_measurement, jobs)
+
+            for index, (measurement_id, contacts, arrays) in enumerate(results):
+                measurement = measurements[measurement_id]
+                contact_model = self.contact_models[measurement.measurement_name]
+                if arrays is not None:
+                    contact_model.tracking_table.store_components(tracking_keys[measurement_id], arrays)
+                if contacts is not None:
+                    old_contacts = self.contacts.get(measurement.measurement_name, [])
+                    contactmodel.transfer_labels(old_contacts, contacts)
+                    contact_model.create_contacts(contacts)
+                    self.contacts[measurement.measurement_name] = contacts
+                pub.sendMessage("update_progress", progress=(index + 1) * 100. / len(jobs))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            shutil.rmtree(shared_folder, ignore_errors=True)
+
+        pub.sendMessage("update_statusbar", status="Tracked the contacts of {} measurements".format(len(jobs)))
+        settings.settings.logger.info("Model.track_session: Tracked {} measurements".format(len(jobs)))
+        # This notifies the other widgets that the contacts have been retrieved again
+        if self.measurement_name in self.contacts:
+            self.get_contacts()
+        # Notify the measurement tree that something has changed
+        pub.sendMessage("update_measurement_status")
+
     # TODO Make sure this function doesn't have to pass along data
     def load_contacts(self):
         """
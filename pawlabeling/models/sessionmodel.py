@@ -5,7 +5,7 @@ import numpy as np
 from pubsub import pub
 from ..models import table
 from ..settings import settings
-from ..functions import calculations, utility
+from ..functions import calculations, tracking, utility
 
 
 class Sessions(object):
@@ -33,6 +33,7 @@ class Sessions(object):
                                        item_id=session.session_id)
         self.sessions_table.remove_group(where="/{}".format(self.subject_id),
                                          name=session.session_id)
+        tracking.stage_cache.discard((self.subject_id, session.session_id))
         # If we've removed all the sessions, clean up after yourself
         try:
             self.sessions_table.get_sessions()
@@ -1,6 +1,7 @@
 import logging
 from ..models import table
 from ..settings import settings
+from ..functions import tracking
 
 
 class MissingIdentifier(Exception):
@@ -37,6 +38,7 @@ class Subjects(object):
                                        name_id="subject_id",
                                        item_id=subject.subject_id)
         self.subjects_table.remove_group(where="/", name=subject.subject_id)
+        tracking.stage_cache.discard((subject.subject_id,))
 
         # If we've removed all the sessions, clean up after yourself
         try:
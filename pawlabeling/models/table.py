@@ -1,6 +1,7 @@
 from collections import defaultdict
 import tables
 from tables.exceptions import ClosedNodeError, NoSuchNodeError, NodeError
+from ..functions import sparse
 
 class MissingIdentifier(Exception):
     pass
@@ -64,6 +65,9 @@ class Table(object):
     # This function can be used for measurement_data, contact_data and normalized_contact_data
     # Actually also for all the different results (at least the time series)
     def store_data(self, group, item_id, data):
+        if isinstance(data, sparse.SparseMeasurement):
+            return self.store_sparse_data(group, item_id, data)
+
         atom = tables.Atom.from_dtype(data.dtype)
         filters = tables.Filters(complib="blosc", complevel=9)
         data_array = self.table.create_carray(where=group, name=item_id,
@@ -71,13 +75,35 @@ class Table(object):
         data_array[:] = data
         self.table.flush()
 
+    def store_sparse_data(self, group, item_id, data):
+        """
+        Stores the arrays of a SparseMeasurement in a group of their own, with the shape as an attribute
+        """
+        sparse_group = self.create_group(parent=group, item_id=item_id)
+        sparse_group._v_attrs.shape = data.shape
+        filters = tables.Filters(complib="blosc", complevel=9)
+        for name in ["indptr", "indices", "values"]:
+            array = getattr(data, name)
+            data_array = self.table.create_carray(where=sparse_group, name=name,
+                                                 atom=tables.Atom.from_dtype(array.dtype),
+                                                 shape=array.shape, filters=filters)
+            data_array[:] = array
+        self.table.flush()
+
     def get_group(self, parent, group_id):
         return parent.__getattr__(group_id)
 
     def get_data(self, group, item_id):
         # We're calling read, because else we get a pytables object
         if hasattr(group, item_id):
-            return group.__getattr__(item_id).read()
+            node = group.__getattr__(item_id)
+            # Sparse data is stored as a group with the arrays of the SparseMeasurement
+            if isinstance(node, tables.Group):
+                return sparse.SparseMeasurement(shape=node._v_attrs.shape,
+                                                indptr=node.indptr.read(),
+                                                indices=node.indices.read(),
+                                                values=node.values.read())
+            return node.read()
 
     def remove_group(self, where, name, recursive=True):
         # Recursive remove is on by default
@@ -248,6 +274,9 @@ class MeasurementsTable(Table):
         frequency = tables.UInt32Col()
         orientation = tables.BoolCol()
         maximum_value = tables.FloatCol()
+        # The first and last frame with nonzero values, -1 if we don't know
+        first_frame = tables.Int32Col(dflt=-1)
+        last_frame = tables.Int32Col(dflt=-1)
         date = tables.StringCol(32)
         time = tables.StringCol(32)
         processed = tables.BoolCol()
@@ -462,6 +491,51 @@ class ContactDataTable(Table):
             contacts.append(contact_data)
         return contacts
 
+class TrackingTable(Table):
+    """
+    Stores the unmerged components of a measurement (see tracking.pack_components) in a tracking group
+    under the measurement's group. The group has the key of the tracker version and the settings
+    they were tracked with, if that doesn't match anymore, they have to be tracked again.
+    """
+    def __init__(self, table, subject_id, session_id, measurement_id):
+        super(TrackingTable, self).__init__(table=table)
+        self.table_name = "tracking"
+        self.subject_id = subject_id
+        self.session_id = session_id
+        self.measurement_id = measurement_id
+        self.session_group = self.table.root.__getattr__(self.subject_id).__getattr__(self.session_id)
+        self.measurement_group = self.session_group.__getattr__(measurement_id)
+        self.item_ids = ["points", "offsets", "frames", "labels"]
+
+    def store_components(self, key, arrays):
+        # create_group replaces any components we've stored before
+        group = self.create_group(parent=self.measurement_group, item_id=self.table_name)
+        group._v_attrs.key = key
+        for item_id in self.item_ids:
+            # A CArray can't be empty, which they are if there aren't any contours
+            if arrays[item_id].size:
+                self.store_data(group=group, item_id=item_id, data=arrays[item_id])
+            else:
+                self.table.create_array(where=group, name=item_id, obj=arrays[item_id])
+        self.table.flush()
+
+    def get_components(self, key):
+        """
+        Returns the arrays stored by store_components or None if there's nothing stored for key
+        """
+        if self.table_name not in self.measurement_group:
+            return None
+        group = self.measurement_group.__getattr__(self.table_name)
+        if getattr(group._v_attrs, "key", None) != key:
+            return None
+        arrays = {}
+        for item_id in self.item_ids:
+            arrays[item_id] = self.get_data(group=group, item_id=item_id)
+            if arrays[item_id] is None:
+                return None
+        return arrays
+
+
 class SessionDataTable(Table):
     class Contacts(tables.IsDescription):
         session_id = tables.StringCol(64)
@@ -1,6 +1,7 @@
 import os
 import sys
 from collections import defaultdict
+from contextlib import contextmanager
 from PySide import QtGui, QtCore
 from pubsub import pub
 import pkg_resources
@@ -12,6 +13,14 @@ __version__ = '0.2'
 # Using a global for now
 __human__ = False
 
+# The settings the worker processes need to import and track measurements, see Settings.worker_settings
+worker_setting_names = ["start_force_percentage", "end_force_percentage",
+                        "tracking_temporal", "tracking_spatial", "tracking_surface", "tracking_engine",
+                        "tracking_connectivity", "tracking_linking", "tracking_gap", "tracking_window",
+                        "tracking_window_overlap", "tracking_workers",
+                        "denoising", "denoising_min_area", "denoising_persistence", "padding_factor",
+                        "cache_folder", "cache_size", "stage_cache_size"]
+
 
 class Settings(QtCore.QSettings):
     def __init__(self):
@@ -33,7 +42,7 @@ class Settings(QtCore.QSettings):
         # Lookup table for all the different settings
         self.lookup_table = {
             "plate": ["plate", "frequency"],
-            "folders": ["measurement_folder", "database_file", "database_folder", "logging_folder"],
+            "folders": ["measurement_folder", "database_file", "database_folder", "logging_folder", "cache_folder"],
             "keyboard_shortcuts": ["left_front", "left_hind", "right_front", "right_hind",
                                    "previous_contact", "next_contact", "invalid_valid", "remove_label"],
             "interpolation_degree": ["interpolation_entire_plate",
@@ -43,15 +52,19 @@ class Settings(QtCore.QSettings):
                            "end_force_percentage",
                            "tracking_temporal",
                            "tracking_spatial",
-                           "tracking_surface"],
-            "application": ["zip_files", "show_maximized", "restore_last_session"],
+                           "tracking_surface",
+                           "tracking_engine",
+                           "tracking_connectivity",
+                           "tracking_linking",
+                           "tracking_gap", "tracking_window", "tracking_window_overlap",
+                           "denoising", "denoising_min_area", "denoising_persistence"],
+            "application": ["zip_files", "show_maximized", "restore_last_session", "cache_size",
+                            "import_processes", "zip_compress_level", "zip_workers",
+                            "tracking_workers", "stage_cache_size"],
         }
 
-        # Create a database connection with PyTables
-        database_file = self.database_file()
-        self.table = table.load_table(database_file)
-        # Verify the table layout and if its not up to date, update it (though perhaps ask the user?)
-        table.verify_tables(self.table)
+        # The database connection with PyTables only gets created when it's first used, see table
+        self._table = None
 
         # Possibly I could provide a getter/setter such that you could change this on the fly
         self.create_contact_dict()
@@ -60,6 +73,42 @@ class Settings(QtCore.QSettings):
         # Set up the logger
         self.setup_logging()
 
+    @property
+    def table(self):
+        """
+        Opens the PyTables file the first time it's used, instead of when this module gets imported.
+        The worker processes import this module as well, but only this process should ever write to the file.
+        """
+        if self._table is None:
+            self._table = table.load_table(self.database_file())
+            # Verify the table layout and if its not up to date, update it (though perhaps ask the user?)
+            table.verify_tables(self._table)
+        return self._table
+
+    def worker_settings(self):
+        """
+        Returns the values of the settings the worker processes need, so they can be passed along with their jobs
+        """
+        return dict((name, getattr(self, name)()) for name in worker_setting_names)
+
+    @contextmanager
+    def overridden(self, values):
+        """
+        Makes the settings in values (like the ones from worker_settings) return those values
+        until the with block ends, so a worker uses the same settings as the process that gave it the job
+        """
+        previous = dict((name, self.__dict__[name]) for name in values if name in self.__dict__)
+        for name, value in values.items():
+            setattr(self, name, lambda value=value: value)
+        try:
+            yield self
+        finally:
+            for name in values:
+                if name in previous:
+                    setattr(self, name, previous[name])
+                else:
+                    delattr(self, name)
+
     def create_contact_dict(self):
         # Lookup table for converting indices to labels
         if __human__:
@@ -227,6 +276,15 @@ class Settings(QtCore.QSettings):
             return default_value
         return setting_value
 
+    def cache_folder(self):
+        key = "folders/cache_folder"
+        default_value = os.path.join(self.root_folder, "cache")
+        setting_value = str(self.value(key))
+        # Check if this folder even exists, else return the relative path
+        if not os.path.exists(setting_value):
+            return default_value
+        return setting_value
+
     def logging_folder(self):
         key = "folders/logging_folder"
         default_value = os.path.join(self.root_folder, "log")
@@ -259,6 +317,76 @@ class Settings(QtCore.QSettings):
         value = float(self.value(key, 0.25))
         return value
 
+    def tracking_engine(self):
+        """
+        Which tracker to use: graph (contours linked between frames) or label (3D connected components)
+        """
+        key = "thresholds/tracking_engine"
+        value = str(self.value(key, "graph"))
+        return value if value in ["graph", "label"] else "graph"
+
+    def tracking_connectivity(self):
+        """
+        Connectivity of the label tracker's structuring element (1-3), 0 connects them like the graph tracker
+        """
+        key = "thresholds/tracking_connectivity"
+        return min(3, max(0, int(self.value(key, 0))))
+
+    def tracking_linking(self):
+        """
+        How the graph tracker links contours in adjacent frames: polygon (pointPolygonTest) or mask (filled masks)
+        """
+        key = "thresholds/tracking_linking"
+        value = str(self.value(key, "polygon"))
+        return value if value in ["polygon", "mask"] else "polygon"
+
+    def tracking_gap(self):
+        """
+        After how many frames without any contours the online tracker considers a contact finished
+        """
+        key = "thresholds/tracking_gap"
+        return max(1, int(self.value(key, 4)))
+
+    def tracking_window(self):
+        """
+        Measurements with more frames than this are tracked this many frames at a time, 0 turns it off
+        """
+        key = "thresholds/tracking_window"
+        return max(0, int(self.value(key, 5000)))
+
+    def tracking_window_overlap(self):
+        """
+        How many frames the windows of the windowed tracking share on either side
+        """
+        key = "thresholds/tracking_window_overlap"
+        return max(1, int(self.value(key, 50)))
+
+    def denoising(self):
+        """
+        Whether the noise gets removed from the measurements before they're tracked, see denoising.denoise
+        """
+        key = "thresholds/denoising"
+        default_value = False
+        setting_value = self.value(key)
+        if isinstance(setting_value, bool):
+            return setting_value
+        else:
+            return default_value
+
+    def denoising_min_area(self):
+        """
+        How many sensors a blob needs to cover to not be considered noise
+        """
+        key = "thresholds/denoising_min_area"
+        return max(1, int(self.value(key, 2)))
+
+    def denoising_persistence(self):
+        """
+        How many frames in a row a sensor needs to be active to not be considered noise, 1 turns it off
+        """
+        key = "thresholds/denoising_persistence"
+        return max(1, int(self.value(key, 1)))
+
     def padding_factor(self):
         key = "thresholds/padding_factor"
         return int(self.value(key, 1))
@@ -371,6 +499,50 @@ class Settings(QtCore.QSettings):
         else:
             return default_value
 
+    def cache_size(self):
+        """
+        Maximum size of the measurement cache in MB
+        """
+        key = "application/cache_size"
+        return int(self.value(key, 1024))
+
+    def import_processes(self):
+        """
+        Number of worker processes used for importing measurements, by default one per core
+        """
+        import multiprocessing
+        key = "application/import_processes"
+        return max(1, int(self.value(key, multiprocessing.cpu_count())))
+
+    def zip_compress_level(self):
+        """
+        Compression level (0-9) used when zipping imported files, 0 stores them without compression
+        """
+        key = "application/zip_compress_level"
+        return min(9, max(0, int(self.value(key, 6))))
+
+    def tracking_workers(self):
+        """
+        Number of threads that look for contours while tracking, by default one per core
+        """
+        import multiprocessing
+        key = "application/tracking_workers"
+        return max(1, int(self.value(key, multiprocessing.cpu_count())))
+
+    def stage_cache_size(self):
+        """
+        Of how many measurements we keep the tracking's connected components in memory
+        """
+        key = "application/stage_cache_size"
+        return max(0, int(self.value(key, 8)))
+
+    def zip_workers(self):
+        """
+        Number of background threads that zip imported files
+        """
+        key = "application/zip_workers"
+        return max(1, int(self.value(key, 2)))
+
     def show_maximized(self):
         key = "application/show_maximized"
         default_value = False
@@ -438,12 +610,22 @@ class Settings(QtCore.QSettings):
         self.settings["folders/database_folder"] = self.database_folder()
         self.settings["folders/database_file"] = self.database_file()
         self.settings["folders/logging_folder"] = self.logging_folder()
+        self.settings["folders/cache_folder"] = self.cache_folder()
 
         self.settings["thresholds/start_force_percentage"] = self.start_force_percentage()
         self.settings["thresholds/end_force_percentage"] = self.end_force_percentage()
         self.settings["thresholds/tracking_temporal"] = self.tracking_temporal()
         self.settings["thresholds/tracking_spatial"] = self.tracking_spatial()
         self.settings["thresholds/tracking_surface"] = self.tracking_surface()
+        self.settings["thresholds/tracking_engine"] = self.tracking_engine()
+        self.settings["thresholds/tracking_connectivity"] = self.tracking_connectivity()
+        self.settings["thresholds/tracking_linking"] = self.tracking_linking()
+        self.settings["thresholds/tracking_gap"] = self.tracking_gap()
+        self.settings["thresholds/tracking_window"] = self.tracking_window()
+        self.settings["thresholds/tracking_window_overlap"] = self.tracking_window_overlap()
+        self.settings["thresholds/denoising"] = self.denoising()
+        self.settings["thresholds/denoising_min_area"] = self.denoising_min_area()
+        self.settings["thresholds/denoising_persistence"] = self.denoising_persistence()
         self.settings["thresholds/padding_factor"] = self.padding_factor()
 
         self.settings["widgets/main_window_left"] = self.main_window_left()
@@ -465,6 +647,12 @@ class Settings(QtCore.QSettings):
         self.settings["application/label_font"] = self.label_font()
         self.settings["application/date_format"] = self.date_format()
         self.settings["application/restore_last_session"] = self.restore_last_session()
+        self.settings["application/cache_size"] = self.cache_size()
+        self.settings["application/import_processes"] = self.import_processes()
+        self.settings["application/zip_compress_level"] = self.zip_compress_level()
+        self.settings["application/zip_workers"] = self.zip_workers()
+        self.settings["application/tracking_workers"] = self.tracking_workers()
+        self.settings["application/stage_cache_size"] = self.stage_cache_size()
 
         return self.settings
 
@@ -0,0 +1,41 @@
+"""
+Generates synthetic measurements, so we can test loaders for which we don't have any sample files.
+"""
+import numpy as np
+
+
+def create_measurement(rows, columns, frames, seed=0):
+    """
+    Returns a (rows x columns x frames) float32 array with a blob of pressure walking across the plate
+    """
+    random_state = np.random.RandomState(seed)
+    x, y = np.mgrid[0:rows, 0:columns]
+    data = np.zeros((rows, columns, frames), dtype=np.float32)
+    for frame in range(frames):
+        center_x = rows * float(frame) / frames
+        center_y = columns / 2.
+        blob = 100 * np.exp(-((x - center_x) ** 2 + (y - center_y) ** 2) / 8.)
+        data[:, :, frame] = np.round(blob * random_state.uniform(0.9, 1.1, size=blob.shape), 2)
+    # Clear the tiny values, so it looks like a real (thresholded) export
+    data[data < 1] = 0
+    return data
+
+
+def create_tekscan_export(rows, columns, frames, seed=0):
+    """
+    Returns the text of a Tekscan ASCII export and the array it should load as
+    """
+    data = create_measurement(rows, columns, frames, seed)
+    lines = ["DATA_TYPE MOVIE",
+             "ASCII_DATA @@",
+             "ROWS {}".format(rows),
+             "COLS {}".format(columns),
+             "SECONDS_PER_FRAME 0.002",
+             "UNITS KPa",
+             ""]
+    for frame in range(frames):
+        lines.append("Frame {}".format(frame + 1))
+        for row in data[:, :, frame]:
+            lines.append(",".join("{:g}".format(value) for value in row))
+        lines.append("")
+    return "\r\n".join(lines) + "\r\n", data
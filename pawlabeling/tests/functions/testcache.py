@@ -0,0 +1,109 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import logging
+import numpy as np
+from ...functions import cache
+
+logger = logging.getLogger("logger")
+logger.disabled = True
+
+
+class TestGetKey(TestCase):
+    def setUp(self):
+        self.root = os.path.dirname(os.path.abspath(__file__))
+        self.file_name = os.path.join(self.root, "files/rsscan_export.zip")
+
+    def test_zip_key_uses_member(self):
+        import zipfile
+        from ...functions import io
+        temp_folder = tempfile.mkdtemp()
+        try:
+            # The same contents in another archive, with a second member behind it
+            contents = io.open_zip_file(self.file_name)
+            file_path = os.path.join(temp_folder, "rsscan_export.zip")
+            with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as outfile:
+                outfile.writestr("first", contents)
+                outfile.writestr("second", contents + "\n")
+            member = zipfile.ZipFile(self.file_name).namelist()[-1]
+            with zipfile.ZipFile(os.path.join(temp_folder, "copy.zip"), "w", zipfile.ZIP_STORED) as outfile:
+                outfile.writestr(member, contents)
+
+            self.assertEqual(cache.get_key(os.path.join(temp_folder, "copy.zip"), brand="rsscan"),
+                             cache.get_key(self.file_name, brand="rsscan"))
+            self.assertNotEqual(cache.get_key(file_path, member="first", brand="rsscan"),
+                                cache.get_key(file_path, brand="rsscan"))
+            self.assertEqual(cache.get_key(file_path, member="second", brand="rsscan"),
+                             cache.get_key(file_path, brand="rsscan"))
+            self.assertIsNone(cache.get_key(file_path, member="missing", brand="rsscan"))
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+    def test_unzipped_key(self):
+        from ...functions import io
+        temp_folder = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(temp_folder, "rsscan_export")
+            with open(file_path, "wb") as outfile:
+                outfile.write(io.open_zip_file(self.file_name))
+            self.assertEqual(cache.get_key(file_path, brand="rsscan"), cache.get_key(file_path, brand="rsscan"))
+            self.assertNotEqual(cache.get_key(file_path, brand="rsscan"), cache.get_key(self.file_name, brand="rsscan"))
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+    def test_brand_changes_key(self):
+        self.assertNotEqual(cache.get_key(self.file_name, brand="rsscan"),
+                            cache.get_key(self.file_name, brand="zebris"))
+
+
+class TestStoreAndLoad(TestCase):
+    def setUp(self):
+        self.cache_folder = tempfile.mkdtemp()
+        self.data = np.arange(60, dtype=np.float32).reshape((5, 4, 3))
+        self.summary = {"orientation": False, "maximum_value": 59.0}
+
+    def test_load_missing_key(self):
+        data, summary = cache.load("missing", self.cache_folder)
+        self.assertIsNone(data)
+        self.assertIsNone(summary)
+
+    def test_store_and_load(self):
+        cache.store("key", self.data, self.summary, self.cache_folder, cache_size=1)
+        data, summary = cache.load("key", self.cache_folder)
+        self.assertTrue(isinstance(data, np.memmap))
+        self.assertTrue(np.array_equal(data, self.data))
+        self.assertEqual(summary["maximum_value"], 59.0)
+        self.assertEqual(summary["shape"], [5, 4, 3])
+
+    def test_store_leaves_no_temporary_files(self):
+        cache.store("key", self.data, self.summary, self.cache_folder, cache_size=1)
+        cache.store("key", self.data, self.summary, self.cache_folder, cache_size=1)
+        self.assertEqual(sorted(os.listdir(self.cache_folder)), ["key.json", "key.npy"])
+
+    def test_evict_skips_missing_files(self):
+        cache.store("key", self.data, self.summary, self.cache_folder, cache_size=1)
+        # Pretend another worker evicts it while we're listing the folder
+        listdir = os.listdir
+        cache.os.listdir = lambda path: listdir(path) + ["evicted.npy"]
+        try:
+            cache.evict(self.cache_folder, cache_size=1)
+        finally:
+            cache.os.listdir = listdir
+        self.assertIsNotNone(cache.load("key", self.cache_folder)[0])
+
+    def test_evict_least_recently_used(self):
+        data = np.zeros((512, 512, 2), dtype=np.float32)  # 2 MB
+        cache.store("first", data, self.summary, self.cache_folder, cache_size=5)
+        cache.store("second", data, self.summary, self.cache_folder, cache_size=5)
+        # Make first older than second and then use it, so second becomes the least recently used
+        os.utime(os.path.join(self.cache_folder, "first.npy"), (0, 0))
+        os.utime(os.path.join(self.cache_folder, "second.npy"), (1, 1))
+        cache.load("first", self.cache_folder)
+        cache.store("third", data, self.summary, self.cache_folder, cache_size=5)
+        self.assertIsNotNone(cache.load("first", self.cache_folder)[0])
+        self.assertIsNone(cache.load("second", self.cache_folder)[0])
+        self.assertIsNotNone(cache.load("third", self.cache_folder)[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_folder, ignore_errors=True)
@@ -206,4 +206,36 @@ class TestInterpolateTimeSeries(TestCase):
     def test_interpolate_time_series_with_2d_array(self):
         data = np.zeros((3, 3))
         with self.assertRaises(Exception):
-            calculations.interpolate_time_series(data)
\ No newline at end of file
+            calculations.interpolate_time_series(data)
+
+class TestSummarizeMeasurement(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_location = "files/rsscan_verify_content.zip"
+        file_name = os.path.join(parent_folder, file_location)
+        self.data = io.load(io.open_zip_file(file_name), brand="rsscan")
+
+    def test_summarize_measurement(self):
+        summary = calculations.summarize_measurement(self.data, block_size=50)
+        x, y, z = np.nonzero(self.data)
+        self.assertEqual(summary["first_frame"], z.min())
+        self.assertEqual(summary["last_frame"], z.max())
+        self.assertEqual(summary["maximum_value"], self.data.max())
+        self.assertTrue(np.allclose(summary["frame_sums"], np.sum(np.sum(self.data, axis=0), axis=0)))
+        self.assertTrue(np.array_equal(summary["frame_counts"],
+                                       [np.count_nonzero(self.data[:, :, frame]) for frame in xrange(249)]))
+
+    def test_sparse_gives_the_same_summary(self):
+        from ...functions import sparse
+        summary = calculations.summarize_measurement(self.data)
+        sparse_summary = calculations.summarize_measurement(sparse.SparseMeasurement.from_dense(self.data))
+        for key in ["orientation", "maximum_value", "first_frame", "last_frame"]:
+            self.assertEqual(summary[key], sparse_summary[key])
+        self.assertTrue(np.allclose(summary["frame_sums"], sparse_summary["frame_sums"]))
+        self.assertTrue(np.array_equal(summary["frame_counts"], sparse_summary["frame_counts"]))
+
+    def test_empty_measurement(self):
+        summary = calculations.summarize_measurement(np.zeros((10, 10, 5)))
+        self.assertEqual(summary["first_frame"], -1)
+        self.assertEqual(summary["last_frame"], -1)
+        self.assertFalse(summary["orientation"])
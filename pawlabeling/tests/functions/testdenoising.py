@@ -0,0 +1,100 @@
+from unittest import TestCase
+import os
+import numpy as np
+from ...functions import denoising, io, tracking
+
+
+class TestDenoising(TestCase):
+    def setUp(self):
+        # A noisy sensor in every frame and a blob of four sensors with a light first frame,
+        # followed by a single sensor. The first and last frames are far enough away from the blob to be idle.
+        self.data = np.zeros((10, 10, 30), dtype=np.float32)
+        self.data[0, 0, :] = 0.5
+        self.data[4:6, 4:6, 13] = 0.5
+        self.data[4:6, 4:6, 14:18] = 100.
+        self.data[8, 8, 15] = 3.
+
+    def test_noise_floor(self):
+        self.assertEqual(list(denoising.find_idle_frames(self.data)), [0, 1, 2, 3, 28, 29])
+        floor = denoising.noise_floor(self.data)
+        self.assertEqual(floor[0, 0], 0.5)
+        self.assertEqual(np.count_nonzero(floor), 1)
+
+    def test_light_frames_arent_idle(self):
+        # Without a margin, the first frame of the blob is light enough to be idle and becomes part of the floor
+        self.assertIn(13, denoising.find_idle_frames(self.data, margin=0))
+        self.assertEqual(np.count_nonzero(denoising.noise_floor(self.data, margin=0)), 5)
+        # But a contact that's this light during all of its frames still counts as noise
+        self.data[2, 2, 2] = 1.
+        self.assertEqual(denoising.noise_floor(self.data)[2, 2], 1.)
+
+    def test_denoise(self):
+        statistics = {}
+        denoised_data = denoising.denoise(self.data, min_area=2, statistics=statistics)
+        self.assertEqual(denoised_data.dtype, self.data.dtype)
+        self.assertTrue(np.array_equal(denoised_data[4:6, 4:6, :], self.data[4:6, 4:6, :]))
+        self.assertEqual(np.count_nonzero(denoised_data), 20)
+        self.assertEqual(statistics, {"sensors_before": 51, "sensors_after": 20, "blobs_before": 36, "blobs_after": 5})
+
+    def test_filters_off(self):
+        self.assertTrue(np.array_equal(denoising.denoise(self.data, min_area=1, idle_fraction=0), self.data))
+
+    def test_persistence(self):
+        from scipy.ndimage import binary_opening
+
+        mask = np.random.RandomState(0).rand(20, 15, 30) > 0.5
+        for persistence in [2, 3, 5]:
+            frames = denoising.remove_short_runs(denoising.to_frames(mask), persistence)
+            opened = binary_opening(mask, structure=np.ones((1, 1, persistence), dtype=np.bool))
+            self.assertTrue(np.array_equal(denoising.from_frames(frames, mask), opened))
+
+    def load_noisy_data(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        data = io.load(io.open_zip_file(os.path.join(parent_folder, "files/rsscan_verify_content.zip")),
+                       brand="rsscan")
+        padded_data = np.zeros((258, 65, 249), dtype=np.float32)
+        padded_data[1:-1, 1:-1, :] = data
+        noisy_data = padded_data.copy()
+        random_state = np.random.RandomState(0)
+        noisy_data[1:-1, 1:-1, :][(random_state.rand(*data.shape) < 0.002) & (data == 0)] = data.max() / 10
+        return padded_data, noisy_data
+
+    def test_tracking_noisy_measurement(self):
+        padded_data, noisy_data = self.load_noisy_data()
+
+        def frames(contacts):
+            return sorted((min(contact), max(contact)) for contact in contacts if len(contact) > 1)
+
+        contacts = frames(tracking.track_contours(padded_data, engine="graph", denoise=False))
+        self.assertGreater(len(frames(tracking.track_contours(noisy_data, engine="graph", denoise=False))),
+                           len(contacts))
+        # Contacts that start or end with a single sensor lose that frame
+        denoised_contacts = frames(tracking.track_contours(noisy_data, engine="graph", denoise=True))
+        self.assertEqual(len(denoised_contacts), len(contacts))
+        for (start, stop), (denoised_start, denoised_stop) in zip(contacts, denoised_contacts):
+            self.assertLessEqual(abs(start - denoised_start), 1)
+            self.assertLessEqual(abs(stop - denoised_stop), 1)
+
+    def test_windowed_tracking_noisy_measurement(self):
+        from ...settings import settings
+
+        _, noisy_data = self.load_noisy_data()
+
+        def contours(contacts):
+            return sorted(sorted((frame, contour.tostring()) for frame, frame_contours in contact.iteritems()
+                                 for contour in frame_contours) for contact in contacts)
+
+        for persistence in [1, 3]:
+            settings.settings.denoising_persistence = lambda: persistence
+            statistics, windowed_statistics = {}, {}
+            try:
+                contacts = tracking.track_contours(noisy_data, engine="graph", denoise=True, statistics=statistics)
+                windowed_contacts = tracking.track_contours_windowed(noisy_data[1:-1, 1:-1, :], window=50, overlap=5,
+                                                                     padding=1, engine="graph", denoise=True,
+                                                                     statistics=windowed_statistics)
+            finally:
+                del settings.settings.denoising_persistence
+            self.assertEqual(contours(windowed_contacts), contours(contacts))
+            # Every frame only gets counted once
+            self.assertEqual(windowed_statistics, statistics)
+            self.assertLess(statistics["blobs_after"], statistics["blobs_before"])
@@ -1,10 +1,13 @@
 from unittest import TestCase
 import os
+import errno
 import numpy as np
 import shutil
+import tempfile
 import logging
 from ...settings import settings
 from ...functions import io
+from . import fixtures
 
 logger = logging.getLogger("logger")
 logger.disabled = True
@@ -49,7 +52,48 @@ class TestLoad(TestCase):
     #     measurement_data = io.load(file_name=file_name)
     #     self.assertEqual(measurement_data.shape, (128L, 56L, 1472L))
 
-    # TODO Add a test for loading Tekscan
+    def test_load_small_zebris(self):
+        frame = "Frame {} {{\nExercise1\nTime, ms\t0.0\n\tx1\tx2\tx3\ny1\t1.0\t2.0\t3.0\ny2\t4.0\t5.0\t6.0\n}}\n"
+        input_file = "Frame count\t3\n\n" + "".join(frame.format(index) for index in range(1, 4))
+        data = io.load(input_file, brand="zebris")
+        # The longest side should become the first dimension
+        self.assertEqual(data.shape, (3L, 2L, 3L))
+        self.assertEqual(data.dtype, np.float32)
+        self.assertEqual(data[:, 0, 0].tolist(), [1.0, 2.0, 3.0])
+
+    def test_load_zebris_from_stream(self):
+        from StringIO import StringIO
+        frame = "Frame {} {{\r\n\tx1\tx2\r\ny1\t1.0\t2.0\r\n}}\r\n"
+        input_file = StringIO("".join(frame.format(index) for index in range(1, 4)))
+        data = io.load(input_file, brand="zebris")
+        self.assertEqual(data.shape, (2L, 1L, 3L))
+
+    def test_load_zebris_single_frame(self):
+        input_file = "Frame 1 {\n\tx1\tx2\ny1\t1.0\t2.0\n}\n"
+        data = io.load(input_file, brand="zebris")
+        self.assertEqual(data, None)
+
+    def test_load_tekscan(self):
+        input_file, expected = fixtures.create_tekscan_export(rows=10, columns=8, frames=5)
+        data = io.load(input_file, brand="tekscan")
+        self.assertEqual(data.shape, (10L, 8L, 5L))
+        self.assertTrue(np.array_equal(data, expected))
+
+    def test_tekscan_versions_equal(self):
+        input_file, _ = fixtures.create_tekscan_export(rows=20, columns=12, frames=15, seed=1)
+        data_python = io.load_tekscan(input_file, version="python")
+        data_pandas = io.load_tekscan(input_file, version="pandas")
+        self.assertEqual(data_pandas.dtype, np.float32)
+        self.assertTrue(np.array_equal(data_python, data_pandas))
+
+    def test_unknown_tekscan_version(self):
+        with self.assertRaisesRegexp(ValueError, "Unknown Tekscan version: numpy"):
+            io.load_tekscan("", version="numpy")
+
+    def test_load_tekscan_without_frames(self):
+        input_file, _ = fixtures.create_tekscan_export(rows=10, columns=8, frames=5)
+        data = io.load(input_file.replace("Frame", "Pane"), brand="tekscan")
+        self.assertEqual(data, None)
 
 class TestNonMeasurementFile(TestCase):
     def test_loading_wrong_file(self):
@@ -100,6 +144,20 @@ class TestCorrectLoading(TestCase):
         nonzero_count = np.count_nonzero(force_over_time)
         self.assertEqual(nonzero_count, 249)
 
+    def test_rsscan_versions_equal(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_location = "files/rsscan_verify_content.zip"
+        file_name = os.path.join(parent_folder, file_location)
+        input_file = io.open_zip_file(file_name)
+        data_loadtxt = io.load_rsscan(input_file, version="loadtxt")
+        data_fromstring = io.load_rsscan(input_file, version="fromstring")
+        self.assertEqual(data_fromstring.dtype, np.float32)
+        self.assertTrue(np.array_equal(data_loadtxt, data_fromstring))
+
+    def test_unknown_rsscan_version(self):
+        with self.assertRaisesRegexp(ValueError, "Unknown RSscan version: numpy"):
+            io.load_rsscan("", version="numpy")
+
 # class TestLoadResults(TestCase):
 #     def test_load_successful(self):
 #         parent_folder = os.path.dirname(os.path.abspath(__file__))
@@ -235,6 +293,139 @@ class TestZipFile(TestCase):
             shutil.rmtree(self.new_file_name + ".zip", ignore_errors=True)
 
 
+class TestZipQueue(TestCase):
+    def setUp(self):
+        self.root = os.path.dirname(os.path.abspath(__file__))
+        self.temp_folder = tempfile.mkdtemp()
+        self.file_names = []
+        for index in range(4):
+            file_name = os.path.join(self.temp_folder, "export_{}".format(index))
+            shutil.copyfile(os.path.join(self.root, "files/fake_export"), file_name)
+            self.file_names.append(file_name)
+
+    def test_zip_files(self):
+        zip_queue = io.ZipQueue(workers=2, max_size=1)
+        for file_name in self.file_names:
+            zip_queue.put(file_name)
+        zip_queue.join()
+        self.assertEqual(zip_queue.status(), {"pending": 0, "zipped": 4, "failed": 0})
+        for file_name in self.file_names:
+            self.assertFalse(os.path.exists(file_name))
+            self.assertEqual(io.get_zip_members(file_name + ".zip"), [os.path.basename(file_name)])
+
+    def test_store_without_compression(self):
+        import zipfile
+        zip_queue = io.ZipQueue(workers=1, compress_level=0)
+        zip_queue.put(self.file_names[0])
+        zip_queue.join()
+        info = zipfile.ZipFile(self.file_names[0] + ".zip").infolist()[0]
+        self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+
+    def test_failed(self):
+        zip_queue = io.ZipQueue(workers=1)
+        zip_queue.put(os.path.join(self.temp_folder, "missing_export"))
+        zip_queue.join()
+        self.assertEqual(zip_queue.status()["failed"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_folder, "missing_export.zip")))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+
+class TestDetectFormat(TestCase):
+    def setUp(self):
+        self.root = os.path.dirname(os.path.abspath(__file__))
+        self.rsscan_file = os.path.join(self.root, "files/rsscan_export.zip")
+
+    def test_detect_rsscan(self):
+        input_file = io.open_zip_file(self.rsscan_file)
+        self.assertEqual(io.detect_format(input_file[:8192]), "rsscan")
+
+    def test_detect_zebris(self):
+        # The first frame only starts after a long header, so we have to recognize the header
+        file_name = os.path.join(self.root, "../../samples/Measurements/Zebris/RawDataGaitAnalysis.txt.zip")
+        self.assertEqual(io.detect_file_format(file_name), "zebris")
+
+    def test_detect_tekscan(self):
+        input_file, _ = fixtures.create_tekscan_export(rows=10, columns=8, frames=2)
+        self.assertEqual(io.detect_format(input_file[:8192]), "tekscan")
+
+    def test_detect_incorrect_file(self):
+        file_path = os.path.join(self.root, "files/incorrect_files/desktop.ini")
+        self.assertEqual(io.detect_file_format(file_path), None)
+
+    def test_file_formats_stay_bounded(self):
+        temp_folder = tempfile.mkdtemp()
+        file_formats_size = io.file_formats_size
+        io.file_formats_size = 2
+        try:
+            file_path = os.path.join(temp_folder, "export.txt")
+            with open(file_path, "w") as outfile:
+                outfile.write("nothing to see here")
+            self.assertEqual(io.detect_file_format(file_path), None)
+            # A file that changed replaces its entry, instead of adding one
+            with open(file_path, "w") as outfile:
+                outfile.write(io.open_zip_file(self.rsscan_file))
+            os.utime(file_path, (0, 0))
+            self.assertEqual(io.detect_file_format(file_path), "rsscan")
+            self.assertEqual(io.file_formats.keys().count((file_path, None)), 1)
+
+            io.detect_file_format(self.rsscan_file)
+            io.detect_file_format(os.path.join(self.root, "files/incorrect_files/desktop.ini"))
+            self.assertEqual(len(io.file_formats), 2)
+            self.assertNotIn((file_path, None), io.file_formats)
+        finally:
+            io.file_formats_size = file_formats_size
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+    def test_load_without_brand(self):
+        input_file = io.open_zip_member(self.rsscan_file)
+        data = io.load(input_file)
+        input_file.close()
+        self.assertEqual(data.shape, (256L, 63L, 249L))
+
+    def test_load_wrong_brand(self):
+        input_file = io.open_zip_file(self.rsscan_file)
+        self.assertEqual(io.load(input_file, brand="zebris"), None)
+
+
+class TestZipMembers(TestCase):
+    def setUp(self):
+        # Create a zip file containing two measurements and a folder
+        import zipfile
+        self.root = os.path.dirname(os.path.abspath(__file__))
+        self.input_file = io.open_zip_file(os.path.join(self.root, "files/rsscan_export.zip"))
+        self.temp_folder = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp_folder, "multiple_members.zip")
+        outfile = zipfile.ZipFile(self.file_name, "w")
+        outfile.writestr("folder/", "")
+        outfile.writestr("folder/first_export", self.input_file)
+        outfile.writestr("second_export", self.input_file)
+        outfile.close()
+
+    def test_get_zip_members(self):
+        members = io.get_zip_members(self.file_name)
+        self.assertEqual(members, ["folder/first_export", "second_export"])
+
+    def test_load_from_stream(self):
+        for member in io.get_zip_members(self.file_name):
+            input_file = io.open_zip_member(self.file_name, member=member)
+            data = io.load(input_file, brand="rsscan")
+            input_file.close()
+            self.assertTrue(np.array_equal(data, io.load(self.input_file, brand="rsscan")))
+
+    def test_open_last_member(self):
+        input_file = io.open_zip_member(self.file_name)
+        self.assertEqual(input_file.read(), self.input_file)
+        input_file.close()
+
+    def test_open_non_zip_file(self):
+        self.assertEqual(io.open_zip_member(self.file_name[:-4]), None)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+
 class TestGetFilePaths(TestCase):
     def test_get_file_paths(self):
         # Let's try and change the measurement folder
@@ -245,6 +436,56 @@ class TestGetFilePaths(TestCase):
         # Check if file_paths is correct
         self.assertEqual(sorted(file_paths.keys()), ["fake_export_1", "fake_export_2", "fake_export_3"])
 
+class TestScanFolder(TestCase):
+    def setUp(self):
+        root = os.path.dirname(os.path.abspath(__file__))
+        self.measurement_folder = os.path.join(root, "files/zip_folder")
+        self.index_folder = tempfile.mkdtemp()
+        self.index_file = os.path.join(self.index_folder, "file_index.json")
+
+    def test_scan_recursively(self):
+        entries = io.scan_folder(measurement_folder=self.measurement_folder)
+        dog_folder = os.path.join(self.measurement_folder, "Dog1")
+        self.assertTrue(entries[dog_folder]["is_dir"])
+        file_names = sorted(entry["name"] for entry in entries.itervalues() if entry["folder"] == dog_folder)
+        self.assertEqual(file_names, ["fake_export_1", "fake_export_2", "fake_export_3"])
+
+    def test_reuse_index(self):
+        entries = io.scan_folder(measurement_folder=self.measurement_folder, index_file=self.index_file)
+        # Change the hashes in the index, if the files didn't change they shouldn't be hashed again
+        file_index = io.load_file_index(self.index_file)
+        for path, entry in file_index.iteritems():
+            if not entry["is_dir"]:
+                self.assertEqual(entry["hash"], entries[path]["hash"])
+                entry["hash"] = "unchanged"
+        io.store_file_index(self.index_file, file_index)
+
+        entries = io.scan_folder(measurement_folder=self.measurement_folder, index_file=self.index_file)
+        hashes = set(entry["hash"] for entry in entries.itervalues() if not entry["is_dir"])
+        self.assertEqual(hashes, set(["unchanged"]))
+
+    def test_replace_index(self):
+        io.store_file_index(self.index_file, {"first": 1})
+        # Windows won't rename a file over an existing one
+        rename = os.rename
+
+        def windows_rename(source, destination):
+            if os.path.exists(destination):
+                raise OSError(errno.EEXIST, "File exists")
+            rename(source, destination)
+
+        io.os.rename = windows_rename
+        try:
+            io.store_file_index(self.index_file, {"second": 2})
+        finally:
+            io.os.rename = rename
+        self.assertEqual(io.load_file_index(self.index_file), {"second": 2})
+        self.assertEqual(os.listdir(self.index_folder), ["file_index.json"])
+
+    def tearDown(self):
+        shutil.rmtree(self.index_folder, ignore_errors=True)
+
+
 class TestGetFilePaths2(TestCase):
     """
     Second test case, but this time on an empty folder.
@@ -39,6 +39,298 @@ class TestContactTracking(TestCase):
                                                           plate=self.plate, )
         self.assertEqual(len(self.contacts), 9)
 
+    def test_tracking_sparse(self):
+        from ...functions import sparse, tracking
+        self.contact_model = contactmodel.MockContacts(subject_id=self.subject_id,
+                                                        session_id=self.session_id,
+                                                        measurement_id=self.measurement.measurement_id)
+        contacts = self.contact_model.track_contacts(measurement=self.measurement,
+                                                     measurement_data=self.measurement.data,
+                                                     plate=self.plate, )
+        sparse_data = sparse.SparseMeasurement.from_dense(self.measurement.data)
+        # Otherwise we'd get the components we found in the dense data
+        tracking.stage_cache.clear()
+        sparse_contacts = self.contact_model.track_contacts(measurement=self.measurement,
+                                                            measurement_data=sparse_data,
+                                                            plate=self.plate, )
+        self.assertEqual(len(sparse_contacts), len(contacts))
+        for contact, sparse_contact in zip(contacts, sparse_contacts):
+            self.assertTrue(np.array_equal(contact.data, sparse_contact.data))
+
+    def test_tracking_engines_agree(self):
+        from ...functions import sparse, tracking
+        data = np.zeros((258, 65, 249), dtype=np.float32)
+        data[1:-1, 1:-1, :] = self.measurement.data
+
+        def frames(contacts):
+            return sorted((min(contact), max(contact)) for contact in contacts if len(contact) > 1)
+
+        graph_frames = frames(tracking.track_contours(data, engine="graph"))
+        self.assertEqual(frames(tracking.track_contours(data, engine="label")), graph_frames)
+        sparse_data = sparse.SparseMeasurement.from_dense(data)
+        self.assertEqual(frames(tracking.track_contours(sparse_data, engine="label")), graph_frames)
+
+    def test_repeated_tracking(self):
+        from ...functions import tracking
+        tracking.stage_cache.clear()
+        contacts = contactmodel.track_contacts(self.measurement, self.measurement.data, self.plate,
+                                               self.subject_id, self.session_id, self.measurement.measurement_id)
+        # Label a contact, which shouldn't end up in the contacts we get the second time
+        contacts[0].contact_label = 1
+        hits = tracking.stage_cache.hits
+        repeated_contacts = contactmodel.track_contacts(self.measurement, self.measurement.data, self.plate,
+                                                        self.subject_id, self.session_id,
+                                                        self.measurement.measurement_id)
+        self.assertEqual(tracking.stage_cache.hits, hits + 1)
+        self.assertEqual(len(repeated_contacts), len(contacts))
+        for contact, repeated_contact in zip(contacts, repeated_contacts):
+            self.assertIsNot(contact, repeated_contact)
+            self.assertEqual(contact.contact_id, repeated_contact.contact_id)
+            self.assertTrue(np.array_equal(contact.data, repeated_contact.data))
+        self.assertEqual(repeated_contacts[0].contact_label, -2)
+        # Only the contacts of the last time are kept
+        cache_key = (self.subject_id, self.session_id, self.measurement.measurement_id,
+                     contactmodel.tracking_key(self.measurement))
+        self.assertEqual(len(tracking.stage_cache.results(cache_key)), len(contacts))
+
+    def test_repeated_tracking_validates_contacts(self):
+        from ...functions import tracking
+        from ...settings import settings
+        tracking.stage_cache.clear()
+        contacts = contactmodel.track_contacts(self.measurement, self.measurement.data, self.plate,
+                                               self.subject_id, self.session_id, self.measurement.measurement_id)
+        self.assertFalse(all(contact.incomplete_contact for contact in contacts))
+        # Any force at the start of a contact makes it incomplete
+        settings.settings.start_force_percentage = lambda: -1
+        try:
+            repeated_contacts = contactmodel.track_contacts(self.measurement, self.measurement.data, self.plate,
+                                                            self.subject_id, self.session_id,
+                                                            self.measurement.measurement_id)
+        finally:
+            del settings.settings.start_force_percentage
+        self.assertTrue(all(contact.incomplete_contact for contact in repeated_contacts))
+
+    def test_online_tracking(self):
+        contacts = contactmodel.track_contacts(self.measurement, self.measurement.data, self.plate,
+                                               self.subject_id, self.session_id, self.measurement.measurement_id)
+        tracker = contactmodel.OnlineContactTracker(self.measurement, self.plate, self.subject_id, self.session_id,
+                                                    self.measurement.measurement_id)
+        online_contacts = []
+        for frame in xrange(self.measurement.number_of_frames):
+            online_contacts.extend(tracker.push(self.measurement.data[:, :, frame]))
+            # We should never hold on to all the frames
+            self.assertLess(len(tracker.frames.frames), self.measurement.number_of_frames)
+        online_contacts.extend(tracker.finish())
+        self.assertEqual(len(tracker.frames.frames), 0)
+
+        self.assertEqual(len(online_contacts), len(contacts))
+        for contact, online_contact in zip(contacts, sorted(online_contacts, key=lambda contact: contact.min_z)):
+            self.assertEqual(contact.min_z, online_contact.min_z)
+            self.assertTrue(np.array_equal(contact.data, online_contact.data))
+            self.assertEqual(contact.invalid, online_contact.invalid)
+
+
+class TestImportMeasurement(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_location = "files/rsscan_verify_content.zip"
+        self.file_name = os.path.join(parent_folder, file_location)
+
+        self.plate = platemodel.Plate()
+        self.plate.plate_id = "plate_1"
+        self.plate.brand = "rsscan"
+        self.plate.sensor_width = 0.508
+        self.plate.sensor_height = 0.762
+        self.plate.sensor_surface = 0.387096
+
+        self.measurement = {"measurement_name": "rsscan_verify_content.zip",
+                            "file_path": self.file_name,
+                            "date": "2013-07-24",
+                            "time": "12:00",
+                            "plate_id": self.plate.plate_id,
+                            "frequency": 126}
+        self.job = ("subject_1", "session_1", self.measurement, {self.plate.plate_id: self.plate},
+                    settings.settings.worker_settings())
+
+    def test_import_measurement(self):
+        measurement, contacts = measurementmodel.import_measurement(self.job)
+        self.assertEqual(measurement.measurement_name, "rsscan_verify_content")
+        self.assertEqual(measurement.measurement_data.shape, (256L, 63L, 249L))
+        self.assertEqual(len(contacts), 9)
+        self.assertEqual(len(measurement.frame_sums), 249)
+        self.assertLessEqual(0, measurement.first_frame)
+        self.assertLess(measurement.first_frame, measurement.last_frame)
+
+    def test_results_can_be_pickled(self):
+        # The results have to be send back from the worker processes
+        import cPickle as pickle
+        measurement, contacts = pickle.loads(pickle.dumps(measurementmodel.import_measurement(self.job), -1))
+        self.assertEqual(measurement.measurement_data.shape, (256L, 63L, 249L))
+        self.assertEqual([contact.contact_id for contact in contacts],
+                         ["contact_{}".format(index) for index in range(9)])
+
+    def test_workers_use_the_settings_of_their_job(self):
+        worker_settings = dict(self.job[4], tracking_engine="unknown")
+        job = self.job[:4] + (worker_settings,)
+        self.assertEqual(measurementmodel.import_measurement(job), (None, None))
+        self.assertNotEqual(settings.settings.tracking_engine(), "unknown")
+
+    def test_settings_dont_open_the_table(self):
+        # The worker processes create their own Settings, which shouldn't open the PyTables file
+        handlers = list(logger.handlers)
+        try:
+            self.assertIsNone(settings.Settings()._table)
+        finally:
+            logger.handlers = handlers
+
+    def test_unique_measurements(self):
+        measurements = [dict(self.measurement, measurement_name=measurement_name)
+                        for measurement_name in ["x.txt", "x.txt.zip", "y.txt.zip", "y.txt"]]
+        self.assertEqual([measurement["measurement_name"]
+                          for measurement in measurementmodel.unique_measurements(measurements)],
+                         ["x.txt", "y.txt.zip"])
+
+    def test_import_wrong_brand(self):
+        self.plate.brand = "zebris"
+        self.assertEqual(measurementmodel.import_measurement(self.job), (None, None))
+
+    def test_track_measurement(self):
+        import shutil
+        import tempfile
+        from ...functions import sparse
+
+        measurement, contacts = measurementmodel.import_measurement(self.job)
+        measurement.measurement_id = "measurement_1"
+        # Some random labels that should survive tracking again
+        for contact, contact_label in zip(contacts, [0, 1, 2, 3]):
+            contact.contact_label = contact_label
+
+        shared_folder = tempfile.mkdtemp()
+        try:
+            for measurement_data in [measurement.measurement_data,
+                                     sparse.SparseMeasurement.from_dense(np.asarray(measurement.measurement_data))]:
+                paths = measurementmodel.share_measurement_data(measurement_data, shared_folder, "measurement_1")
+                job = ("subject_1", "session_1", measurement.to_dict(), self.plate, paths, None, self.job[4])
+                measurement_id, new_contacts, arrays = measurementmodel.track_measurement(job)
+                self.assertEqual(measurement_id, "measurement_1")
+                self.assertEqual(len(new_contacts), len(contacts))
+                for contact, new_contact in zip(contacts, new_contacts):
+                    self.assertTrue(np.array_equal(contact.data, new_contact.data))
+
+                # With the components it returned, it only has to merge them again
+                job = ("subject_1", "session_1", measurement.to_dict(), self.plate, paths, arrays, self.job[4])
+                _, resumed_contacts, resumed_arrays = measurementmodel.track_measurement(job)
+                self.assertIsNone(resumed_arrays)
+                self.assertEqual([contact.data.shape for contact in resumed_contacts],
+                                 [contact.data.shape for contact in new_contacts])
+
+                self.assertEqual(contactmodel.transfer_labels(contacts, new_contacts), 4)
+                self.assertEqual([contact.contact_label for contact in new_contacts],
+                                 [contact.contact_label for contact in contacts])
+
+            # The workers use the settings of their job
+            job = ("subject_1", "session_1", measurement.to_dict(), self.plate, paths, None,
+                   dict(self.job[4], tracking_engine="unknown"))
+            self.assertEqual(measurementmodel.track_measurement(job), ("measurement_1", None, None))
+        finally:
+            shutil.rmtree(shared_folder)
+
+
+class TestStoredComponents(TestCase):
+    def setUp(self):
+        import tempfile
+        import tables
+        from ...models import table
+
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_name = os.path.join(parent_folder, "files/rsscan_verify_content.zip")
+        data = io.load(io.open_zip_file(file_name), brand="rsscan")
+        self.measurement = measurementmodel.MockMeasurement(measurement_id="measurement_1", data=data, frequency=126)
+        self.plate = platemodel.Plate()
+        self.plate.sensor_width = 0.508
+        self.plate.sensor_height = 0.762
+        self.plate.sensor_surface = 0.387096
+
+        self.temp_folder = tempfile.mkdtemp()
+        self.table_file = tables.open_file(os.path.join(self.temp_folder, "data.h5"), mode="w")
+        self.table_file.create_group(self.table_file.create_group("/", "subject_1"), "session_1")
+        self.table_file.create_group("/subject_1/session_1", "measurement_1")
+        self.contact_model = contactmodel.MockContacts(subject_id="subject_1", session_id="session_1",
+                                                       measurement_id="measurement_1")
+        self.contact_model.tracking_table = table.TrackingTable(self.table_file, subject_id="subject_1",
+                                                                session_id="session_1",
+                                                                measurement_id="measurement_1")
+
+    def test_resume_tracking(self):
+        from ...functions import tracking
+
+        tracking.stage_cache.clear()
+        contacts = self.contact_model.track_contacts(self.measurement, self.measurement.data, self.plate)
+        key = contactmodel.tracking_key(self.measurement)
+        self.assertIsNotNone(self.contact_model.tracking_table.get_components(key))
+        self.assertIsNone(self.contact_model.tracking_table.get_components(key + " other"))
+
+        # Without the cache, we have to resume from the stored components
+        tracking.stage_cache.clear()
+        find_contours = tracking.find_contours
+        tracking.find_contours = None
+        try:
+            resumed_contacts = self.contact_model.track_contacts(self.measurement, self.measurement.data,
+                                                                 self.plate)
+        finally:
+            tracking.find_contours = find_contours
+        self.assertEqual(len(resumed_contacts), len(contacts))
+        for contact, resumed_contact in zip(contacts, resumed_contacts):
+            self.assertTrue(np.array_equal(contact.data, resumed_contact.data))
+
+    def tearDown(self):
+        import shutil
+        self.table_file.close()
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+
+class TestMeasurementData(TestCase):
+    def setUp(self):
+        import tempfile
+        import tables
+        from ...functions import sparse
+        from ...models import table
+
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_location = "files/rsscan_verify_content.zip"
+        file_name = os.path.join(parent_folder, file_location)
+        self.data = io.load(io.open_zip_file(file_name), brand="rsscan")
+
+        self.temp_folder = tempfile.mkdtemp()
+        self.table_file = tables.open_file(os.path.join(self.temp_folder, "data.h5"), mode="w")
+        self.table = table.Table(self.table_file)
+        self.table.store_data(group=self.table_file.root, item_id="dense", data=self.data)
+        self.table.store_data(group=self.table_file.root, item_id="sparse",
+                              data=sparse.SparseMeasurement.from_dense(self.data))
+
+    def test_lazy_access(self):
+        for item_id in ["dense", "sparse"]:
+            measurement_data = measurementmodel.MeasurementData(self.table_file.root._f_get_child(item_id))
+            self.assertEqual(measurement_data.shape, self.data.shape)
+            self.assertTrue(np.array_equal(measurement_data[:, :, 100], self.data[:, :, 100]))
+            self.assertTrue(np.array_equal(measurement_data[10:50, 5:20, -1], self.data[10:50, 5:20, -1]))
+            self.assertTrue(np.array_equal(measurement_data[:, :, 90:110], self.data[:, :, 90:110]))
+            self.assertTrue(np.array_equal(measurement_data.max(axis=2), self.data.max(axis=2)))
+            self.assertEqual(measurement_data.max(), self.data.max())
+            self.assertTrue(np.array_equal(measurement_data.toarray(), self.data))
+
+    def test_frame_sums(self):
+        # These measurements don't have their frame sums stored next to them, so they get calculated
+        for item_id in ["dense", "sparse"]:
+            measurement_data = measurementmodel.MeasurementData(self.table_file.root._f_get_child(item_id))
+            self.assertTrue(np.allclose(measurement_data.frame_sums(), np.sum(np.sum(self.data, axis=0), axis=0)))
+            self.assertEqual(len(measurement_data.frame_counts()), self.data.shape[2])
+
+    def tearDown(self):
+        import shutil
+        self.table_file.close()
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
 
 class TestContactValidation(TestCase):
     def setUp(self):
@@ -0,0 +1,53 @@
+from unittest import TestCase
+import os
+import numpy as np
+from ...functions import io, sparse
+
+
+class TestSparseMeasurement(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_location = "files/rsscan_verify_content.zip"
+        file_name = os.path.join(parent_folder, file_location)
+        input_file = io.open_zip_file(file_name)
+        self.data = io.load(input_file, brand="rsscan")
+        self.sparse_data = sparse.SparseMeasurement.from_dense(self.data)
+
+    def test_toarray(self):
+        self.assertEqual(self.sparse_data.shape, self.data.shape)
+        self.assertTrue(np.array_equal(self.sparse_data.toarray(), self.data))
+
+    def test_smaller(self):
+        self.assertLess(self.sparse_data.nbytes * 10, self.data.nbytes)
+
+    def test_frame(self):
+        for frame in [0, 100, 248, -1]:
+            self.assertTrue(np.array_equal(self.sparse_data.frame(frame), self.data[:, :, frame]))
+        with self.assertRaises(IndexError):
+            self.sparse_data.frame(249)
+
+    def test_indexing(self):
+        self.assertTrue(np.array_equal(self.sparse_data[:, :, 100], self.data[:, :, 100]))
+        self.assertTrue(np.array_equal(self.sparse_data[10:50, 5:20, 100], self.data[10:50, 5:20, 100]))
+        self.assertEqual(self.sparse_data[30, 10, 100], self.data[30, 10, 100])
+        self.assertTrue(np.array_equal(self.sparse_data[10:50, 5:20, 90:110], self.data[10:50, 5:20, 90:110]))
+
+    def test_max_projection(self):
+        self.assertTrue(np.array_equal(self.sparse_data.max_projection(), np.max(self.data, axis=2)))
+        self.assertEqual(self.sparse_data.max(), self.data.max())
+
+    def test_frame_sums(self):
+        frame_sums = np.sum(np.sum(self.data, axis=0, dtype=np.float64), axis=0)
+        self.assertTrue(np.allclose(self.sparse_data.frame_sums(), frame_sums))
+        self.assertTrue(np.array_equal(self.sparse_data.frame_counts(),
+                                       np.count_nonzero(self.data.reshape((-1, self.data.shape[2])), axis=0)))
+
+    def test_pad(self):
+        padded_data = np.zeros((258, 65, 249), dtype=np.float32)
+        padded_data[1:-1, 1:-1, :] = self.data
+        self.assertTrue(np.array_equal(self.sparse_data.pad(1).toarray(), padded_data))
+
+    def test_compress(self):
+        self.assertTrue(isinstance(sparse.compress(self.data), sparse.SparseMeasurement))
+        dense_data = np.ones((10, 10, 10), dtype=np.float32)
+        self.assertTrue(sparse.compress(dense_data) is dense_data)
@@ -0,0 +1,307 @@
+from unittest import TestCase
+import os
+import numpy as np
+import logging
+from ...functions import io, tracking, utility
+
+logger = logging.getLogger("logger")
+logger.disabled = True
+
+
+class TestGridIndex(TestCase):
+    def setUp(self):
+        # Three square contours, the last one far away from the others
+        self.contours = [np.array([[[x, y]], [[x + size, y]], [[x + size, y + size]], [[x, y + size]]], dtype=np.int32)
+                         for x, y, size in [(0, 0, 4), (3, 3, 4), (40, 40, 2)]]
+        self.index = tracking.GridIndex(self.contours, cell_size=5)
+
+    def test_query(self):
+        self.assertEqual(self.index.query((2, 2, 2, 2)), [0, 1])
+        self.assertEqual(self.index.query((41, 41, 1, 1)), [2])
+        self.assertEqual(self.index.query((20, 20, 5, 5)), [])
+
+    def test_touching_boxes_dont_overlap(self):
+        # boundingRect includes the last pixel, so (0, 0, 5, 5) ends right before x = 5
+        self.assertEqual(self.index.query((5, 0, 1, 1)), [])
+
+
+class TestCreateGraph(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_name = os.path.join(parent_folder, "files/rsscan_verify_content.zip")
+        data = io.load(io.open_zip_file(file_name), brand="rsscan")
+        self.contour_dict = tracking.find_contours(data)
+
+    def test_statistics(self):
+        statistics = {}
+        graph = tracking.create_graph(self.contour_dict, statistics=statistics)
+        self.assertTrue(graph)
+        self.assertGreater(statistics["pruned"], 0)
+        self.assertLessEqual(statistics["pruned"], statistics["pairs"])
+
+    def test_edges_are_bidirectional(self):
+        graph = tracking.create_graph(self.contour_dict)
+        for node, neighbours in graph.items():
+            for neighbour in neighbours:
+                self.assertIn(node, graph[neighbour])
+                self.assertEqual(abs(node[0] - neighbour[0]), 1)
+
+    def test_mask_linking_finds_the_same_edges(self):
+        graph = tracking.create_graph(self.contour_dict)
+        mask_graph = tracking.create_graph_mask(self.contour_dict)
+        edges = set((node, neighbour) for node in graph for neighbour in graph[node])
+        mask_edges = set((node, neighbour) for node in mask_graph for neighbour in mask_graph[node])
+        # The masks also overlap when the longest contour is a line, which pointPolygonTest misses
+        self.assertTrue(edges <= mask_edges)
+        self.assertLess(len(mask_edges - edges), 0.01 * len(edges))
+
+
+class TestMergingContacts(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_name = os.path.join(parent_folder, "files/rsscan_verify_content.zip")
+        data = io.load(io.open_zip_file(file_name), brand="rsscan")
+        contour_dict = tracking.find_contours(data)
+        self.contacts = tracking.search_graph(tracking.create_graph(contour_dict), contour_dict)
+
+    def test_kdtree_gives_the_same_contacts(self):
+        import copy
+        # merging_contacts empties the contacts it merges, so each version gets its own copy
+        naive_contacts = tracking.merging_contacts(copy.deepcopy(self.contacts), version="naive")
+        kdtree_contacts = tracking.merging_contacts(copy.deepcopy(self.contacts), version="kdtree")
+        self.assertEqual(sorted(sorted(contact) for contact in naive_contacts),
+                         sorted(sorted(contact) for contact in kdtree_contacts))
+
+    def test_frame_interval_index(self):
+        # The second contact is close enough, the third one starts too long after the first one ended
+        center_list = [(10, 10), (12, 10), (11, 11)]
+        frame_ranges = [(0, 10), (14, 20), (15, 30)]
+        candidates = tracking.find_merge_candidates(center_list, frame_ranges, euclidean_distance=5)
+        pairs = sorted((index1, index2) for index1, index2, _ in candidates)
+        self.assertEqual(pairs, [(0, 1), (1, 0), (1, 2), (2, 1)])
+        naive_candidates = tracking.find_merge_candidates(center_list, frame_ranges, euclidean_distance=5,
+                                                          version="naive")
+        self.assertEqual(len(naive_candidates), 6)
+
+
+class TestLabelContours(TestCase):
+    def test_label_contours(self):
+        contours = [np.array([[[1, 1]], [[3, 1]], [[3, 2]], [[1, 2]]], dtype=np.int32),
+                    np.array([[[6, 0]]], dtype=np.int32)]
+        labels = tracking.label_contours(contours, shape=(4, 8))
+        self.assertEqual(labels.dtype, np.int32)
+        # The border of the contours is filled too
+        self.assertEqual(np.count_nonzero(labels == 1), 6)
+        self.assertEqual(labels[0, 6], 2)
+
+    def test_offset(self):
+        contours = [np.array([[[11, 21]], [[12, 21]]], dtype=np.int32)]
+        labels = tracking.label_contours(contours, shape=(2, 3), offset=(-10, -20))
+        self.assertTrue(np.array_equal(np.transpose(np.nonzero(labels)), [[1, 1], [1, 2]]))
+
+
+class TestFindContours(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_name = os.path.join(parent_folder, "files/rsscan_verify_content.zip")
+        self.data = io.load(io.open_zip_file(file_name), brand="rsscan")
+        self.contour_dict = tracking.find_contours(self.data, version="frames")
+
+    def assertSameContours(self, contour_dict):
+        self.assertEqual(sorted(contour_dict), sorted(self.contour_dict))
+        for frame, contours in self.contour_dict.iteritems():
+            self.assertEqual(len(contour_dict[frame]), len(contours))
+            for contour1, contour2 in zip(contour_dict[frame], contours):
+                self.assertTrue(np.array_equal(contour1, contour2))
+
+    def test_batch(self):
+        for workers in [1, 3]:
+            timings = {}
+            self.assertSameContours(tracking.find_contours(self.data, version="batch", workers=workers,
+                                                           timings=timings))
+            self.assertEqual(sorted(timings), ["binarize", "contours"])
+
+    def test_sparse(self):
+        from ...functions import sparse
+        self.assertSameContours(tracking.find_contours(sparse.SparseMeasurement.from_dense(self.data),
+                                                       version="batch", workers=2))
+
+    def test_binarize(self):
+        binary, active_frames = tracking.binarize(self.data)
+        self.assertEqual(binary.shape, (249, 63, 256))
+        self.assertTrue(np.array_equal(binary[100], (self.data[:, :, 100] > 0).T))
+        self.assertEqual(active_frames, sorted(self.contour_dict))
+
+
+class TestContourFeatures(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_name = os.path.join(parent_folder, "files/rsscan_verify_content.zip")
+        self.data = io.load(io.open_zip_file(file_name), brand="rsscan")
+        self.contour_dict = tracking.find_contours(self.data)
+        self.features = tracking.ContourFeatures(self.contour_dict)
+
+    def test_table(self):
+        number_of_contours = sum(len(contours) for contours in self.contour_dict.itervalues())
+        self.assertEqual(len(self.features), number_of_contours)
+        self.assertEqual(len(self.features.table), number_of_contours)
+        self.assertEqual(self.features.bounding_rect_calls, number_of_contours)
+        # Adding the same contours again shouldn't calculate anything
+        self.features.add(self.contour_dict)
+        self.assertEqual(self.features.bounding_rect_calls, number_of_contours)
+
+    def test_bounding_box(self):
+        for frame, contours in self.contour_dict.iteritems():
+            self.assertEqual(self.features.bounding_box({frame: contours}),
+                             utility.update_bounding_box({frame: contours}))
+
+    def test_tracking_gives_the_same_contacts(self):
+        features = tracking.ContourFeatures()
+        contacts = tracking.track_contours_graph(self.data, features=features)
+        self.assertTrue(len(features))
+        self.assertEqual(sorted(sorted(contact) for contact in contacts),
+                         sorted(sorted(contact) for contact in tracking.track_contours_graph(self.data)))
+
+
+class TestOnlineTracker(TestCase):
+    def create_frame(self, squares):
+        frame = np.zeros((30, 30), dtype=np.float32)
+        for x, y, size in squares:
+            frame[x:x + size, y:y + size] = 1.
+        return frame
+
+    def test_contacts_finish_after_the_gap(self):
+        tracker = tracking.OnlineTracker(gap=2, padding=1)
+        finished = []
+        # A square that's there for 3 frames, disappears for 1 frame and comes back for 2 more
+        for squares in [[(5, 5, 4)]] * 3 + [[]] + [[(5, 5, 4)]] * 2:
+            finished.append(tracker.push(self.create_frame(squares)))
+        self.assertEqual(finished, [[]] * 6)
+        # After two empty frames, it's done
+        self.assertEqual(tracker.push(self.create_frame([])), [])
+        contacts = tracker.push(self.create_frame([]))
+        self.assertEqual(len(contacts), 1)
+        self.assertEqual(sorted(contacts[0]), [0, 1, 2, 4, 5])
+        self.assertEqual(tracker.open_contacts, [])
+
+    def test_pieces_get_merged(self):
+        tracker = tracking.OnlineTracker(gap=2, padding=1)
+        # Two pieces of the same contact close to each other and one far away
+        for _ in xrange(3):
+            tracker.push(self.create_frame([(5, 5, 3), (5, 9, 3), (20, 20, 3)]))
+        contacts = tracker.finish()
+        self.assertEqual(len(contacts), 2)
+        self.assertEqual(sorted(len(contact[0]) for contact in contacts), [1, 2])
+
+    def test_single_frames_are_dropped(self):
+        tracker = tracking.OnlineTracker(gap=1, padding=1)
+        tracker.push(self.create_frame([(5, 5, 3)]))
+        self.assertEqual(tracker.push(self.create_frame([])), [])
+        self.assertEqual(tracker.finish(), [])
+
+
+class TestWindowedTracking(TestCase):
+    def setUp(self):
+        parent_folder = os.path.dirname(os.path.abspath(__file__))
+        file_name = os.path.join(parent_folder, "files/rsscan_verify_content.zip")
+        self.data = io.load(io.open_zip_file(file_name), brand="rsscan")
+        self.padded_data = np.zeros((258, 65, 249), dtype=np.float32)
+        self.padded_data[1:-1, 1:-1, :] = self.data
+
+    def frames(self, contacts):
+        return sorted((min(contact), max(contact), sum(len(contours) for contours in contact.itervalues()))
+                      for contact in contacts)
+
+    def test_stitching_gives_the_same_components(self):
+        components = tracking.track_contours(self.padded_data, engine="graph", merge=False)
+        window_components = []
+        for start in xrange(0, 249, 50):
+            window_start, window_stop = max(0, start - 5), min(249, start + 55)
+            for component in tracking.track_contours(self.padded_data[:, :, window_start:window_stop],
+                                                     engine="graph", merge=False):
+                window_components.append(dict((frame + window_start, contours)
+                                              for frame, contours in component.iteritems()))
+        self.assertEqual(self.frames(tracking.stitch_contacts(window_components)), self.frames(components))
+
+    def test_windowed_tracking(self):
+        from ...functions import sparse
+
+        contacts = tracking.track_contours(self.padded_data, engine="graph")
+        for data in [self.data, sparse.SparseMeasurement.from_dense(self.data)]:
+            features = tracking.ContourFeatures()
+            windowed_contacts = tracking.track_contours_windowed(data, window=50, overlap=5, padding=1,
+                                                                 engine="graph", features=features)
+            self.assertEqual(self.frames(windowed_contacts), self.frames(contacts))
+            self.assertEqual(len(features), sum(len(contours) for contact in contacts
+                                                for contours in contact.itervalues()))
+
+
+class TestStageCache(TestCase):
+    def setUp(self):
+        contour = np.array([[[0, 0]], [[2, 0]], [[2, 2]], [[0, 2]]], dtype=np.int32)
+        self.components = [{0: [contour], 1: [contour]}, {2: [contour]}]
+        self.features = tracking.ContourFeatures()
+
+    def test_least_recently_used_gets_dropped(self):
+        cache = tracking.StageCache(max_size=2)
+        cache.put("a", self.components, self.features)
+        cache.put("b", self.components, self.features)
+        cache.get("a")
+        cache.put("c", self.components, self.features)
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertEqual(cache.get("b"), (None, None))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_get_returns_copies(self):
+        cache = tracking.StageCache(max_size=2)
+        cache.put("a", self.components, self.features)
+        components, features = cache.get("a")
+        self.assertIs(features, self.features)
+        # Merging empties the components, which shouldn't affect the cached ones
+        components[0].clear()
+        components[1][2].append(None)
+        components, _ = cache.get("a")
+        self.assertEqual(sorted(components[0]), [0, 1])
+        self.assertEqual(len(components[1][2]), 1)
+
+    def test_results(self):
+        cache = tracking.StageCache(max_size=2)
+        self.assertIsNone(cache.results("a"))
+        cache.put("a", self.components, self.features)
+        signature = tracking.component_signature(self.components[0], self.features)
+        cache.results("a")[signature] = "contact"
+        self.assertEqual(cache.results("a"), {signature: "contact"})
+        self.assertNotEqual(tracking.component_signature(self.components[1], self.features), signature)
+        cache.set_results("a", {})
+        self.assertEqual(cache.results("a"), {})
+
+    def test_discard(self):
+        cache = tracking.StageCache(max_size=3)
+        for key in [("subject_0", "session_0", "measurement_0", "key"),
+                    ("subject_0", "session_0", "measurement_1", "key"),
+                    ("subject_0", "session_1", "measurement_0", "key")]:
+            cache.put(key, self.components, self.features)
+        cache.discard(("subject_0", "session_0", "measurement_0"))
+        self.assertEqual(list(cache.entries), [("subject_0", "session_0", "measurement_1", "key"),
+                                               ("subject_0", "session_1", "measurement_0", "key")])
+        cache.discard(("subject_0",))
+        self.assertEqual(len(cache), 0)
+
+
+class TestPackComponents(TestCase):
+    def test_pack_components(self):
+        data = np.zeros((258, 65, 249), dtype=np.float32)
+        file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files/rsscan_verify_content.zip")
+        data[1:-1, 1:-1, :] = io.load(io.open_zip_file(file_name), brand="rsscan")
+        components = tracking.track_contours(data, merge=False)
+        features = tracking.ContourFeatures()
+        unpacked_components = tracking.unpack_components(tracking.pack_components(components), features=features)
+        self.assertEqual(len(unpacked_components), len(components))
+        for component, unpacked_component in zip(components, unpacked_components):
+            self.assertEqual(sorted(component), sorted(unpacked_component))
+            for frame, contours in component.iteritems():
+                for contour, unpacked_contour in zip(contours, unpacked_component[frame]):
+                    self.assertTrue(np.array_equal(contour, unpacked_contour))
+        self.assertEqual(len(features), sum(len(contours) for component in components
+                                            for contours in component.itervalues()))
+        self.assertEqual(tracking.unpack_components(tracking.pack_components([])), [])
@@ -0,0 +1,40 @@
+from unittest import TestCase
+import numpy as np
+from ...functions import unionfind
+
+
+class TestDisjointSet(TestCase):
+    def setUp(self):
+        self.clusters = unionfind.DisjointSet(6)
+
+    def test_initial_state(self):
+        self.assertEqual(len(self.clusters), 6)
+        self.assertEqual(self.clusters.number_of_sets, 6)
+        self.assertEqual(self.clusters.groups(), [[0], [1], [2], [3], [4], [5]])
+
+    def test_union(self):
+        self.clusters.union(0, 3)
+        self.clusters.union(4, 3)
+        self.clusters.union(1, 5)
+        self.assertTrue(self.clusters.connected(0, 4))
+        self.assertFalse(self.clusters.connected(0, 1))
+        self.assertEqual(self.clusters.number_of_sets, 3)
+        self.assertEqual(self.clusters.groups(), [[0, 3, 4], [1, 5], [2]])
+
+    def test_union_same_cluster(self):
+        root = self.clusters.union(0, 1)
+        self.assertEqual(self.clusters.union(1, 0), root)
+        self.assertEqual(self.clusters.number_of_sets, 5)
+
+    def test_path_compression(self):
+        for node in xrange(1, 6):
+            self.clusters.union(node - 1, node)
+        root = self.clusters.find(5)
+        self.assertTrue(np.array_equal(self.clusters.roots(), [root] * 6))
+
+
+class TestAgglomerativeClustering(TestCase):
+    def test_agglomerative_clustering(self):
+        from ...functions import utility
+        data = [np.array([0.]), np.array([10.]), np.array([0.5]), np.array([10.5])]
+        self.assertEqual(utility.agglomerative_clustering(data, num_clusters=2), [0, 1, 0, 1])
@@ -186,25 +186,39 @@ class MeasurementWidget(QtGui.QWidget):
     def update_files_tree(self):
         self.files_tree.clear()
 
-        self.file_paths = io.get_file_paths(measurement_folder=self.model.measurement_folder)
-        for file_name, file_path in self.file_paths.iteritems():
-            file_path = self.file_paths[file_name]
-            root_item = QtGui.QTreeWidgetItem(self.files_tree)
+        # The index remembers the stat results and hashes, so rescans only have to hash changed files
+        cache_folder = settings.settings.cache_folder()
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+        index_file = os.path.join(cache_folder, "file_index.json")
+        measurement_folder = self.model.measurement_folder
+        self.file_entries = io.scan_folder(measurement_folder=measurement_folder, index_file=index_file)
+
+        # Only the files in the measurement folder itself can be added to the session
+        self.file_paths = {}
+        # Sorting on the path makes sure we've created a folder's item before its children
+        items = {}
+        for file_path, entry in sorted(self.file_entries.iteritems()):
+            if entry["folder"] == measurement_folder:
+                self.file_paths[entry["name"]] = file_path
+                root_item = QtGui.QTreeWidgetItem(self.files_tree)
+            else:
+                root_item = QtGui.QTreeWidgetItem(items[entry["folder"]])
+            items[file_path] = root_item
+
             # If its not a measurement, give it a directory icon
-            if not os.path.isfile(file_path):
+            if entry["is_dir"]:
                 root_item.setIcon(0, QtGui.QIcon(os.path.join(os.path.dirname(__file__),
                                                               "../images/folder.png")))
             else:
                 # Give it some paw as an icon
                 root_item.setIcon(0, QtGui.QIcon(os.path.join(os.path.dirname(__file__),
                                                               "../images/paw.png")))
-            root_item.setText(1, file_name)
-            file_size = os.path.getsize(file_path)
-            file_size = utility.humanize_bytes(bytes=file_size, precision=1)
+            root_item.setText(1, entry["name"])
+            file_size = utility.humanize_bytes(bytes=entry["size"], precision=1)
             root_item.setText(2, file_size)
             # This is one messed up format
-            creation_date = os.path.getctime(file_path)
-            creation_date = time.strftime("%Y-%m-%d", time.gmtime(creation_date))
+            creation_date = time.strftime("%Y-%m-%d", time.gmtime(entry["ctime"]))
             # DAMNIT Why can't I use a locale on this?
             root_item.setText(3, creation_date)
             root_item.setText(4, file_path)
@@ -243,31 +257,38 @@ class MeasurementWidget(QtGui.QWidget):
         # Initialize a progress bar
         progress = 0
         pub.sendMessage("update_progress", progress=progress)
-        # Calculate how much progress we make each step
-        total_work =  len(self.file_paths)
-        step_work = 100. / total_work
 
+        measurements = []
         for file_name, file_path in self.file_paths.iteritems():
             # Only load measurements, so skip directories
-            if not os.path.isfile(file_path):
+            entry = self.file_entries[file_path]
+            if entry["is_dir"]:
                 continue
 
-            date_time = time.strftime("%Y-%m-%d %H:%M", time.gmtime(os.path.getctime(file_path))).split(" ")
-            # Check if the brands and model have been changed or not
-            measurement = {"measurement_name": file_name,
-                           "file_path": file_path,
-                           "date": date_time[0],
-                           "time": date_time[1],
-                           "plate_id": plate_id,
-                           "frequency": frequency
-            }
-            self.model.create_measurement(measurement=measurement)
-            # Update the tree after a measurement has been created
-            self.get_measurements()
-            # Increment the progress
-            progress += step_work
-            pub.sendMessage("update_progress", progress=progress)
-
+            date_time = time.strftime("%Y-%m-%d %H:%M", time.gmtime(entry["ctime"])).split(" ")
+            # Every file inside a zip file is a measurement of its own
+            members = [None]
+            if file_path[-3:] == "zip":
+                members = io.get_zip_members(file_path)
+
+            for member in members:
+                measurement_name = file_name
+                if len(members) > 1:
+                    measurement_name = "{} - {}".format(file_name[:-4], member)
+                # Check if the brands and model have been changed or not
+                measurements.append({"measurement_name": measurement_name,
+                                     "file_path": file_path,
+                                     "member": member,
+                                     "date": date_time[0],
+                                     "time": date_time[1],
+                                     "plate_id": plate_id,
+                                     "frequency": frequency
+                })
+
+        # The model parses and tracks them in parallel and reports the progress per measurement
+        self.model.create_measurements(measurements=measurements)
+        # Update the tree after the measurements have been created
+        self.get_measurements()
 
         # When we're done, signal we've reached 100%
         progress = 100
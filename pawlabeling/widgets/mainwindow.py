@@ -1,6 +1,7 @@
 import sys
 import os
 import logging
+import multiprocessing
 from PySide import QtGui, QtCore
 from pubsub import pub
 # Set this right away, so its set for the whole application
@@ -162,6 +163,8 @@ class MainWindow(QtGui.QMainWindow):
         event.accept()
 
 def main():
+    # The measurements get imported by worker processes, which need this when we're frozen on Windows
+    multiprocessing.freeze_support()
     appGuid = 'F3FF80BA-BA05-4277-8063-82A6DB9245A2'
     app = QtSingleApplication(appGuid, sys.argv)
     if app.isRunning():
@@ -173,6 +176,8 @@ def main():
     window.show()
     window.raise_()
     app.exec_()
+    # Don't quit halfway through zipping a file
+    window.model.wait_for_zip_queue()
     # Remember to close the table when we're done
     settings.settings.table.close()
 
@@ -236,6 +236,12 @@ class ProcessingWidget(QtGui.QWidget):
         self.update_current_contact()
 
 
+    def track_session(self, event=None):
+        # Track the contacts of every measurement again, for instance after changing the thresholds
+        self.model.track_session()
+        self.update_current_contact()
+
+
     def store_status(self, event=None):
         self.model.store_contacts()
 
@@ -304,6 +310,16 @@ class ProcessingWidget(QtGui.QWidget):
                                                        connection=self.track_contacts
         )
 
+        self.track_session_action = gui.create_action(text="Track &Session",
+                                                      shortcut=QtGui.QKeySequence("CTRL+SHIFT+F"),
+                                                      icon=QtGui.QIcon(
+                                                          os.path.join(os.path.dirname(__file__),
+                                                                       "../images/edit_zoom.png")),
+                                                      tip="Track the contacts of all the measurements in the session",
+                                                      checkable=False,
+                                                      connection=self.track_session
+        )
+
         self.store_status_action = gui.create_action(text="&Store",
                                                      shortcut=QtGui.QKeySequence("CTRL+S"),
                                                      icon=QtGui.QIcon(
@@ -407,7 +423,7 @@ class ProcessingWidget(QtGui.QWidget):
 
         # TODO Not all actions are editable yet in the settings
         if settings.__human__:
-            self.actions = [self.store_status_action, self.track_contacts_action,
+            self.actions = [self.store_status_action, self.track_contacts_action, self.track_session_action,
                             "separator",
                             self.left_front_action, self.right_front_action,
                             "separator",
@@ -415,7 +431,7 @@ class ProcessingWidget(QtGui.QWidget):
                             "separator",
                             self.remove_label_action, self.invalid_contact_action, self.undo_label_action]
         else:
-                    self.actions = [self.store_status_action, self.track_contacts_action,
+                    self.actions = [self.store_status_action, self.track_contacts_action, self.track_session_action,
                         "separator",
                         self.left_front_action, self.left_hind_action,
                         self.right_front_action, self.right_hind_action,